@@ -60,9 +60,22 @@ using namespace __dfsan;
 
 #define MAX_LOCAL_BRANCH_COUNTER 128
 
+#define DEFAULT_TASK_CAPACITY 65536
+
+#define DEFAULT_COV_MAP_BITS 20
+
 static bool NestedSolving = false;
 static int TraceBounds = 0;
 static int ForceStdin = 0;
+static const char *TaintRanges = NULL;
+static const char *TaintMask = NULL;
+static const char *BranchFilter = NULL;
+static int BranchFilterDeny = 0;
+// events beyond the local counter are discarded anyway, don't send them
+static int BranchLimit = MAX_LOCAL_BRANCH_COUNTER + 1;
+static int RuntimeAstSize = 0;
+static int SamplePermille = 0;
+static int SampleFirst = 0;
 
 #undef alloc_printf
 #define alloc_printf(_str...) ({ \
@@ -172,9 +185,7 @@ static void handle_cond(pipe_msg &msg, my_mutator_t *my_mutator) {
   const branch_ctx_t ctx = my_mutator->cov_mgr->add_branch((void*)msg.addr,
       msg.id, msg.result != 0, msg.context, false, false);
 
-  branch_ctx_t neg_ctx = std::make_shared<rgd::BranchContext>();
-  *neg_ctx = *ctx;
-  neg_ctx->direction = !ctx->direction;
+  branch_ctx_t neg_ctx = my_mutator->cov_mgr->negate_branch(ctx);
 
   if (my_mutator->cov_mgr->is_branch_interesting(neg_ctx)) {
     // parse the uniont table AST to solving tasks
@@ -222,8 +233,9 @@ static void handle_gep(gep_msg &gmsg, pipe_msg &msg, my_mutator_t *my_mutator) {
     return;
   }
 
-  // add the tasks to the task manager, with a dummy context
-  branch_ctx_t ctx = std::make_shared<rgd::BranchContext>();
+  // add the tasks to the task manager, a GEP is not a branch, so its
+  // context carries no coverage
+  branch_ctx_t ctx = std::make_shared<rgd::SiteContext>();
   ctx->addr = (void*)msg.addr;
   ctx->direction = true;
   for (auto const& task_id : tasks) {
@@ -251,8 +263,55 @@ extern "C" my_mutator_t *afl_custom_init(afl_state *afl, unsigned int seed) {
   (void)(seed);
 
   struct stat st;
-  rgd::TaskManager *tmgr = new rgd::FIFOTaskManager();
-  rgd::CovManager *cmgr = new rgd::EdgeCovManager();
+  rgd::CovManager *cmgr = nullptr;
+  // coverage granularity: edge (default), bitmap, context, loop, or history
+  char *cov_env = getenv("SYMSAN_COV_MGR");
+  if (!cov_env || !strcmp(cov_env, "edge")) {
+    cmgr = new rgd::EdgeCovManager();
+  } else {
+    uint32_t map_bits = DEFAULT_COV_MAP_BITS;
+    uint32_t num_hashes = 1;
+    char *bits_env = getenv("SYMSAN_COV_MAP_BITS");
+    if (bits_env) map_bits = strtoul(bits_env, NULL, 0);
+    if (map_bits < 10 || map_bits > 32) {
+      FATAL("Invalid SYMSAN_COV_MAP_BITS %u\n", map_bits);
+    }
+    char *hashes_env = getenv("SYMSAN_COV_NUM_HASHES");
+    if (hashes_env) num_hashes = strtoul(hashes_env, NULL, 0);
+    if (!strcmp(cov_env, "bitmap")) {
+      // optionally persisted in and shared through a file
+      auto *bmgr = new rgd::BitmapEdgeCovManager(getenv("SYMSAN_COV_FILE"), map_bits);
+      if (!bmgr->is_valid()) {
+        PFATAL("Failed to map the coverage bitmap, SYMSAN_COV_FILE may have "
+               "been created with a different SYMSAN_COV_MAP_BITS");
+      }
+      cmgr = bmgr;
+    } else if (!strcmp(cov_env, "context")) {
+      cmgr = new rgd::ContextAwareCovManager(map_bits, num_hashes);
+    } else if (!strcmp(cov_env, "loop")) {
+      cmgr = new rgd::LoopAwareCovManager(map_bits, num_hashes);
+    } else if (!strcmp(cov_env, "history")) {
+      cmgr = new rgd::HistoryAwareCovManager(map_bits, num_hashes);
+    } else {
+      FATAL("Unknown SYMSAN_COV_MGR %s\n", cov_env);
+    }
+  }
+  rgd::TaskManager *tmgr = nullptr;
+  if (getenv("SYMSAN_FIFO_TASKS")) {
+    tmgr = new rgd::FIFOTaskManager();
+  } else {
+    size_t capacity = DEFAULT_TASK_CAPACITY;
+    char *cap_env = getenv("SYMSAN_TASK_CAPACITY");
+    if (cap_env) capacity = strtoull(cap_env, NULL, 0);
+    // weights: novelty,num_cons,ast_size,nested,cost
+    rgd::PriorityTaskManager::Weights w;
+    char *weights_env = getenv("SYMSAN_TASK_WEIGHTS");
+    if (weights_env && sscanf(weights_env, "%lf,%lf,%lf,%lf,%lf", &w.novelty,
+          &w.num_cons, &w.ast_size, &w.nested, &w.cost) != 5) {
+      FATAL("Invalid SYMSAN_TASK_WEIGHTS %s\n", weights_env);
+    }
+    tmgr = new rgd::PriorityTaskManager(cmgr, capacity, w);
+  }
   my_mutator_t *data = new my_mutator_t(afl, tmgr, cmgr);
   if (!data) {
     FATAL("afl_custom_init alloc");
@@ -260,8 +319,19 @@ extern "C" my_mutator_t *afl_custom_init(afl_state *afl, unsigned int seed) {
   }
   // always use the simpler i2s solver
   data->solvers.emplace_back(std::make_shared<rgd::I2SSolver>());
-  if (getenv("SYMSAN_USE_JIGSAW"))
-    data->solvers.emplace_back(std::make_shared<rgd::JITSolver>());
+  if (getenv("SYMSAN_USE_JIGSAW")) {
+    size_t cache_size = rgd::JITSolver::kDefaultCacheSize;
+    char *size_env = getenv("SYMSAN_JIT_CACHE_SIZE");
+    if (size_env) cache_size = strtoull(size_env, NULL, 0);
+    uint64_t jit_threshold = rgd::JITSolver::kDefaultJitThreshold;
+    char *threshold_env = getenv("SYMSAN_JIT_THRESHOLD");
+    if (threshold_env) jit_threshold = strtoull(threshold_env, NULL, 0);
+    uint32_t num_threads = 1;
+    char *threads_env = getenv("SYMSAN_GD_THREADS");
+    if (threads_env) num_threads = strtoul(threads_env, NULL, 0);
+    data->solvers.emplace_back(std::make_shared<rgd::JITSolver>(
+        getenv("SYMSAN_JIT_CACHE_DIR"), cache_size, jit_threshold, num_threads));
+  }
   if (getenv("SYMSAN_USE_Z3"))
     data->solvers.emplace_back(std::make_shared<rgd::Z3Solver>());
   // make nested solving optional too
@@ -276,6 +346,23 @@ extern "C" my_mutator_t *afl_custom_init(afl_state *afl, unsigned int seed) {
   if (getenv("SYMSAN_FORCE_STDIN")) {
     ForceStdin = 1;
   }
+  // only taint part of the input?
+  TaintRanges = getenv("SYMSAN_TAINT_RANGES");
+  TaintMask = getenv("SYMSAN_TAINT_MASK");
+  // only emit events of selected branches?
+  BranchFilter = getenv("SYMSAN_BRANCH_FILTER");
+  if (getenv("SYMSAN_BRANCH_FILTER_DENY")) {
+    BranchFilterDeny = 1;
+  }
+  char *limit_env = getenv("SYMSAN_BRANCH_LIMIT");
+  if (limit_env) BranchLimit = strtoul(limit_env, NULL, 0);
+  char *ast_env = getenv("SYMSAN_RUNTIME_AST_SIZE");
+  if (ast_env) RuntimeAstSize = strtoul(ast_env, NULL, 0);
+  // only trace a sample of the branches?
+  char *sample_env = getenv("SYMSAN_SAMPLE_PERMILLE");
+  if (sample_env) SamplePermille = strtoul(sample_env, NULL, 0);
+  char *first_env = getenv("SYMSAN_SAMPLE_FIRST");
+  if (first_env) SampleFirst = strtoul(first_env, NULL, 0);
 
   if (!(data->symsan_bin = getenv("SYMSAN_TARGET"))) {
     FATAL(
@@ -406,6 +493,15 @@ extern "C" u32 afl_custom_fuzz_count(my_mutator_t *data, const u8 *buf,
     symsan_set_debug(DEBUG);
     symsan_set_bounds_check(TraceBounds);
     symsan_set_force_stdin(ForceStdin);
+    if (TaintRanges) symsan_set_taint_ranges(TaintRanges);
+    if (TaintMask) symsan_set_taint_mask(TaintMask);
+    if (BranchFilter) symsan_set_branch_filter(BranchFilter, BranchFilterDeny);
+    symsan_set_branch_limit(BranchLimit);
+    symsan_set_max_ast_size(RuntimeAstSize);
+    if (symsan_set_sampling(SamplePermille, SampleFirst) != 0) {
+      FATAL("Invalid sampling settings");
+    }
+    symsan_set_memcmp_dedup(1);
   }
 
   // launch the symsan child process
@@ -433,7 +529,10 @@ extern "C" u32 afl_custom_fuzz_count(my_mutator_t *data, const u8 *buf,
   std::vector<symsan::input_t> inputs;
   inputs.push_back({buf, buf_size});
   data->parser->restart(inputs);
+  data->cov_mgr->new_execution();
   reset_global_caches(buf_size);
+  for (auto &solver : data->solvers)
+    solver->new_input(buf, buf_size);
 
   while (symsan_read_event(&msg, sizeof(msg), timeout) == sizeof(msg)) {
     // create solving tasks
@@ -466,6 +565,12 @@ extern "C" u32 afl_custom_fuzz_count(my_mutator_t *data, const u8 *buf,
         // flags = 0 means both operands are symbolic thus no content to read
         // if (!msg.flags)
         //  break;
+        if (msg.flags & F_MEMCMP_CACHED) {
+          // same content as sent before, resolve it by the hash
+          if (data->parser->record_memcmp_cached(msg.label, msg.id, msg.result) != 0)
+            WARNF("Unknown memcmp content hash: %x\n", msg.id);
+          break;
+        }
         msg_size = sizeof(memcmp_msg) + msg.result;
         mmsg = (memcmp_msg*)malloc(msg_size);
         if (symsan_read_event(mmsg, msg_size, 0) != msg_size) {
@@ -480,7 +585,7 @@ extern "C" u32 afl_custom_fuzz_count(my_mutator_t *data, const u8 *buf,
           break;
         }
         // save the content
-        data->parser->record_memcmp(msg.label, mmsg->content, msg.result);
+        data->parser->record_memcmp(msg.label, mmsg->content, msg.result, msg.id);
         free(mmsg);
         break;
       case fsize_type:
@@ -588,8 +693,13 @@ size_t afl_custom_fuzz(my_mutator_t *data, uint8_t *buf, size_t buf_size,
   size_t new_buf_size = 0;
   *out_buf = buf;
   auto &solver = data->solvers[data->cur_solver_index];
+  struct timeval start, end;
+  gettimeofday(&start, NULL);
   auto ret = solver->solve(data->cur_task, buf, buf_size,
       data->output_buf, new_buf_size);
+  gettimeofday(&end, NULL);
+  data->task_mgr->report_cost(data->cur_task, (end.tv_sec - start.tv_sec) * 1000000 +
+      (end.tv_usec - start.tv_usec));
   if (likely(ret == rgd::SOLVER_SAT)) {
     DEBUGF("task solved\n");
     data->cur_mutation_state = MUTATION_IN_VALIDATION;
@@ -116,18 +116,43 @@ static void __handle_gep(dfsan_label ptr_label, uptr ptr,
   }
 
   for (auto id : tasks) {
-    symsan::Z3ParserSolver::solution_t solutions;
-    auto status = __z3_parser->solve_task(id, 5000U, solutions);
+    // an enumeration task may produce multiple inputs
+    std::vector<symsan::Z3ParserSolver::solution_t> solutions;
+    __z3_parser->solve_task(id, 5000U, solutions);
+    for (auto &solution : solutions) {
+      generate_input(solution);
+    }
     if (solutions.size() != 0) {
       AOUT("gep solved\n");
-      generate_input(solutions);
     } else {
       AOUT("gep not solvable @%p\n", addr);
     }
-    solutions.clear();
   }
 }
 
+// extract the value of an option from TAINT_OPTIONS, or NULL if not set
+static char* get_option(const char *options, const char *name) {
+  if (!options) return NULL;
+  size_t len = strlen(name);
+  for (const char *p = strstr(options, name); p; p = strstr(p + 1, name)) {
+    // only match a whole option name
+    if (p != options && p[-1] != ':' && p[-1] != ' ') continue;
+    if (p[len] != '=') continue;
+    p += len + 1;
+    // options are separated by either ':' or ' '
+    return strndup(p, strcspn(p, ": "));
+  }
+  return NULL;
+}
+
+static int get_int_option(const char *options, const char *name, int dflt) {
+  char *value = get_option(options, name);
+  if (!value) return dflt;
+  int ret = atoi(value);
+  free(value);
+  return ret;
+}
+
 int main(int argc, char* const argv[]) {
 
   if (argc != 3) {
@@ -140,28 +165,15 @@ int main(int argc, char* const argv[]) {
 
   int is_stdin = 0;
   char *options = getenv("TAINT_OPTIONS");
-  if (options) {
-    // setup output dir
-    char *output = strstr(options, "output_dir=");
-    if (output) {
-      output += 11; // skip "output_dir="
-      char *end = strchr(output, ':'); // try ':' first, then ' '
-      if (end == NULL) end = strchr(output, ' ');
-      size_t n = end == NULL? strlen(output) : (size_t)(end - output);
-      __output_dir = strndup(output, n);
-    }
+  // setup output dir
+  char *output = get_option(options, "output_dir");
+  if (output) __output_dir = output;
 
-    // check if input is stdin
-    char *taint_file = strstr(options, "taint_file=");
-    if (taint_file) {
-      taint_file += strlen("taint_file="); // skip "taint_file="
-      char *end = strchr(taint_file, ':');
-      if (end == NULL) end = strchr(taint_file, ' ');
-      size_t n = end == NULL? strlen(taint_file) : (size_t)(end - taint_file);
-      if (n == 5 && !strncmp(taint_file, "stdin", 5))
-        is_stdin = 1;
-    }
-  }
+  // check if input is stdin
+  char *taint_file = get_option(options, "taint_file");
+  if (taint_file && !strcmp(taint_file, "stdin"))
+    is_stdin = 1;
+  free(taint_file);
 
   // load input file
   struct stat st;
@@ -201,6 +213,42 @@ int main(int argc, char* const argv[]) {
 
   symsan_set_debug(1);
   symsan_set_bounds_check(1);
+  symsan_set_memcmp_dedup(get_int_option(options, "dedup_memcmp", 1));
+
+  // forward the runtime options the launcher knows about
+  char *taint_ranges = get_option(options, "taint_ranges");
+  if (taint_ranges && symsan_set_taint_ranges(taint_ranges) != 0) {
+    fprintf(stderr, "Failed to set taint ranges\n");
+    exit(1);
+  }
+  free(taint_ranges);
+  char *taint_mask = get_option(options, "taint_mask");
+  if (taint_mask && symsan_set_taint_mask(taint_mask) != 0) {
+    fprintf(stderr, "Failed to set taint mask\n");
+    exit(1);
+  }
+  free(taint_mask);
+  char *branch_filter = get_option(options, "branch_filter");
+  if (branch_filter &&
+      symsan_set_branch_filter(branch_filter,
+          get_int_option(options, "branch_filter_deny", 0)) != 0) {
+    fprintf(stderr, "Failed to set branch filter\n");
+    exit(1);
+  }
+  free(branch_filter);
+  if (symsan_set_branch_limit(get_int_option(options, "branch_emit_limit", 0)) != 0) {
+    fprintf(stderr, "Failed to set branch limit\n");
+    exit(1);
+  }
+  if (symsan_set_max_ast_size(get_int_option(options, "max_ast_size", 0)) != 0) {
+    fprintf(stderr, "Failed to set max AST size\n");
+    exit(1);
+  }
+  if (symsan_set_sampling(get_int_option(options, "sample_permille", 0),
+                          get_int_option(options, "sample_first", 0)) != 0) {
+    fprintf(stderr, "Failed to set sampling\n");
+    exit(1);
+  }
 
   // launch the target
   int ret = symsan_run(input_fd);
@@ -221,6 +269,9 @@ int main(int argc, char* const argv[]) {
     fprintf(stderr, "Failed to restart parser\n");
     exit(1);
   }
+  int gep_enum_limit = get_int_option(options, "gep_enum_limit", 0);
+  if (gep_enum_limit > 0)
+    __z3_parser->set_index_enum_limit(gep_enum_limit);
 
   pipe_msg msg;
   gep_msg gmsg;
@@ -250,6 +301,12 @@ int main(int argc, char* const argv[]) {
         // flags = 0 means both operands are symbolic thus no content to read
         if (!msg.flags)
           break;
+        if (msg.flags & F_MEMCMP_CACHED) {
+          // same content as sent before, resolve it by the hash
+          if (__z3_parser->record_memcmp_cached(msg.label, msg.id, msg.result) != 0)
+            fprintf(stderr, "Unknown memcmp content hash: %x\n", msg.id);
+          break;
+        }
         msg_size = sizeof(memcmp_msg) + msg.result;
         mmsg = (memcmp_msg*)malloc(msg_size); // not freed until terminate
         if (symsan_read_event(mmsg, msg_size, 0) != msg_size) {
@@ -264,7 +321,7 @@ int main(int argc, char* const argv[]) {
           break;
         }
         // save the content
-        __z3_parser->record_memcmp(msg.label, mmsg->content, msg.result);
+        __z3_parser->record_memcmp(msg.label, mmsg->content, msg.result, msg.id);
         free(mmsg);
         break;
       case fsize_type:
@@ -274,6 +331,9 @@ int main(int argc, char* const argv[]) {
     }
   }
 
+  AOUT("unsat cores: %zu, pruned tasks: %lu\n",
+       __z3_parser->num_unsat_cores(), __z3_parser->num_core_hits());
+
   symsan_destroy();
   exit(0);
 }
@@ -48,6 +48,15 @@ struct symsan_config {
   int exit_on_memerror;
   int trace_file_size;
   int force_stdin;
+  char *taint_ranges;
+  char *taint_mask;
+  char *branch_filter;
+  int branch_filter_deny;
+  int branch_limit;
+  int max_ast_size;
+  int sample_permille;
+  int sample_first;
+  int memcmp_dedup;
 
   int dev_null_fd;
 
@@ -82,6 +91,15 @@ void* symsan_init(const char *symsan_bin, const size_t uniontable_size) {
   g_config.exit_on_memerror = 1;
   g_config.trace_file_size = 0;
   g_config.force_stdin = 0;
+  g_config.taint_ranges = NULL;
+  g_config.taint_mask = NULL;
+  g_config.branch_filter = NULL;
+  g_config.branch_filter_deny = 0;
+  g_config.branch_limit = 0;
+  g_config.max_ast_size = 0;
+  g_config.sample_permille = 0;
+  g_config.sample_first = 0;
+  g_config.memcmp_dedup = 0;
   g_config.dev_null_fd = -1;
   g_config.exit_status = 0;
   g_config.is_killed = 0;
@@ -208,6 +226,80 @@ int symsan_set_force_stdin(int enable) {
   return 0;
 }
 
+__attribute__((visibility("default")))
+int symsan_set_taint_ranges(const char *ranges) {
+  if (!ranges) {
+    return SYMSAN_INVALID_ARGS;
+  }
+  free(g_config.taint_ranges);
+  g_config.taint_ranges = strdup(ranges);
+  if (!g_config.taint_ranges) {
+    return SYMSAN_NO_MEMORY;
+  }
+  return 0;
+}
+
+__attribute__((visibility("default")))
+int symsan_set_taint_mask(const char *mask_file) {
+  if (!mask_file) {
+    return SYMSAN_INVALID_ARGS;
+  }
+  free(g_config.taint_mask);
+  g_config.taint_mask = strdup(mask_file);
+  if (!g_config.taint_mask) {
+    return SYMSAN_NO_MEMORY;
+  }
+  return 0;
+}
+
+__attribute__((visibility("default")))
+int symsan_set_branch_filter(const char *filter_file, int deny) {
+  if (!filter_file) {
+    return SYMSAN_INVALID_ARGS;
+  }
+  free(g_config.branch_filter);
+  g_config.branch_filter = strdup(filter_file);
+  if (!g_config.branch_filter) {
+    return SYMSAN_NO_MEMORY;
+  }
+  g_config.branch_filter_deny = !!deny;
+  return 0;
+}
+
+__attribute__((visibility("default")))
+int symsan_set_branch_limit(int limit) {
+  if (limit < 0) {
+    return SYMSAN_INVALID_ARGS;
+  }
+  g_config.branch_limit = limit;
+  return 0;
+}
+
+__attribute__((visibility("default")))
+int symsan_set_max_ast_size(int max_size) {
+  if (max_size < 0) {
+    return SYMSAN_INVALID_ARGS;
+  }
+  g_config.max_ast_size = max_size;
+  return 0;
+}
+
+__attribute__((visibility("default")))
+int symsan_set_sampling(int permille, int first_n) {
+  if (permille < 0 || permille > 1000 || first_n < 0) {
+    return SYMSAN_INVALID_ARGS;
+  }
+  g_config.sample_permille = permille;
+  g_config.sample_first = first_n;
+  return 0;
+}
+
+__attribute__((visibility("default")))
+int symsan_set_memcmp_dedup(int enable) {
+  g_config.memcmp_dedup = !!enable;
+  return 0;
+}
+
 __attribute__((visibility("default")))
 int symsan_run(int fd) {
   if (fd < 0) {
@@ -237,11 +329,21 @@ int symsan_run(int fd) {
 
   if (!g_config.symsan_env) {
     g_config.symsan_env = alloc_printf(
-        "taint_file=\"%s\":shm_fd=%d:pipe_fd=%d:debug=%d:trace_bounds=%d:exit_on_memerror=%d:trace_fsize=%d:force_stdin=%d",
+        "taint_file=\"%s\":shm_fd=%d:pipe_fd=%d:debug=%d:trace_bounds=%d:exit_on_memerror=%d:trace_fsize=%d:force_stdin=%d"
+        ":taint_ranges=\"%s\":taint_mask=\"%s\""
+        ":branch_filter=\"%s\":branch_filter_deny=%d:branch_emit_limit=%d"
+        ":max_ast_size=%d:sample_permille=%d:sample_first=%d"
+        ":dedup_memcmp=%d",
         g_config.input_file, g_config.shm_fd, g_config.pipefds[1],
         g_config.enable_debug, g_config.enable_bounds_check,
         g_config.exit_on_memerror, g_config.trace_file_size,
-        g_config.force_stdin);
+        g_config.force_stdin,
+        g_config.taint_ranges ? g_config.taint_ranges : "",
+        g_config.taint_mask ? g_config.taint_mask : "",
+        g_config.branch_filter ? g_config.branch_filter : "",
+        g_config.branch_filter_deny, g_config.branch_limit,
+        g_config.max_ast_size, g_config.sample_permille,
+        g_config.sample_first, g_config.memcmp_dedup);
     if (!g_config.symsan_env) {
       return SYMSAN_NO_MEMORY;
     }
@@ -376,6 +478,10 @@ void symsan_destroy() {
     free(g_config.input_file);
   }
 
+  free(g_config.taint_ranges);
+  free(g_config.taint_mask);
+  free(g_config.branch_filter);
+
   if (g_config.argv) {
     for (int i = 0; g_config.argv[i]; i++) {
       free(g_config.argv[i]);
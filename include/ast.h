@@ -170,6 +170,9 @@ namespace rgd {
       }
     }
 
+    // number of nodes allocated for the whole AST, excluding the dummy root
+    inline uint32_t tree_size() const { return root_->size() - 1; }
+
     inline uint32_t children_size() const {
       return (!!child0_) + (!!child1_);
     }
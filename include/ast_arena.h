@@ -0,0 +1,109 @@
+#pragma once
+
+#include <stdint.h>
+
+#include <memory>
+#include <unordered_map>
+#include <vector>
+
+#include "ast.h"
+
+namespace rgd {
+
+// unlike isEqualAst, which ignores the relational operator and is used to
+// share JIT'ed functions, interning requires the nodes to be identical,
+// including the labels, as some solvers (e.g., z3, i2s) consume them
+static bool isIdenticalAst(const AstNode& lhs, const AstNode& rhs) {
+  if (&lhs == &rhs) return true;
+  const uint32_t children_size = lhs.children_size();
+  if (children_size != rhs.children_size()) return false;
+  if (lhs.kind() != rhs.kind()) return false;
+  if (lhs.bits() != rhs.bits()) return false;
+  if (lhs.hash() != rhs.hash()) return false;
+  if (lhs.label() != rhs.label()) return false;
+  if (lhs.index() != rhs.index()) return false;
+  if (lhs.boolvalue() != rhs.boolvalue()) return false;
+  for (uint32_t i = 0; i < children_size; i++) {
+    if (!isIdenticalAst(lhs.children(i), rhs.children(i)))
+      return false;
+  }
+  return true;
+}
+
+// hash-consing arena for ASTs, so constraints parsed from different
+// branches and different inputs share the same canonical tree.
+// an entry is referenced by constraints, tasks and the JIT cache through
+// the shared_ptr, once the arena holds the only reference and the entry
+// has not been used for max_age epochs, it is evicted.
+class AstArena {
+public:
+  using node_t = std::shared_ptr<AstNode>;
+
+  AstArena(uint32_t max_age = 4) : max_age_(max_age), epoch_(0),
+    hits_(0), misses_(0), evicted_(0) {}
+
+  // return the canonical node that is identical to node
+  node_t intern(const node_t &node) {
+    if (node == nullptr) return nullptr;
+    auto &bucket = nodes_[node->hash()];
+    for (auto &e : bucket) {
+      if (e.node == node || isIdenticalAst(*e.node, *node)) {
+        e.epoch = epoch_;
+        hits_++;
+        return e.node;
+      }
+    }
+    bucket.push_back({node, epoch_});
+    misses_++;
+    return node;
+  }
+
+  // advance the epoch, typically when a new input is being processed,
+  // and evict the entries that are no longer in use
+  void next_epoch() {
+    epoch_++;
+    if (epoch_ < max_age_) return;
+    uint32_t threshold = epoch_ - max_age_;
+    for (auto itr = nodes_.begin(); itr != nodes_.end();) {
+      auto &bucket = itr->second;
+      for (size_t i = 0; i < bucket.size();) {
+        if (bucket[i].node.use_count() == 1 && bucket[i].epoch <= threshold) {
+          bucket[i] = std::move(bucket.back());
+          bucket.pop_back();
+          evicted_++;
+        } else {
+          i++;
+        }
+      }
+      if (bucket.empty()) itr = nodes_.erase(itr);
+      else itr++;
+    }
+  }
+
+  void clear() { nodes_.clear(); }
+
+  size_t size() const {
+    size_t n = 0;
+    for (auto const& [hash, bucket] : nodes_) n += bucket.size();
+    return n;
+  }
+
+  uint64_t hits() const { return hits_; }
+  uint64_t misses() const { return misses_; }
+  uint64_t evicted() const { return evicted_; }
+
+private:
+  struct entry_t {
+    node_t node;
+    uint32_t epoch; // last epoch the entry is used
+  };
+
+  const uint32_t max_age_;
+  uint32_t epoch_;
+  std::unordered_map<uint32_t, std::vector<entry_t>> nodes_; // hash -> nodes
+  uint64_t hits_;
+  uint64_t misses_;
+  uint64_t evicted_;
+};
+
+}; // namespace rgd
@@ -1,6 +1,13 @@
 #pragma once
 
+#include <errno.h>
+#include <fcntl.h>
 #include <stdint.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include <algorithm>
 #include <vector>
 #include <unordered_map>
 #include <memory>
@@ -9,10 +16,15 @@
 namespace rgd {
 
 struct BranchContext {
+  virtual ~BranchContext() {}
   void *addr;
   bool direction;
 };
 
+// a site without branch coverage (e.g., a symbolic GEP index), solving it
+// never covers a new branch by itself
+struct SiteContext : public BranchContext {};
+
 struct HybridBranchContext : public BranchContext {
   uint32_t id;
 };
@@ -42,6 +54,16 @@ public:
     add_branch(void *addr, uint32_t id, bool direction, uint32_t context, bool is_loop_header, bool is_loop_exit) = 0;
   virtual bool
     is_branch_interesting(const std::shared_ptr<BranchContext> context) = 0;
+  // return a new context of the same type, for the opposite direction
+  virtual std::shared_ptr<BranchContext>
+    negate_branch(const std::shared_ptr<BranchContext> context) {
+    auto neg = std::make_shared<BranchContext>();
+    neg->addr = context->addr;
+    neg->direction = !context->direction;
+    return neg;
+  }
+  // called before a new input is traced, to reset per-execution states
+  virtual void new_execution() {}
 };
 
 class EdgeCovManager : public CovManager {
@@ -65,7 +87,8 @@ public:
 
   bool is_branch_interesting(const std::shared_ptr<BranchContext> context) override {
     auto itr = branches.find(context->addr);
-    // assert(itr != branches.end());
+    // never seen (e.g., a gep site), so it's new
+    if (itr == branches.end()) return true;
     if (context->direction) {
       return itr->second.first == false;
     } else {
@@ -74,4 +97,276 @@ public:
   }
 };
 
-}; // namespace rgd
\ No newline at end of file
+static inline uint64_t cov_hash(uint64_t x) {
+  // splitmix64 finalizer
+  x ^= x >> 30;
+  x *= 0xbf58476d1ce4e5b9ULL;
+  x ^= x >> 27;
+  x *= 0x94d049bb133111ebULL;
+  x ^= x >> 31;
+  return x;
+}
+
+// a fixed-size bitmap indexed by hashed keys, each key sets num_hashes bits,
+// so the collision (false positive) rate can be traded for memory
+class HashedBitmap {
+public:
+  HashedBitmap(uint32_t map_bits = 20, uint32_t num_hashes = 1)
+    : mask_((1ULL << map_bits) - 1), num_hashes_(num_hashes ? num_hashes : 1),
+      bits_(((1ULL << map_bits) + 63) / 64, 0) {}
+
+  // return true if all the bits for the key are set
+  bool test(uint64_t key) const {
+    uint64_t h = cov_hash(key);
+    for (uint32_t i = 0; i < num_hashes_; i++) {
+      uint64_t idx = slot(h, i);
+      if (!(bits_[idx >> 6] & (1ULL << (idx & 63)))) return false;
+    }
+    return true;
+  }
+
+  // set the bits for the key, return true if the key is new
+  bool set(uint64_t key) {
+    uint64_t h = cov_hash(key);
+    bool is_new = false;
+    for (uint32_t i = 0; i < num_hashes_; i++) {
+      uint64_t idx = slot(h, i);
+      uint64_t bit = 1ULL << (idx & 63);
+      if (!(bits_[idx >> 6] & bit)) {
+        bits_[idx >> 6] |= bit;
+        is_new = true;
+      }
+    }
+    return is_new;
+  }
+
+private:
+  const uint64_t mask_;
+  const uint32_t num_hashes_;
+  std::vector<uint64_t> bits_;
+
+  // double hashing to derive the i-th slot
+  inline uint64_t slot(uint64_t h, uint32_t i) const {
+    return (h + i * ((h >> 32) | 1)) & mask_;
+  }
+};
+
+// base of the coverage managers on a hashed bitmap, Ctx is the type of
+// the branch context and key() decides the coverage granularity
+template <class Ctx>
+class BitmapCovManager : public CovManager {
+public:
+  BitmapCovManager(uint32_t map_bits, uint32_t num_hashes)
+    : map_(map_bits, num_hashes) {}
+
+  const std::shared_ptr<BranchContext>
+  add_branch(void *addr, uint32_t id, bool direction, uint32_t context, bool is_loop_header, bool is_loop_exit) override {
+    auto ctx = std::make_shared<Ctx>();
+    ctx->addr = addr;
+    ctx->direction = direction;
+    fill(*ctx, id, context, is_loop_header, is_loop_exit);
+    map_.set(key(*ctx));
+    return ctx;
+  }
+
+  bool is_branch_interesting(const std::shared_ptr<BranchContext> context) override {
+    auto ctx = std::dynamic_pointer_cast<Ctx>(context);
+    if (!ctx) {
+      // not from this manager (e.g., a gep site), fall back to the edge
+      Ctx tmp;
+      tmp.addr = context->addr;
+      tmp.direction = context->direction;
+      fill_default(tmp);
+      return !map_.test(key(tmp));
+    }
+    return !map_.test(key(*ctx));
+  }
+
+  std::shared_ptr<BranchContext>
+  negate_branch(const std::shared_ptr<BranchContext> context) override {
+    auto ctx = std::dynamic_pointer_cast<Ctx>(context);
+    if (!ctx) return CovManager::negate_branch(context);
+    auto neg = std::make_shared<Ctx>(*ctx);
+    neg->direction = !ctx->direction;
+    return neg;
+  }
+
+protected:
+  HashedBitmap map_;
+
+  static inline uint64_t edge_key(const BranchContext &ctx) {
+    return ((uint64_t)(uintptr_t)ctx.addr << 1) | (ctx.direction ? 1 : 0);
+  }
+
+  virtual void fill(Ctx &ctx, uint32_t id, uint32_t context, bool is_loop_header, bool is_loop_exit) = 0;
+  virtual void fill_default(Ctx &ctx) = 0;
+  virtual uint64_t key(const Ctx &ctx) const = 0;
+};
+
+// distinguish the same branch under different calling contexts
+class ContextAwareCovManager : public BitmapCovManager<ContextAwareBranchContext> {
+public:
+  ContextAwareCovManager(uint32_t map_bits = 20, uint32_t num_hashes = 1)
+    : BitmapCovManager(map_bits, num_hashes) {}
+
+protected:
+  void fill(ContextAwareBranchContext &ctx, uint32_t id, uint32_t context,
+            bool is_loop_header, bool is_loop_exit) override {
+    ctx.context = context;
+  }
+  void fill_default(ContextAwareBranchContext &ctx) override { ctx.context = 0; }
+  uint64_t key(const ContextAwareBranchContext &ctx) const override {
+    return cov_hash(edge_key(ctx)) ^ ctx.context;
+  }
+};
+
+// distinguish the same branch by how many times it has been executed
+// in the current execution, bucketized like AFL's hit counts
+class LoopAwareCovManager : public BitmapCovManager<LoopAwareBranchContext> {
+public:
+  LoopAwareCovManager(uint32_t map_bits = 20, uint32_t num_hashes = 1)
+    : BitmapCovManager(map_bits, num_hashes), counters_(kCounterSize, 0) {}
+
+  void new_execution() override {
+    std::fill(counters_.begin(), counters_.end(), 0);
+  }
+
+protected:
+  static const size_t kCounterSize = 1 << 16;
+  std::vector<uint16_t> counters_; // hashed addr -> hit count
+
+  static inline uint32_t bucket(uint32_t count) {
+    if (count <= 3) return count;
+    return 33 - __builtin_clz(count); // 4-7 => 4, 8-15 => 5, ...
+  }
+
+  void fill(LoopAwareBranchContext &ctx, uint32_t id, uint32_t context,
+            bool is_loop_header, bool is_loop_exit) override {
+    auto &c = counters_[cov_hash((uintptr_t)ctx.addr) & (kCounterSize - 1)];
+    if (c != UINT16_MAX) c++;
+    ctx.loop_counter = bucket(c);
+  }
+  void fill_default(LoopAwareBranchContext &ctx) override { ctx.loop_counter = 1; }
+  uint64_t key(const LoopAwareBranchContext &ctx) const override {
+    return cov_hash(edge_key(ctx)) ^ ((uint64_t)ctx.loop_counter << 32);
+  }
+};
+
+// distinguish the same branch by the last few branches leading to it
+class HistoryAwareCovManager : public BitmapCovManager<HistoryAwareBranchContext> {
+public:
+  HistoryAwareCovManager(uint32_t map_bits = 20, uint32_t num_hashes = 1)
+    : BitmapCovManager(map_bits, num_hashes), history_(0) {}
+
+  void new_execution() override { history_ = 0; }
+
+protected:
+  uint32_t history_; // 4 bits for each of the last 8 branches
+
+  void fill(HistoryAwareBranchContext &ctx, uint32_t id, uint32_t context,
+            bool is_loop_header, bool is_loop_exit) override {
+    ctx.history = history_;
+    history_ = (history_ << 4) | (cov_hash(edge_key(ctx)) & 0xf);
+  }
+  void fill_default(HistoryAwareBranchContext &ctx) override { ctx.history = 0; }
+  uint64_t key(const HistoryAwareBranchContext &ctx) const override {
+    return cov_hash(edge_key(ctx)) ^ ctx.history;
+  }
+};
+
+// edge coverage on a fixed-size bitmap, two bits (taken, not taken) per
+// hashed branch address.  if a file is given, the bitmap is mapped from it,
+// so the coverage persists across restarts and can be shared by multiple
+// instances, otherwise an anonymous mapping is used.  the file starts with
+// a small header recording map_bits, a file created with a different size
+// uses a different index mapping, so it is rejected
+class BitmapEdgeCovManager : public CovManager {
+public:
+  BitmapEdgeCovManager(const char *path = nullptr, uint32_t map_bits = 20)
+    : mask_((1ULL << map_bits) - 1), size_(((1ULL << map_bits) + 3) / 4),
+      base_(nullptr), mapped_size_(0), map_(nullptr) {
+    if (path) {
+      int fd = open(path, O_RDWR | O_CREAT, 0644);
+      if (fd < 0) return;
+      size_t file_size = kHeaderSize + size_;
+      struct stat st;
+      if (fstat(fd, &st) != 0 ||
+          (st.st_size == 0 && ftruncate(fd, file_size) != 0)) {
+        close(fd);
+        return;
+      }
+      if (st.st_size != 0 && (size_t)st.st_size != file_size) {
+        close(fd);
+        errno = EINVAL;
+        return;
+      }
+      void *m = mmap(nullptr, file_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+      close(fd);
+      if (m == MAP_FAILED) return;
+      auto *header = (file_header*)m;
+      // a new file, or one whose creator has not written the header yet
+      if (header->magic == 0 && header->map_bits == 0) {
+        header->map_bits = map_bits;
+        __atomic_store_n(&header->magic, kFileMagic, __ATOMIC_RELEASE);
+      } else if (header->magic != kFileMagic || header->map_bits != map_bits) {
+        munmap(m, file_size);
+        errno = EINVAL;
+        return;
+      }
+      base_ = (uint8_t*)m;
+      mapped_size_ = file_size;
+      map_ = base_ + kHeaderSize;
+    } else {
+      void *m = mmap(nullptr, size_, PROT_READ | PROT_WRITE,
+                     MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+      if (m == MAP_FAILED) return;
+      base_ = map_ = (uint8_t*)m;
+      mapped_size_ = size_;
+    }
+  }
+  ~BitmapEdgeCovManager() { if (base_) munmap(base_, mapped_size_); }
+
+  // false if the bitmap cannot be mapped
+  bool is_valid() const { return map_ != nullptr; }
+
+  const std::shared_ptr<BranchContext>
+  add_branch(void *addr, uint32_t id, bool direction, uint32_t context, bool is_loop_header, bool is_loop_exit) override {
+    auto ctx = std::make_shared<BranchContext>();
+    ctx->addr = addr;
+    ctx->direction = direction;
+    uint64_t idx;
+    uint8_t bit = slot(ctx, idx);
+    // other instances may update the same byte
+    if (!(map_[idx] & bit))
+      __atomic_fetch_or(&map_[idx], bit, __ATOMIC_RELAXED);
+    return ctx;
+  }
+
+  bool is_branch_interesting(const std::shared_ptr<BranchContext> context) override {
+    uint64_t idx;
+    uint8_t bit = slot(context, idx);
+    return (__atomic_load_n(&map_[idx], __ATOMIC_RELAXED) & bit) == 0;
+  }
+
+private:
+  struct file_header {
+    uint32_t magic;
+    uint32_t map_bits;
+  };
+  static const uint32_t kFileMagic = 0x53434f56; // "SCOV"
+  static const size_t kHeaderSize = 64;
+
+  const uint64_t mask_;
+  const size_t size_;
+  uint8_t *base_;
+  size_t mapped_size_;
+  uint8_t *map_;
+
+  inline uint8_t slot(const std::shared_ptr<BranchContext> &ctx, uint64_t &idx) const {
+    uint64_t s = cov_hash((uintptr_t)ctx->addr) & mask_;
+    idx = s >> 2;
+    return 1 << (((s & 3) << 1) | (ctx->direction ? 0 : 1));
+  }
+};
+
+}; // namespace rgd
@@ -42,6 +42,39 @@ int symsan_set_trace_file_size(int enable);
 /// @brief set the force stdin mode for the target binary
 int symsan_set_force_stdin(int enable);
 
+/// @brief only taint the given input ranges, other bytes get label 0
+/// @param ranges: comma separated "start-end" pairs, end exclusive
+int symsan_set_taint_ranges(const char *ranges);
+
+/// @brief only taint the input bytes whose byte in the mask file is non-zero
+/// @param mask_file: path to the mask file
+int symsan_set_taint_mask(const char *mask_file);
+
+/// @brief filter branch events by the cids and address ranges in a file,
+///        ranges are offsets from the load base of the executable, and
+///        the file is re-read by every run, so it can be updated in between
+/// @param filter_file: path to the filter file
+/// @param deny: use the file as a denylist instead of an allowlist
+int symsan_set_branch_filter(const char *filter_file, int deny);
+
+/// @brief cap the events emitted for the same branch id and calling context
+/// @param limit: max number of events, 0 for unlimited
+int symsan_set_branch_limit(int limit);
+
+/// @brief bound the AST size of labels, larger operands are concretized
+/// @param max_size: max number of AST nodes, 0 for unlimited
+int symsan_set_max_ast_size(int max_size);
+
+/// @brief only trace a sample of the branch events, for quick triage
+/// @param permille: per-mille of the events to emit, 0 to emit all
+/// @param first_n: only emit the first N distinct branches, 0 for all
+int symsan_set_sampling(int permille, int first_n);
+
+/// @brief only send the content of a memcmp once, repeated contents are
+///        referred to by their hash (F_MEMCMP_CACHED), the consumer must
+///        resolve them, e.g., with record_memcmp_cached
+int symsan_set_memcmp_dedup(int enable);
+
 /// @brief run the target binary with the input file descriptor
 /// @param fd: input file descriptor, only used if input is "stdin"
 /// @return < 0 on syscall error, > 0 on setup error, 0 on success
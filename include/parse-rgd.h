@@ -2,6 +2,7 @@
 
 #include "parse.h"
 
+#include "ast_arena.h"
 #include "task.h"
 #include "union_find.h"
 
@@ -52,6 +53,7 @@ private:
   std::vector<uint32_t> ast_size_cache; // label -> size of the AST
   std::vector<uint8_t> nested_cmp_cache; // label -> nested comparison
   std::unordered_map<dfsan_label, uint8_t> concretize_node; // label -> concretize node
+  AstArena ast_arena; // canonical ASTs, persist across restarts
 
   // dependencies tracking
   size_t input_size_; // record the whole input size
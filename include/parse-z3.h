@@ -24,11 +24,20 @@ public:
 
   int add_constraints(dfsan_label label, uint64_t result) override;
 
+  // when limit > 0, instead of creating one task per candidate index,
+  // parse_gep creates a single task that enumerates up to limit indices
+  // with the same solver, see Z3ParserSolver::solve_task
+  void set_index_enum_limit(uint32_t limit) { index_enum_limit_ = limit; }
+
 protected:
   z3::context &context_;
   const char* input_name_format;
   const char* atoi_name_format;
 
+  // enumeration tasks: task id -> the index expression to enumerate
+  uint32_t index_enum_limit_;
+  std::unordered_map<uint64_t, z3::expr> enum_tasks_;
+
 private:
   // fsize flag
   bool has_fsize;
@@ -95,7 +104,7 @@ class Z3ParserSolver : public Z3AstParser {
 public:
   Z3ParserSolver() = delete;
   Z3ParserSolver(void *base, size_t size, z3::context &context)
-      : Z3AstParser(base, size, context) {}
+      : Z3AstParser(base, size, context), core_hits_(0) {}
   ~Z3ParserSolver() {}
 
   struct solution_val {
@@ -117,10 +126,41 @@ public:
 
   using solution_t = std::vector<struct solution_val>;
   solving_status solve_task(uint64_t task_id, unsigned timeout, solution_t &solutions);
+  // same as above, but an index enumeration task may produce multiple
+  // solutions, one per distinct index value
+  solving_status solve_task(uint64_t task_id, unsigned timeout,
+                            std::vector<solution_t> &solutions);
+
+  // number of tasks whose nested constraints are pruned by a cached unsat core
+  uint64_t num_core_hits() const { return core_hits_; }
+  size_t num_unsat_cores() const { return unsat_cores_.size(); }
 
 private:
   void generate_solution(z3::model &m, solution_t &solutions);
 
+  // unsat cores of nested checks, each core is the target followed by the
+  // nested constraints that conflict with it; the exprs are kept alive so
+  // their ids remain valid
+  static const size_t kMaxUnsatCores = 4096;
+  // max number of times a conflicting nested constraint is dropped and
+  // the nested constraints are checked again
+  static const unsigned kMaxPruneRounds = 4;
+  using core_t = std::vector<z3::expr>;
+  std::vector<core_t> unsat_cores_;
+  std::unordered_map<unsigned, std::vector<size_t>> core_index_; // target id -> cores
+  uint64_t core_hits_;
+
+  // break the cores known to conflict with the target by dropping one
+  // nested constraint of each, return the number of dropped constraints
+  size_t prune_nested(z3_task_t &task, std::vector<z3::expr> &nested);
+  void save_core(z3::expr &target, std::vector<z3::expr> &nested,
+                 z3::expr_vector const& core,
+                 std::unordered_map<unsigned, size_t> &tracked);
+  // enumerate distinct values of index under the assertions of solver
+  size_t enumerate_index(z3::solver &solver, z3::expr &index, uint32_t limit,
+                         std::vector<solution_t> &solutions,
+                         z3::check_result &res);
+
 };
 
 };
\ No newline at end of file
@@ -40,6 +40,7 @@ public:
   virtual int restart(std::vector<input_t> &inputs) {
     (void)inputs;
     memcmp_cache_.clear();
+    memcmp_content_.clear();
     return 0;
   }
   /// @brief Parse a conditional branch
@@ -80,6 +81,24 @@ public:
     return 0;
   };
 
+  /// @brief Record a memcmp content sent with its hash (F_MEMCMP_CONTENT),
+  ///        so later messages can refer to it by the hash
+  int record_memcmp(dfsan_label label, uint8_t* buf, size_t size, uint32_t hash) {
+    memcmp_content_[hash].assign(buf, buf + size);
+    return record_memcmp(label, buf, size);
+  }
+
+  /// @brief Record a memcmp content only referred to by its hash
+  ///        (F_MEMCMP_CACHED)
+  /// @return 0 on success, -1 if the content has not been received
+  int record_memcmp_cached(dfsan_label label, uint32_t hash, size_t size) {
+    auto itr = memcmp_content_.find(hash);
+    if (itr == memcmp_content_.end() || itr->second.size() != size) {
+      return -1;
+    }
+    return record_memcmp(label, itr->second.data(), size);
+  }
+
   // use shared_ptr to auto-free task
   virtual std::shared_ptr<T> retrieve_task(uint64_t id) {
     auto it = tasks_.find(id);
@@ -110,6 +129,8 @@ protected:
   uint64_t prev_task_id_;
   std::unordered_map<uint64_t, std::shared_ptr<T>> tasks_;
   std::unordered_map<dfsan_label, std::unique_ptr<uint8_t[]>> memcmp_cache_;
+  // memcmp contents by hash, as sent by the current run
+  std::unordered_map<uint32_t, std::vector<uint8_t>> memcmp_content_;
 };
 
 }; // namespace symsan
@@ -11,6 +11,8 @@
 #include <memory>
 #include <atomic>
 
+class ThreadPool;
+
 namespace rgd {
 
 enum solver_result_t {
@@ -27,6 +29,9 @@ public:
                                 const uint8_t *in_buf, size_t in_size,
                                 uint8_t *out_buf, size_t &out_size) = 0;
   virtual void print_stats(int fd) = 0;
+  // called once per input before its tasks are solved, so solvers can
+  // build per-input states shared by all the tasks
+  virtual void new_input(const uint8_t *buf, size_t size) {}
 };
 
 class Z3Solver : public Solver {
@@ -52,19 +57,36 @@ private:
 
 class JITSolver : public Solver {
 public:
-  JITSolver();
+  static const size_t kDefaultCacheSize = 100000;
+  static const uint64_t kDefaultJitThreshold = 1000;
+  // if cache_dir is given, JIT'ed code is persisted and reused across runs,
+  // at most cache_size functions are kept in memory,
+  // constraints are interpreted until evaluated jit_threshold times (0 to
+  // always JIT), with num_threads > 1, each task is searched by num_threads
+  // workers in parallel, solve() can be called concurrently
+  JITSolver(const char *cache_dir = nullptr, size_t cache_size = kDefaultCacheSize,
+            uint64_t jit_threshold = kDefaultJitThreshold,
+            uint32_t num_threads = 1);
+  ~JITSolver();
   solver_result_t solve(std::shared_ptr<SearchTask> task,
                         const uint8_t *in_buf, size_t in_size,
                         uint8_t *out_buf, size_t &out_size) override;
   void print_stats(int fd) override;
 private:
+  const uint64_t jit_threshold;
+  const uint32_t num_threads;
+  std::unique_ptr<ThreadPool> pool;
   std::atomic_ulong uuid;
   std::atomic_ulong cache_hits;
   std::atomic_ulong cache_misses;
+  std::atomic_ulong cache_evictions;
+  std::atomic_ulong num_tasks;
   std::atomic_ulong num_timeout;
   std::atomic_ulong num_solved;
   std::atomic_ulong process_time;
   std::atomic_ulong jit_time;
+  std::atomic_ulong jit_batches;
+  std::atomic_ulong interp_hits;
   std::atomic_ulong solving_time;
 };
 
@@ -75,10 +97,40 @@ public:
                         const uint8_t *in_buf, size_t in_size,
                         uint8_t *out_buf, size_t &out_size) override;
   void print_stats(int fd) override {};
+  void new_input(const uint8_t *buf, size_t size) override;
 private:
+  // where a value is found in the input
+  struct i2s_loc_t {
+    uint32_t offset;
+    uint8_t size; // size of the window, or length of the text
+    uint8_t encoding;
+  };
+  struct i2s_locs_t {
+    std::vector<i2s_loc_t> locs;
+    bool poisoned = false; // found at too many locations, not used
+  };
+  using value_index_t = std::unordered_map<uint64_t, i2s_locs_t>;
+  // try the operands found anywhere in the input
+  bool try_location(std::shared_ptr<const Constraint> const& c,
+                    uint32_t comparison, i2s_loc_t const& loc,
+                    uint64_t expected, uint32_t s,
+                    const uint8_t *in_buf, size_t in_size,
+                    uint8_t *out_buf, size_t &out_size);
+  bool solve_with_index(std::shared_ptr<const Constraint> const& c,
+                        uint32_t comparison,
+                        const uint8_t *in_buf, size_t in_size,
+                        uint8_t *out_buf, size_t &out_size);
+  // solve the index-th constraint of the task alone
+  solver_result_t solve_constraint(std::shared_ptr<SearchTask> task, size_t index,
+                                   const uint8_t *in_buf, size_t in_size,
+                                   uint8_t *out_buf, size_t &out_size);
   uint64_t matches;
   uint64_t mismatches;
   std::bitset<rgd::LastOp> binop_mask;
+  // values of the 1, 2, 4, 8-byte windows of the current input
+  value_index_t raw_index[4];
+  // numbers in text of the current input
+  value_index_t text_index;
 };
 
 }; // namespace rgd
@@ -1,7 +1,10 @@
 #pragma once
 
 #include <stdint.h>
+#include <string.h>
 
+#include <algorithm>
+#include <atomic>
 #include <bitset>
 #include <cassert>
 #include <map>
@@ -18,19 +21,24 @@ namespace rgd {
 // JIT'ed function for each relational constraint
 typedef void(*test_fn_type)(uint64_t*);
 
+// interpreted program for constraints that are not hot enough to be JIT'ed
+class AstProgram;
+
 // the first two slots of the arguments for reseved for the left and right operands
 static const int RET_OFFSET = 2;
 
+// number of inputs evaluated by one call of a batched function, the
+// arguments of a batched call are laid out as [slot][lane]
+static const uint32_t BATCH_LANES = 16;
+
 struct Constraint {
   Constraint() = delete;
-  Constraint(int ast_size): fn(nullptr), const_num(0) {
+  Constraint(int ast_size): const_num(0) {
     ast = std::make_shared<AstNode>(ast_size);
   }
   Constraint(const Constraint&) = default; // XXX: okay to use default?
   const AstNode *get_root() const { return const_cast<const AstNode*>(ast.get()); }
 
-  // JIT'ed function for a comparison expression
-  test_fn_type fn;
   // the AST
   std::shared_ptr<AstNode> ast;
 
@@ -60,6 +68,14 @@ struct Constraint {
 };
 
 struct ConsMeta {
+  ConsMeta(): fn(nullptr), batch_fn(nullptr) {}
+  // JIT'ed function for the comparison expression, set by the solver per
+  // task, so concurrent tasks can share the constraint
+  test_fn_type fn;
+  // batched version of fn, nullptr if it cannot be vectorized
+  test_fn_type batch_fn;
+  // used instead of fn before the constraint is JIT'ed
+  std::shared_ptr<const AstProgram> prog;
   // per-constraint arg mapping, so we can share the constraints
   std::vector<std::pair<bool, uint64_t>> input_args;
   // per-constraint relational operator, so we can share the AST
@@ -69,12 +85,61 @@ struct ConsMeta {
   uint64_t op1, op2;
 };
 
+// a flat map keyed by input offset, backed by a vector sorted by the offset,
+// so it's compact and cache-friendly to iterate
+template <typename V>
+class OffsetMap {
+public:
+  using value_type = std::pair<uint32_t, V>;
+  using iterator = typename std::vector<value_type>::iterator;
+  using const_iterator = typename std::vector<value_type>::const_iterator;
+
+  iterator begin() { return data_.begin(); }
+  iterator end() { return data_.end(); }
+  const_iterator begin() const { return data_.begin(); }
+  const_iterator end() const { return data_.end(); }
+  bool empty() const { return data_.empty(); }
+  size_t size() const { return data_.size(); }
+  void clear() { data_.clear(); }
+  void reserve(size_t n) { data_.reserve(n); }
+
+  iterator find(uint32_t offset) {
+    auto itr = lower_bound(offset);
+    return (itr != data_.end() && itr->first == offset) ? itr : data_.end();
+  }
+  const_iterator find(uint32_t offset) const {
+    return const_cast<OffsetMap*>(this)->find(offset);
+  }
+
+  V& operator[](uint32_t offset) {
+    // values are mostly inserted in ascending order
+    if (data_.empty() || data_.back().first < offset) {
+      data_.emplace_back(offset, V());
+      return data_.back().second;
+    }
+    auto itr = lower_bound(offset);
+    if (itr != data_.end() && itr->first == offset) return itr->second;
+    return data_.emplace(itr, offset, V())->second;
+  }
+
+private:
+  std::vector<value_type> data_;
+
+  iterator lower_bound(uint32_t offset) {
+    return std::lower_bound(data_.begin(), data_.end(), offset,
+        [](const value_type &v, uint32_t o) { return v.first < o; });
+  }
+};
+
 struct SearchTask {
-  SearchTask(): scratch_args(nullptr), max_const_num(0),
+  SearchTask(): scratch_args(nullptr), batch_args(nullptr), max_const_num(0),
       stopped(false), attempts(0), solved(false), skip_next(false),
       base_task(nullptr) {}
   SearchTask(const SearchTask&) = delete;
-  ~SearchTask() { if (scratch_args) free(scratch_args); }
+  ~SearchTask() {
+    if (scratch_args) free(scratch_args);
+    if (batch_args) free(batch_args);
+  }
   bool has_finalized() const { return scratch_args != nullptr; }
 
   uint32_t num_exprs;
@@ -86,18 +151,24 @@ struct SearchTask {
   std::vector<std::unique_ptr<ConsMeta>> consmeta;
 
   // inputs as pairs of <offset (from the beginning of the input, and value>
+  // sorted by the offset, the position is the index in the global input array
   std::vector<std::pair<uint32_t, uint8_t>> inputs;
-  // shape information at each offset
-  std::unordered_map<uint32_t, uint32_t> shapes;
+  // shape information of each input, parallel to inputs
+  std::vector<uint32_t> shapes;
   // aggreated atoi info
-  std::unordered_map<uint32_t, std::tuple<uint32_t, uint32_t, uint32_t>> atoi_info;
+  OffsetMap<std::tuple<uint32_t, uint32_t, uint32_t>> atoi_info;
   // max number of constants in the input array
   uint32_t max_const_num;
-  // record constraints that use a certain input byte
-  std::unordered_map<uint32_t, std::vector<size_t>> cmap;
+  // record constraints that use a certain input byte, in CSR format:
+  // constraints using inputs[i] are cmap[cmap_start[i]] .. cmap[cmap_start[i+1]-1]
+  std::vector<uint32_t> cmap_start;
+  std::vector<uint32_t> cmap;
   // the input array used for all JIT'ed functions
   // all input bytes are extended to 64 bits
   uint64_t* scratch_args;
+  // same as scratch_args but for the batched functions, i.e., BATCH_LANES
+  // copies of each slot
+  uint64_t* batch_args;
 
   // intermediate states for the search
   std::vector<uint64_t> min_distances; // current best
@@ -107,12 +178,13 @@ struct SearchTask {
 
   // statistics
   uint64_t start; //start time
-  bool stopped;
+  // may be set by other threads to cancel the search
+  std::atomic<bool> stopped;
   int attempts;
 
   // solutions
   bool solved;
-  std::unordered_map<size_t, uint8_t> solution;
+  OffsetMap<uint8_t> solution;
 
   // base task
   std::shared_ptr<SearchTask> base_task;
@@ -121,34 +193,41 @@ struct SearchTask {
   void finalize() {
     // aggregate the contraints, map each input byte to a constraint to
     // an index in the "global" input array (i.e., the scratch_args)
-    std::unordered_map<uint32_t, uint32_t> sym_map;
-    uint32_t gidx = 0;
+    // first, collect all the input offsets, sorted and deduplicated,
+    // the position of an offset is its global index
+    std::vector<uint32_t> offsets;
+    for (auto const& c : constraints) {
+      for (auto const& [offset, lidx] : c->local_map)
+        offsets.push_back(offset);
+    }
+    std::sort(offsets.begin(), offsets.end());
+    offsets.erase(std::unique(offsets.begin(), offsets.end()), offsets.end());
+    const size_t num_inputs = offsets.size();
+    inputs.resize(num_inputs);
+    shapes.resize(num_inputs);
+    std::vector<bool> assigned(num_inputs, false);
+    cmap_start.assign(num_inputs + 1, 0);
+
     for (size_t i = 0; i < constraints.size(); i++) {
       std::unique_ptr<ConsMeta> cm = std::make_unique<ConsMeta>();
       cm->input_args = constraints[i]->input_args;
       cm->comparison = comparisons[i];
+      // skip memcmp constraints
+      bool in_cmap = cm->comparison != rgd::Memcmp && cm->comparison != rgd::MemcmpN;
       uint32_t last_offset = -1;
       uint32_t size = 0;
+      // local_map is sorted, so the search can resume from the last position
+      auto pos = offsets.begin();
       for (const auto& [offset, lidx] : constraints[i]->local_map) {
-        auto gitr = sym_map.find(offset);
-        if (gitr == sym_map.end()) {
-          gidx = inputs.size();
-          sym_map[offset] = gidx;
-          inputs.push_back(std::make_pair(offset, constraints[i]->inputs.at(offset)));
-          shapes[offset] = constraints[i]->shapes.at(offset);
-        } else {
-          gidx = gitr->second;
-        }
-        // record input to constraint mapping
-        // skip memcmp constraints
-        if (cm->comparison != rgd::Memcmp && cm->comparison != rgd::MemcmpN) {
-          auto slot = cmap.find(gidx);
-          if (slot != cmap.end()) {
-            slot->second.push_back(i);
-          } else {
-            cmap.emplace(std::make_pair(gidx, std::vector<size_t>{i}));
-          }
+        pos = std::lower_bound(pos, offsets.end(), offset);
+        uint32_t gidx = pos - offsets.begin();
+        if (!assigned[gidx]) {
+          assigned[gidx] = true;
+          inputs[gidx] = std::make_pair(offset, constraints[i]->inputs.at(offset));
+          shapes[gidx] = constraints[i]->shapes.at(offset);
         }
+        // count input to constraint mapping
+        if (in_cmap) cmap_start[gidx + 1]++;
         // save the mapping between the local index (i.e., where the JIT'ed
         // function is going to read the input from) and the global index
         // (i.e., where the current value corresponding to the input byte
@@ -169,14 +248,43 @@ struct SearchTask {
       // save the last set of consecutive input bytes
       cm->i2s_candidates.push_back({last_offset + 1 - size, size});
 
-      // process atoi
+      // update the number of required constants in the input array
+      if (max_const_num < constraints[i]->const_num)
+        max_const_num = constraints[i]->const_num;
+
+      // insert the constraint metadata
+      consmeta.push_back(std::move(cm));
+    }
+
+    // record input to constraint mapping
+    for (size_t g = 0; g < num_inputs; g++)
+      cmap_start[g + 1] += cmap_start[g];
+    cmap.resize(cmap_start[num_inputs]);
+    std::vector<uint32_t> fill(cmap_start.begin(), cmap_start.end() - 1);
+    for (size_t i = 0; i < constraints.size(); i++) {
+      if (comparisons[i] == rgd::Memcmp || comparisons[i] == rgd::MemcmpN)
+        continue;
+      auto pos = offsets.begin();
+      for (const auto& [offset, lidx] : constraints[i]->local_map) {
+        pos = std::lower_bound(pos, offsets.end(), offset);
+        cmap[fill[pos - offsets.begin()]++] = i;
+      }
+    }
+
+    // process atoi
+    for (size_t i = 0; i < constraints.size(); i++) {
       for (const auto& [offset, info] : constraints[i]->atoi_info) {
         // check dependencies
         uint32_t length = std::get<2>(info);
         for (auto j = 0; j < length; ++j) {
-          auto ditr = cmap.find(offset + j);
-          if (ditr != cmap.end()) {
-            fprintf(stderr, "atoi bytes (%d) used in other constraints\n", offset + j);
+          auto pos = std::lower_bound(offsets.begin(), offsets.end(), offset + j);
+          if (pos == offsets.end() || *pos != offset + j) continue;
+          uint32_t gidx = pos - offsets.begin();
+          for (auto k = cmap_start[gidx]; k < cmap_start[gidx + 1]; k++) {
+            if (cmap[k] != i) {
+              fprintf(stderr, "atoi bytes (%d) used in other constraints\n", offset + j);
+              break;
+            }
           }
         }
         auto itr = atoi_info.find(offset);
@@ -186,18 +294,44 @@ struct SearchTask {
         }
         atoi_info[offset] = info;
       }
+    }
 
-      // update the number of required constants in the input array
-      if (max_const_num < constraints[i]->const_num)
-        max_const_num = constraints[i]->const_num;
+    alloc_args();
+  }
 
-      // insert the constraint metadata
-      consmeta.push_back(std::move(cm));
-    }
+  // a copy of a finalized task with its own search states, the constraints
+  // are shared, so the copies can be searched in parallel
+  std::shared_ptr<SearchTask> fork() const {
+    auto task = std::make_shared<SearchTask>();
+    task->num_exprs = num_exprs;
+    task->constraints = constraints;
+    task->comparisons = comparisons;
+    for (auto const& cm : consmeta)
+      task->consmeta.push_back(std::make_unique<ConsMeta>(*cm));
+    task->inputs = inputs;
+    task->shapes = shapes;
+    task->atoi_info = atoi_info;
+    task->max_const_num = max_const_num;
+    task->cmap_start = cmap_start;
+    task->cmap = cmap;
+    task->start = start;
+    task->base_task = base_task;
+    task->alloc_args();
+    return task;
+  }
 
+  void alloc_args() {
     // allocate the input array, reserver 2 for comparison operands a,b
     scratch_args = (uint64_t*)aligned_alloc(sizeof(*scratch_args),
         (2 + inputs.size() + max_const_num + 1) * sizeof(*scratch_args));
+    size_t max_args = 0;
+    for (auto const& c : constraints)
+      max_args = std::max(max_args, c->input_args.size());
+    size_t batch_size = (RET_OFFSET + max_args) * BATCH_LANES * sizeof(*batch_args);
+    batch_args = (uint64_t*)aligned_alloc(BATCH_LANES * sizeof(*batch_args), batch_size);
+    // the vectorized functions always compute all lanes, don't let unused
+    // ones start from garbage
+    memset(batch_args, 0, batch_size);
     min_distances.resize(constraints.size(), 0);
     distances.resize(constraints.size(), 0);
     plus_distances.resize(constraints.size(), 0);
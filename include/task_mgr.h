@@ -1,9 +1,15 @@
 #pragma once
 
 #include "task.h"
+#include "cov.h"
+
+#include <math.h>
 
 #include <deque>
+#include <iterator>
 #include <memory>
+#include <set>
+#include <unordered_map>
 
 namespace rgd {
 
@@ -13,6 +19,10 @@ public:
   virtual bool add_task(std::shared_ptr<BranchContext> ctx, std::shared_ptr<SearchTask> task) = 0;
   virtual std::shared_ptr<SearchTask> get_next_task() = 0;
   virtual size_t get_num_tasks() = 0;
+  // feedback on how long (in us) it took to solve the last task
+  virtual void report_cost(std::shared_ptr<SearchTask> task, uint64_t cost) {
+    (void)task; (void)cost;
+  }
 };
 
 class FIFOTaskManager : public TaskManager {
@@ -38,4 +48,129 @@ private:
   std::deque<task_t> tasks;
 };
 
+// order tasks by a cheaply computed score, higher scores are solved first
+class PriorityTaskManager : public TaskManager {
+public:
+  struct Weights {
+    double novelty = 8.0;   // bonus if the target branch is not yet covered
+    double num_cons = 1.0;  // penalty per constraint
+    double ast_size = 0.5;  // penalty per log2 of total AST size
+    double nested = 2.0;    // penalty for nested tasks
+    double cost = 1.0;      // penalty per log2 of avg solving cost (us) at the branch
+  };
+
+  // capacity == 0 means unbounded
+  PriorityTaskManager(CovManager *cov_mgr, size_t capacity = 0)
+    : PriorityTaskManager(cov_mgr, capacity, Weights()) {}
+  PriorityTaskManager(CovManager *cov_mgr, size_t capacity, const Weights &weights)
+    : cov_mgr_(cov_mgr), capacity_(capacity), weights_(weights), seq_(0),
+      last_addr_(nullptr), num_evicted_(0) {}
+
+  bool add_task(std::shared_ptr<BranchContext> ctx, std::shared_ptr<SearchTask> task) override {
+    if (!task) return false;
+    bool novel = is_novel(ctx);
+    entry_t e = {score(ctx, task, novel), seq_++, novel, std::move(ctx), std::move(task)};
+    if (capacity_ && tasks.size() >= capacity_) {
+      // full, evict the lowest-priority task if the new one is better
+      auto lowest = tasks.begin();
+      if (!(*lowest < e)) {
+        num_evicted_++;
+        return false;
+      }
+      tasks.erase(lowest);
+      num_evicted_++;
+    }
+    tasks.insert(std::move(e));
+    return true;
+  }
+
+  std::shared_ptr<SearchTask> get_next_task() override {
+    while (!tasks.empty()) {
+      auto highest = std::prev(tasks.end());
+      entry_t e = *highest;
+      tasks.erase(highest);
+      // scores are computed at insertion, the target branch may have been
+      // covered (or the cost at the branch changed) since then, so re-score
+      // and put it back if it's no longer the best
+      bool novel = e.novel && is_novel(e.ctx);
+      double s = score(e.ctx, e.task, novel);
+      if (s < e.score) {
+        e.score = s;
+        e.novel = novel;
+        tasks.insert(std::move(e));
+        continue;
+      }
+      last_addr_ = e.ctx ? e.ctx->addr : nullptr;
+      last_task_ = e.task;
+      return e.task;
+    }
+    return nullptr;
+  }
+
+  size_t get_num_tasks() override {
+    return tasks.size();
+  }
+
+  void report_cost(std::shared_ptr<SearchTask> task, uint64_t cost) override {
+    if (task != last_task_.lock()) return;
+    auto &c = costs_[last_addr_];
+    // exponential moving average
+    c = c == 0 ? (double)cost : (c * 3 + (double)cost) / 4;
+  }
+
+  size_t get_num_evicted() const { return num_evicted_; }
+
+private:
+  struct entry_t {
+    double score;
+    uint64_t seq;
+    bool novel; // the novelty bonus is included in the score
+    std::shared_ptr<BranchContext> ctx;
+    task_t task;
+    // lower score first, for the same score, later tasks first, so the
+    // highest (last) entry is the earliest one with the highest score
+    bool operator<(const entry_t &other) const {
+      if (score != other.score) return score < other.score;
+      return seq > other.seq;
+    }
+  };
+
+  // whether solving the task would cover a new branch, sites that are not
+  // branches (e.g., GEP indices) never get the bonus
+  bool is_novel(const std::shared_ptr<BranchContext> &ctx) {
+    if (!ctx || !cov_mgr_ || dynamic_cast<SiteContext*>(ctx.get()))
+      return false;
+    return cov_mgr_->is_branch_interesting(ctx);
+  }
+
+  double score(const std::shared_ptr<BranchContext> &ctx, const task_t &task,
+               bool novel) {
+    double s = 0;
+    if (novel)
+      s += weights_.novelty;
+    uint64_t ast_size = 0;
+    for (auto const& c : task->constraints)
+      ast_size += c->get_root()->tree_size();
+    s -= weights_.num_cons * task->constraints.size();
+    s -= weights_.ast_size * log2(1.0 + ast_size);
+    if (task->base_task) s -= weights_.nested;
+    if (ctx) {
+      auto itr = costs_.find(ctx->addr);
+      if (itr != costs_.end())
+        s -= weights_.cost * log2(1.0 + itr->second);
+    }
+    return s;
+  }
+
+  CovManager *cov_mgr_;
+  const size_t capacity_;
+  const Weights weights_;
+  uint64_t seq_;
+  std::set<entry_t> tasks;
+  std::unordered_map<void*, double> costs_; // branch addr -> avg solving cost
+  void *last_addr_;
+  std::weak_ptr<SearchTask> last_task_;
+  size_t num_evicted_;
+};
+
 };  // namespace rgd
@@ -113,12 +113,15 @@ int RGDAstParser::restart(std::vector<symsan::input_t> &inputs) {
   inputs_cache = inputs;
   // clear caches
   memcmp_cache_.clear(); // inherited from ASTParser
+  memcmp_content_.clear();
   root_expr_cache.clear();
   constraint_cache.clear();
   ast_size_cache.clear();
   nested_cmp_cache.clear();
   concretize_node.clear();
   branch_to_inputs.clear();
+  // ASTs are not dropped, only the stale ones are evicted
+  ast_arena.next_epoch();
 
   // reset data-flow dependencies
   input_size_ = 0;
@@ -528,6 +531,8 @@ RGDAstParser::constraint_t RGDAstParser::parse_constraint(dfsan_label label) {
     if (!do_uta_rel(label, constraint->ast.get(), constraint, visited)) {
       return nullptr;
     }
+    // share the AST with identical constraints
+    constraint->ast = ast_arena.intern(constraint->ast);
     return constraint;
   } catch (std::bad_alloc &e) {
     WARNF("failed to allocate memory for constraint\n");
@@ -1608,6 +1613,7 @@ int RGDAstParser::parse_gep(dfsan_label ptr_label, uptr ptr,
     // again, in jigsaw, we don't care about actual cmp kind
     hash = rgd::xxhash(const_node->hash(), (rgd::Bool << 16) | 1, index_node->hash());
     cmp_node->set_hash(hash);
+    partial_constraint->ast = ast_arena.intern(partial_constraint->ast);
 
     // done parsing, add to cache
     constraint_cache.insert({index_label, partial_constraint});
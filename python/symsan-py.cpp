@@ -57,14 +57,29 @@ static PyObject* SymSanInit(PyObject *self, PyObject *args) {
 }
 
 static PyObject* SymSanConfig(PyObject *self, PyObject *args, PyObject *keywds) {
-  static const char *kwlist[] = {"input", "args", "debug", "bounds", NULL};
+  static const char *kwlist[] = {"input", "args", "debug", "bounds", "ranges", "mask",
+                                 "branch_filter", "filter_deny",
+                                 "branch_limit", "max_ast_size",
+                                 "sample", "sample_first", "dedup_memcmp", NULL};
   const char *input = NULL;
   PyObject *iargs = NULL;
   int debug = 0;
   int bounds = 0;
-
-  if (!PyArg_ParseTupleAndKeywords(args, keywds, "s|O!ii",
-      const_cast<char**>(kwlist), &input, &PyList_Type, &iargs, &debug, &bounds)) {
+  const char *ranges = NULL;
+  const char *mask = NULL;
+  const char *branch_filter = NULL;
+  int filter_deny = 0;
+  int branch_limit = 0;
+  int max_ast_size = 0;
+  int sample = 0;
+  int sample_first = 0;
+  int dedup_memcmp = 0;
+
+  if (!PyArg_ParseTupleAndKeywords(args, keywds, "s|O!iizzziiiiii",
+      const_cast<char**>(kwlist), &input, &PyList_Type, &iargs, &debug, &bounds,
+      &ranges, &mask, &branch_filter, &filter_deny,
+      &branch_limit, &max_ast_size, &sample, &sample_first,
+      &dedup_memcmp)) {
     return NULL;
   }
 
@@ -109,6 +124,39 @@ static PyObject* SymSanConfig(PyObject *self, PyObject *args, PyObject *keywds)
     return NULL;
   }
 
+  if (ranges != NULL && symsan_set_taint_ranges(ranges) != 0) {
+    PyErr_SetString(PyExc_ValueError, "invalid ranges");
+    return NULL;
+  }
+
+  if (mask != NULL && symsan_set_taint_mask(mask) != 0) {
+    PyErr_SetString(PyExc_ValueError, "invalid mask");
+    return NULL;
+  }
+
+  if (branch_filter != NULL &&
+      symsan_set_branch_filter(branch_filter, filter_deny) != 0) {
+    PyErr_SetString(PyExc_ValueError, "invalid branch filter");
+    return NULL;
+  }
+
+  if (symsan_set_branch_limit(branch_limit) != 0) {
+    PyErr_SetString(PyExc_ValueError, "invalid branch limit");
+    return NULL;
+  }
+
+  if (symsan_set_max_ast_size(max_ast_size) != 0) {
+    PyErr_SetString(PyExc_ValueError, "invalid max_ast_size");
+    return NULL;
+  }
+
+  if (symsan_set_sampling(sample, sample_first) != 0) {
+    PyErr_SetString(PyExc_ValueError, "invalid sampling");
+    return NULL;
+  }
+
+  symsan_set_memcmp_dedup(dedup_memcmp);
+
   Py_RETURN_NONE;
 }
 
@@ -335,8 +383,9 @@ static PyObject* RecordMemcmp(PyObject *self, PyObject *args) {
 
   dfsan_label label = 0;
   PyObject *buf = NULL;
+  PyObject *hash = NULL;
 
-  if (!PyArg_ParseTuple(args, "IS", &label, &buf)) {
+  if (!PyArg_ParseTuple(args, "IS|O!", &label, &buf, &PyLong_Type, &hash)) {
     return NULL;
   }
 
@@ -347,7 +396,22 @@ static PyObject* RecordMemcmp(PyObject *self, PyObject *args) {
     return NULL;
   }
 
-  if (__z3_parser->record_memcmp(label, (uint8_t*)data, size) != 0) {
+  int ret;
+  if (hash) {
+    unsigned long h = PyLong_AsUnsignedLong(hash);
+    if (h == (unsigned long)-1 && PyErr_Occurred()) {
+      return NULL;
+    }
+    if (h > UINT32_MAX) {
+      PyErr_SetString(PyExc_OverflowError, "memcmp content hash exceeds 32 bits");
+      return NULL;
+    }
+    // content sent with its hash, keep it for later references
+    ret = __z3_parser->record_memcmp(label, (uint8_t*)data, size, (uint32_t)h);
+  } else {
+    ret = __z3_parser->record_memcmp(label, (uint8_t*)data, size);
+  }
+  if (ret != 0) {
     PyErr_SetString(PyExc_RuntimeError, "failed to record memcmp");
     return NULL;
   }
@@ -355,6 +419,58 @@ static PyObject* RecordMemcmp(PyObject *self, PyObject *args) {
   Py_RETURN_NONE;
 }
 
+static PyObject* RecordMemcmpCached(PyObject *self, PyObject *args) {
+  if (__z3_parser == nullptr) {
+    PyErr_SetString(PyExc_RuntimeError, "parser not initialized");
+    return NULL;
+  }
+
+  dfsan_label label = 0;
+  uint32_t hash = 0;
+  Py_ssize_t size = 0;
+
+  if (!PyArg_ParseTuple(args, "IIn", &label, &hash, &size)) {
+    return NULL;
+  }
+
+  if (__z3_parser->record_memcmp_cached(label, hash, size) != 0) {
+    PyErr_SetString(PyExc_KeyError, "unknown memcmp content hash");
+    return NULL;
+  }
+
+  Py_RETURN_NONE;
+}
+
+static PyObject* SetGEPEnumLimit(PyObject *self, PyObject *args) {
+  if (__z3_parser == nullptr) {
+    PyErr_SetString(PyExc_RuntimeError, "parser not initialized");
+    return NULL;
+  }
+
+  uint32_t limit = 0;
+  if (!PyArg_ParseTuple(args, "I", &limit)) {
+    return NULL;
+  }
+
+  __z3_parser->set_index_enum_limit(limit);
+
+  Py_RETURN_NONE;
+}
+
+// convert a solution to a list of (id, offset, value) tuples
+static PyObject* SolutionToList(const symsan::Z3ParserSolver::solution_t &solution) {
+  PyObject *sols = PyList_New(solution.size());
+  for (size_t i = 0; i < solution.size(); i++) {
+    PyObject *sol = PyTuple_New(3);
+    auto val = solution[i];
+    PyTuple_SetItem(sol, 0, PyLong_FromUnsignedLong(val.id));
+    PyTuple_SetItem(sol, 1, PyLong_FromUnsignedLong(val.offset));
+    PyTuple_SetItem(sol, 2, PyLong_FromUnsignedLong(val.val));
+    PyList_SetItem(sols, i, sol);
+  }
+  return sols;
+}
+
 static PyObject* SolveTask(PyObject *self, PyObject *args) {
   if (__z3_parser == nullptr) {
     PyErr_SetString(PyExc_RuntimeError, "parser not initialized");
@@ -370,14 +486,32 @@ static PyObject* SolveTask(PyObject *self, PyObject *args) {
   symsan::Z3ParserSolver::solution_t solutions;
   int status = __z3_parser->solve_task(id, timeout, solutions);
 
+  PyObject *ret = PyTuple_New(2);
+  PyTuple_SetItem(ret, 0, PyLong_FromLong(status));
+  PyTuple_SetItem(ret, 1, SolutionToList(solutions));
+
+  return ret;
+}
+
+static PyObject* SolveTaskAll(PyObject *self, PyObject *args) {
+  if (__z3_parser == nullptr) {
+    PyErr_SetString(PyExc_RuntimeError, "parser not initialized");
+    return NULL;
+  }
+
+  uint64_t id = 0;
+  unsigned timeout = 5000;
+  if (!PyArg_ParseTuple(args, "K|I", &id, &timeout)) {
+    return NULL;
+  }
+
+  // an index enumeration task may produce one solution per index
+  std::vector<symsan::Z3ParserSolver::solution_t> solutions;
+  int status = __z3_parser->solve_task(id, timeout, solutions);
+
   PyObject *sols = PyList_New(solutions.size());
   for (size_t i = 0; i < solutions.size(); i++) {
-    PyObject *sol = PyTuple_New(3);
-    auto val = solutions[i];
-    PyTuple_SetItem(sol, 0, PyLong_FromUnsignedLong(val.id));
-    PyTuple_SetItem(sol, 1, PyLong_FromUnsignedLong(val.offset));
-    PyTuple_SetItem(sol, 2, PyLong_FromUnsignedLong(val.val));
-    PyList_SetItem(sols, i, sol);
+    PyList_SetItem(sols, i, SolutionToList(solutions[i]));
   }
 
   PyObject *ret = PyTuple_New(2);
@@ -399,7 +533,10 @@ static PyMethodDef SymSanMethods[] = {
   {"parse_gep", ParseGEP, METH_VARARGS, "parse trace_gep event into solving tasks"},
   {"add_constraint", AddConstraint, METH_VARARGS, "add a constraint"},
   {"record_memcmp", RecordMemcmp, METH_VARARGS, "record a memcmp event"},
+  {"record_memcmp_cached", RecordMemcmpCached, METH_VARARGS, "record a memcmp event by the hash of a previous content"},
+  {"set_gep_enum_limit", SetGEPEnumLimit, METH_VARARGS, "enumerate up to limit GEP indices in a single task, 0 to disable"},
   {"solve_task", SolveTask, METH_VARARGS, "solve a task"},
+  {"solve_task_all", SolveTaskAll, METH_VARARGS, "solve a task, return all solutions of an index enumeration task"},
   {NULL, NULL, 0, NULL}  /* Sentinel */
 };
 
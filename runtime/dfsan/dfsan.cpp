@@ -65,9 +65,20 @@ static int __current_saved_stack_index = 0;
 struct taint_file __dfsan::tainted;
 struct taint_socket __dfsan::tainted_socket;
 
+// selective tainting, bytes outside the ranges and the mask get label 0
+static const int kMaxTaintRanges = 64;
+static struct { off_t start, end; } __taint_ranges[kMaxTaintRanges];
+static int __num_taint_ranges = 0;
+static const char *__taint_mask = nullptr;
+static uptr __taint_mask_size = 0;
+
+// per-label AST size, saturated, 0 for labels not created by __taint_union
+static u16 *__label_ast_size = nullptr;
+static uint32_t __max_ast_size = 0;
+
 // Hash table
 static const uptr hashtable_size = (1ULL << 32);
-static const size_t hashtable_buckets = (1ULL << 20);
+static const size_t hashtable_buckets = (1ULL << 20); // initial, grows on demand
 static __taint::union_hashtable __union_table(hashtable_buckets);
 
 Flags __dfsan::flags_data;
@@ -162,6 +173,12 @@ dfsan_label_info* __dfsan::get_label_info(dfsan_label label) {
   return &__dfsan_label_info[label];
 }
 
+uint32_t __dfsan::get_label_ast_size(dfsan_label label) {
+  if (label == CONST_LABEL || __label_ast_size == nullptr) return 1;
+  uint32_t size = __label_ast_size[label];
+  return size ? size : 1; // input labels are a single Read node
+}
+
 static inline bool is_constant_label(dfsan_label label) {
   return label == CONST_LABEL;
 }
@@ -170,6 +187,23 @@ static inline bool is_kind_of_label(dfsan_label label, uint16_t kind) {
   return get_label_info(label)->op == kind;
 }
 
+// return the number of leading labels that equal label0 + i * step,
+// 8 labels are compared per iteration so the loop can be vectorized
+static inline uptr count_matching_labels(const dfsan_label *ls, uptr n,
+                                         dfsan_label label0, dfsan_label step) {
+  uptr i = 0;
+  for (; i + 8 <= n; i += 8) {
+    dfsan_label diff = 0;
+    for (uptr k = 0; k < 8; k++)
+      diff |= ls[i + k] ^ (label0 + (dfsan_label)(i + k) * step);
+    if (diff) break;
+  }
+  for (; i < n; i++) {
+    if (ls[i] != label0 + (dfsan_label)i * step) break;
+  }
+  return i;
+}
+
 static bool isZeroOrPowerOfTwo(uint16_t x) { return (x & (x - 1)) == 0; }
 
 static inline bool is_valid_op(uint16_t op) {
@@ -177,6 +211,24 @@ static inline bool is_valid_op(uint16_t op) {
   return op >= __dfsan::Add && op < __dfsan::LastOp || op == __dfsan::Not;
 }
 
+// keep the AST of the new label within max_ast_size, by concretizing the
+// larger operand, which is only possible when its concrete value is known;
+// return false if the label should not be created at all
+static bool bound_ast_size(dfsan_label &l1, dfsan_label &l2, uint16_t op) {
+  if (op == __dfsan::Load) return true; // l2 is the length
+  if (l1 == kInitializingLabel || l2 == kInitializingLabel) return true;
+  uint32_t s1 = get_label_ast_size(l1);
+  uint32_t s2 = get_label_ast_size(l2);
+  if (s1 + s2 + 1 <= __max_ast_size) return true;
+  // instrumented binary ops and comparisons pass both concrete operands
+  bool has_concrete = (op >= __dfsan::Add && op <= __dfsan::Xor) ||
+                      (op & 0xff) == __dfsan::ICmp;
+  if (!has_concrete) return false;
+  if (s1 >= s2) { l1 = CONST_LABEL; s1 = 1; }
+  else { l2 = CONST_LABEL; s2 = 1; }
+  return s1 + s2 + 1 <= __max_ast_size;
+}
+
 extern "C" SANITIZER_INTERFACE_ATTRIBUTE
 dfsan_label __taint_union(dfsan_label l1, dfsan_label l2, uint16_t op, uint16_t size,
                           uint64_t op1, uint64_t op2) {
@@ -184,6 +236,10 @@ dfsan_label __taint_union(dfsan_label l1, dfsan_label l2, uint16_t op, uint16_t
     AOUT("WARNING: invalid op %d\n", op);
     return 0;
   }
+  if (__max_ast_size && !bound_ast_size(l1, l2, op)) {
+    AOUT("AST too large: (%u, %u, %u)\n", l1, l2, op);
+    return 0;
+  }
   if (l1 > l2 && is_commutative(op)) {
     // needs to swap both labels and concretes
     Swap(l1, l2);
@@ -282,6 +338,12 @@ dfsan_label __taint_union(dfsan_label l1, dfsan_label l2, uint16_t op, uint16_t
   AOUT("%u = (%u, %u, %u, %u, %llu, %llu)\n", label, l1, l2, op, size, op1, op2);
 
   internal_memcpy(&__dfsan_label_info[label], &label_info, sizeof(dfsan_label_info));
+  if (__label_ast_size) {
+    uint32_t ast_size = 1;
+    if (op != __dfsan::Load)
+      ast_size += get_label_ast_size(l1) + get_label_ast_size(l2);
+    __label_ast_size[label] = Min(ast_size, (uint32_t)0xffff);
+  }
   __union_table.insert(&__dfsan_label_info[label], label);
   return label;
 }
@@ -296,18 +358,32 @@ dfsan_label __taint_union_load(const dfsan_label *ls, uptr n) {
   // assert(label0 <= l);
   if (label0 >= CONST_OFFSET) assert(get_label_info(label0)->size != 0);
 
-  // fast path 1: constant and bounds
-  if (is_constant_label(label0) || is_kind_of_label(label0, Alloca)) {
-    bool same = true;
-    for (uptr i = 1; i < n; i++) {
-      if (ls[i] == kInitializingLabel) return kInitializingLabel;
-      else if (ls[i] != label0) {
-        same = false;
-        break;
-      }
+  // fast path 0: prechecks on the shadow only, without the union table
+  uptr same = count_matching_labels(ls, n, label0, 0);
+  if (same == n) {
+    // all untainted
+    if (is_constant_label(label0)) return label0;
+  } else if (!is_constant_label(label0) &&
+             count_matching_labels(ls, n, label0, 1) == n) {
+    // consecutive labels, but lazily created input labels can skip
+    // offsets and be interleaved with derived labels, so every label
+    // has to be a raw input byte at the next offset
+    off_t offset = get_label_info(label0)->op1.i;
+    uptr i = 0;
+    for (; i < n; i++) {
+      dfsan_label_info *info = get_label_info(label0 + i);
+      if (info->op != 0 || info->op1.i != offset + (off_t)i) break;
+    }
+    if (i == n) {
+      AOUT("shape: label0: %d %d\n", label0, n);
+      return __taint_union(label0, (dfsan_label)n, Load, n * 8, 0, 0);
     }
-    if (same) return label0;
   }
+
+  // fast path 1: constant and bounds
+  if (same == n && is_kind_of_label(label0, Alloca)) return label0;
+  if (is_constant_label(label0) && ls[same] == kInitializingLabel)
+    return kInitializingLabel;
   AOUT("label0 = %d, n = %d, ls = %p\n", label0, n, ls);
 
   // shape
@@ -702,11 +778,28 @@ __taint_debug(dfsan_label op1, dfsan_label op2, int predicate,
   if (op1 == 0 && op2 == 0) return;
 }
 
+// match by (st_dev, st_ino), resolving the path is only needed
+// when the file cannot be stat'ed
+static bool match_taint_path(const char *filename) {
+  char path[PATH_MAX];
+  if (!realpath(filename, path)) return false;
+  return internal_strcmp(tainted.filename, path) == 0;
+}
+
+static inline bool match_taint_stat(const struct stat *st) {
+  return st->st_dev == tainted.dev && st->st_ino == tainted.ino;
+}
+
 SANITIZER_INTERFACE_ATTRIBUTE void
 taint_set_file(const char *filename, int fd) {
-  char path[PATH_MAX];
-  realpath(filename, path);
-  if (internal_strcmp(tainted.filename, path) == 0) {
+  if (tainted.filename[0] == '\0' || fd < 0) return;
+  struct stat st;
+  bool match;
+  if (tainted.has_id && fstat(fd, &st) == 0)
+    match = match_taint_stat(&st);
+  else
+    match = match_taint_path(filename);
+  if (match) {
     tainted.fd = fd;
     AOUT("fd:%d created\n", fd);
   }
@@ -714,14 +807,16 @@ taint_set_file(const char *filename, int fd) {
 
 SANITIZER_INTERFACE_ATTRIBUTE int
 is_taint_file(const char *filename) {
-  char path[PATH_MAX];
-  realpath(filename, path);
-  if (internal_strcmp(tainted.filename, path) == 0) {
-    tainted.is_utmp = 1;
-    return 1;
+  bool match = false;
+  if (tainted.filename[0] != '\0') {
+    struct stat st;
+    if (tainted.has_id && stat(filename, &st) == 0)
+      match = match_taint_stat(&st);
+    else
+      match = match_taint_path(filename);
   }
-  tainted.is_utmp = 0;
-  return 0;
+  tainted.is_utmp = match ? 1 : 0;
+  return match ? 1 : 0;
 }
 
 SANITIZER_INTERFACE_ATTRIBUTE off_t
@@ -745,6 +840,18 @@ taint_close_file(int fd) {
   }
 }
 
+SANITIZER_INTERFACE_ATTRIBUTE int
+is_taint_offset(off_t offset) {
+  if (__num_taint_ranges == 0 && __taint_mask == nullptr) return 1;
+  for (int i = 0; i < __num_taint_ranges; i++) {
+    if (offset >= __taint_ranges[i].start && offset < __taint_ranges[i].end)
+      return 1;
+  }
+  if (__taint_mask && offset >= 0 && (uptr)offset < __taint_mask_size)
+    return __taint_mask[offset] != 0;
+  return 0;
+}
+
 SANITIZER_INTERFACE_ATTRIBUTE int
 is_stdin_taint(void) {
   return tainted.is_stdin;
@@ -876,7 +983,11 @@ static void InitializeTaintFile() {
       Report("WARNING: failed to get to real path for taint file\n");
       return;
     }
-    stat(filename, &st);
+    if (stat(filename, &st) == 0) {
+      tainted.dev = st.st_dev;
+      tainted.ino = st.st_ino;
+      tainted.has_id = 1;
+    }
     tainted.size = st.st_size;
     tainted.is_stdin = 0;
     // map a copy
@@ -897,6 +1008,41 @@ static void InitializeTaintFile() {
   }
 }
 
+static void InitializeTaintRanges() {
+  const char *p = flags().taint_ranges;
+  while (*p) {
+    const char *end;
+    s64 start = internal_simple_strtoll(p, &end, 10);
+    if (end == p || *end != '-') {
+      Report("FATAL: invalid taint range %s\n", p);
+      Die();
+    }
+    p = end + 1;
+    s64 stop = internal_simple_strtoll(p, &end, 10);
+    if (end == p || (*end != ',' && *end != '\0') || stop < start) {
+      Report("FATAL: invalid taint range %s\n", p);
+      Die();
+    }
+    if (__num_taint_ranges == kMaxTaintRanges) {
+      Report("FATAL: too many taint ranges, at most %d\n", kMaxTaintRanges);
+      Die();
+    }
+    __taint_ranges[__num_taint_ranges].start = start;
+    __taint_ranges[__num_taint_ranges].end = stop;
+    __num_taint_ranges++;
+    p = *end ? end + 1 : end;
+  }
+
+  const char *mask = flags().taint_mask;
+  if (internal_strcmp(mask, "") != 0) {
+    __taint_mask = static_cast<char *>(MapFileToMemory(mask, &__taint_mask_size));
+    if (__taint_mask == nullptr) {
+      Printf("FATAL: failed to map taint mask file %s\n", mask);
+      Die();
+    }
+  }
+}
+
 static void InitializeTaintSocket() {
   const char *host = flags().taint_socket;
   internal_memset(tainted_socket.host, 0, sizeof(tainted_socket.host));
@@ -1027,6 +1173,13 @@ if (flags().shm_fd != -1) {
   internal_memset(&__dfsan_label_info[CONST_LABEL], 0, sizeof(dfsan_label_info));
   __dfsan_label_info[CONST_LABEL].size = 8;
 
+  // per-label AST size, only touched for labels that are used
+  __max_ast_size = flags().max_ast_size > 0 ? flags().max_ast_size : 0;
+  if (__max_ast_size) {
+    uptr n = uniontable_size / sizeof(dfsan_label_info);
+    __label_ast_size = (u16 *)MmapNoReserveOrDie(n * sizeof(u16), "ast size");
+  }
+
   // init hashtable allocator
   __taint::allocator_init(HashTableAddr(), HashTableAddr() + hashtable_size);
 
@@ -1045,6 +1198,8 @@ if (flags().shm_fd != -1) {
 
   InitializeInterceptors();
 
+  InitializeTaintRanges();
+
   InitializeTaintFile();
 
   InitializeTaintSocket();
@@ -61,6 +61,10 @@ static const size_t uniontable_size = 0xc00000000; // FIXME
 
 struct taint_file {
   char filename[PATH_MAX];
+  // identity of the file, resolved once so opens can be matched by fstat
+  uint64_t dev;
+  uint64_t ino;
+  uint8_t has_id;
   int fd;
   off_t offset;
   dfsan_label offset_label;
@@ -96,6 +100,7 @@ void taint_set_file(const char *filename, int fd);
 off_t taint_get_file(int fd);
 void taint_close_file(int fd);
 int is_taint_file(const char *filename);
+int is_taint_offset(off_t offset);
 int is_stdin_taint(void);
 void taint_set_offset_label(dfsan_label label);
 dfsan_label taint_get_offset_label();
@@ -135,8 +140,32 @@ inline void *app_for(const dfsan_label *l) {
   return (void *) ((((uptr) l) >> 2) | AppBaseAddr());
 }
 
+// scan the shadow a word at a time, untainted ranges are skipped 8 labels
+// (32 bytes) per iteration, which the compiler turns into vector ors;
+// return the index of the first non-zero label, or n if there is none
+inline uptr first_tainted_label(const dfsan_label *ls, uptr n) {
+  uptr i = 0;
+  for (; i + 8 <= n; i += 8) {
+    u64 w[4];
+    __builtin_memcpy(w, ls + i, sizeof(w));
+    if ((w[0] | w[1]) | (w[2] | w[3])) break;
+  }
+  for (; i < n; i++) {
+    if (ls[i] != 0) return i;
+  }
+  return n;
+}
+
+inline bool is_tainted_range(const void *addr, uptr size) {
+  return first_tainted_label(shadow_for(addr), size) != size;
+}
+
 dfsan_label_info* get_label_info(dfsan_label label);
 
+// approximate number of AST nodes of a label, as counted by the parsers,
+// only tracked when max_ast_size is set, otherwise always 1
+uint32_t get_label_ast_size(dfsan_label label);
+
 struct Flags {
 #define DFSAN_FLAG(Type, Name, DefaultValue, Description) Type Name;
 #include "dfsan_flags.inc"
@@ -237,6 +266,10 @@ enum pipe_msg_type {
 
 #define F_ADD_CONS  0x1
 
+// memcmp msg flags, the content hash is in the id field
+#define F_MEMCMP_CONTENT 0x1 // followed by a memcmp_msg with the content
+#define F_MEMCMP_CACHED  0x2 // same content as a previous msg with the hash
+
 #define F_MEMERR_UAF 0x1
 #define F_MEMERR_OLB 0x2
 #define F_MEMERR_OUB 0x4
@@ -65,10 +65,22 @@ static off_t current_stdin_offset = 0;
 
 static inline dfsan_label get_label_for(int fd, off_t offset) {
   // check if fd is stdin, if so, the label hasn't been pre-allocated
-  if (is_stdin_taint() || (fd ==0 && flags().force_stdin))
-    return dfsan_create_label(current_stdin_offset++);
+  if (is_stdin_taint() || (fd ==0 && flags().force_stdin)) {
+    off_t stdin_offset = current_stdin_offset++;
+    if (!is_taint_offset(stdin_offset)) return 0;
+    return dfsan_create_label(stdin_offset);
+  }
+  // bytes outside the selected ranges are not tainted
+  if (!is_taint_offset(offset)) return 0;
   // if fd is a tainted file, the label should have been pre-allocated
-  else return (offset + CONST_OFFSET);
+  return (offset + CONST_OFFSET);
+}
+
+// for sources whose labels are not pre-allocated, e.g., sockets
+static inline dfsan_label create_label_for(off_t offset) {
+  // bytes outside the selected ranges are not tainted
+  if (!is_taint_offset(offset)) return 0;
+  return dfsan_create_label(offset);
 }
 
 extern "C" SANITIZER_INTERFACE_ATTRIBUTE void
@@ -222,6 +234,7 @@ SANITIZER_INTERFACE_ATTRIBUTE char *__dfsw_strpbrk(const char *s,
 
 extern "C" SANITIZER_INTERFACE_ATTRIBUTE
 dfsan_label __taint_memcmp(const void *s1, const void *s2, size_t n) {
+  if (!is_tainted_range(s1, n) && !is_tainted_range(s2, n)) return 0;
   dfsan_label l1 = dfsan_read_label(s1, n);
   dfsan_label l2 = dfsan_read_label(s2, n);
   dfsan_label ret = dfsan_union(l1, l2, fmemcmp, n, (uint64_t)s1, (uint64_t)s2);
@@ -267,6 +280,7 @@ dfsan_label __taint_strcmp(const char *s1, const char *s2) {
   size_t n = strlen(s1) + 1; // including tailing '\0'
   if (dfsan_get_label(s1) != 0)
     n = strlen(s2) + 1; // including tailing '\0'
+  if (!is_tainted_range(s1, n) && !is_tainted_range(s2, n)) return 0;
   dfsan_label l1 = dfsan_read_label(s1, n);
   dfsan_label l2 = dfsan_read_label(s2, n);
   // ugly hack ...
@@ -310,6 +324,7 @@ dfsan_label __taint_strncmp(const char *s1, const char *s2, size_t n) {
     n = strlen(s1) + 1;
   if (dfsan_get_label(s2) == 0 && strlen(s2) < (n - 1))
     n = strlen(s2) + 1;
+  if (!is_tainted_range(s1, n) && !is_tainted_range(s2, n)) return 0;
   dfsan_label l1 = dfsan_read_label(s1, n);
   dfsan_label l2 = dfsan_read_label(s2, n);
   // ugly hack ...
@@ -371,11 +386,32 @@ __dfsw_strlen(const char *s, dfsan_label s_label, dfsan_label *ret_label) {
   return ret;
 }
 
-static void *dfsan_memcpy(void *dest, const void *src, size_t n) {
+// copy the labels of n bytes, untainted ranges are not written when the
+// destination is untainted too, so clean shadow pages are left untouched
+static void dfsan_copy_labels(void *dest, const void *src, size_t n) {
   dfsan_label *sdest = shadow_for(dest);
   const dfsan_label *ssrc = shadow_for(src);
-  // FIXME: check and avoid copying labels?
-  internal_memcpy((void *)sdest, (const void *)ssrc, n * sizeof(dfsan_label));
+  size_t i = 0;
+  while (i < n) {
+    size_t skip = first_tainted_label(ssrc + i, n - i);
+    if (skip != 0) {
+      // clear the destination only where it is tainted
+      size_t j = i + first_tainted_label(sdest + i, skip);
+      if (j < i + skip)
+        internal_memset(sdest + j, 0, (i + skip - j) * sizeof(dfsan_label));
+      i += skip;
+      if (i == n) break;
+    }
+    // copy up to the next untainted word
+    size_t end = i + 1;
+    while (end < n && ssrc[end] != 0) end++;
+    internal_memcpy(sdest + i, ssrc + i, (end - i) * sizeof(dfsan_label));
+    i = end;
+  }
+}
+
+static void *dfsan_memcpy(void *dest, const void *src, size_t n) {
+  dfsan_copy_labels(dest, src, n);
   return internal_memcpy(dest, src, n);
 }
 
@@ -710,7 +746,7 @@ char *__dfsw_stpcpy(char *dest, const char *src, dfsan_label dest_label,
   __taint_check_bounds(dest_label, (uptr)dest, 0, len);
   char *ret = stpcpy(dest, src);
   if (ret) {
-    internal_memcpy(shadow_for(dest), shadow_for(src), sizeof(dfsan_label) * len);
+    dfsan_copy_labels(dest, src, len);
   }
   *ret_label = dest_label;
   return ret;
@@ -723,8 +759,7 @@ char *__dfsw_strcpy(char *dest, const char *src, dfsan_label dst_label,
   __taint_check_bounds(dst_label, (uptr)dest, 0, len);
   char *ret = strcpy(dest, src);
   if (ret) {
-    internal_memcpy(shadow_for(dest), shadow_for(src),
-                    sizeof(dfsan_label) * len);
+    dfsan_copy_labels(dest, src, len);
   }
   *ret_label = dst_label;
   return ret;
@@ -1112,7 +1147,7 @@ SANITIZER_INTERFACE_ATTRIBUTE ssize_t __dfsw_recv(
     if (offset >= 0) {
       AOUT("recv: fd = %d, offset = %d, ret = %d\n", sockfd, offset, ret);
       for (ssize_t i = 0; i < ret; i++) {
-        dfsan_set_label(dfsan_create_label(offset + i), (char *)buf + i, 1);
+        dfsan_set_label(create_label_for(offset + i), (char *)buf + i, 1);
       }
       taint_update_socket_offset(sockfd, ret);
     } else {
@@ -1142,7 +1177,7 @@ SANITIZER_INTERFACE_ATTRIBUTE ssize_t __dfsw_recvfrom(
     off_t offset = taint_get_socket(sockfd);
     if (offset >= 0) {
       for (ssize_t i = 0; i < ret; i++) {
-        dfsan_set_label(dfsan_create_label(offset + i), (char *)buf + i, 1);
+        dfsan_set_label(create_label_for(offset + i), (char *)buf + i, 1);
       }
       taint_update_socket_offset(sockfd, ret);
     } else {
@@ -1172,7 +1207,7 @@ SANITIZER_INTERFACE_ATTRIBUTE ssize_t __dfsw_recvmsg(
           bytes_written < iov->iov_len ? bytes_written : iov->iov_len;
       if (offset >= 0) {
         for (size_t j = 0; j < iov_written; ++j) {
-          dfsan_set_label(dfsan_create_label(offset + j), (char *)iov->iov_base + j, 1);
+          dfsan_set_label(create_label_for(offset + j), (char *)iov->iov_base + j, 1);
         }
         taint_update_socket_offset(sockfd, iov_written);
         offset += iov_written;
@@ -1617,7 +1652,7 @@ __dfsw_fread(void *ptr, size_t size, size_t nmemb, FILE *stream,
       fwrite(ptr, size, nmemb, stream);
       // update taint
       for (size_t i = 0; i < size * nmemb; i++) {
-        dfsan_set_label(dfsan_create_label(offset + i), (char *)ptr + i, 1);
+        dfsan_set_label(create_label_for(offset + i), (char *)ptr + i, 1);
       }
       return nmemb; // directly return
     }
@@ -1664,7 +1699,7 @@ __dfsw_fread_unlocked(
       fwrite(ptr, size, nmemb, stream);
       // update taint
       for (size_t i = 0; i < size * nmemb; i++) {
-        dfsan_set_label(dfsan_create_label(offset + i), (char *)ptr + i, 1);
+        dfsan_set_label(create_label_for(offset + i), (char *)ptr + i, 1);
       }
       return nmemb; // directly return
     }
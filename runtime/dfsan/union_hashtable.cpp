@@ -1,46 +1,170 @@
+#include "sanitizer_common/sanitizer_common.h"
 #include "sanitizer_common/sanitizer_libc.h"
 #include "union_hashtable.h"
 #include "union_util.h"
 
 using namespace __taint;
 
+// the hashtable region is 4GB, the sum of all tables must fit in it
+static const uint64_t kMaxCapacity = (1ULL << 27);
+static const uint64_t kMaxProbes = 1024;
+// number of slots migrated by each insert
+static const uint64_t kMigrateChunk = 256;
+
+static inline union_hashtable_table *as_table(uptr p) {
+  return reinterpret_cast<union_hashtable_table*>(p);
+}
+
 union_hashtable::union_hashtable(uint64_t n) {
-  bucket_size = n;
-  bucket = reinterpret_cast<atomic_uintptr_t*>(
-      allocator_alloc(n * sizeof(atomic_uintptr_t)));
-  __sanitizer::internal_memset(bucket, 0, n * sizeof(atomic_uintptr_t));
+  labels = (dfsan_label_info *)__dfsan::UnionTableAddr();
+  atomic_store(&current, (uptr)alloc_table(n), memory_order_relaxed);
+  atomic_store(&resizing, 0, memory_order_relaxed);
+}
+
+union_hashtable::table_t *
+union_hashtable::alloc_table(uint64_t capacity) {
+  uptr size = sizeof(table_t) + capacity * sizeof(atomic_uint64_t);
+  auto t = reinterpret_cast<table_t*>(allocator_alloc(size));
+  // the allocator never reuses memory, so the slots are still zero pages,
+  // touching them here would commit the whole table
+  __sanitizer::internal_memset(t, 0, sizeof(table_t));
+  t->capacity = capacity;
+  t->slots = reinterpret_cast<atomic_uint64_t*>(t + 1);
+  return t;
 }
 
-uint32_t
-union_hashtable::hash(const dfsan_label_info &key) {
-  return key.hash & (bucket_size - 1);
+option
+union_hashtable::find(table_t *t, const dfsan_label_info &key) {
+  uint64_t mask = t->capacity - 1;
+  uint64_t index = key.hash & mask;
+  for (uint64_t i = 0; i < kMaxProbes && i < t->capacity; i++) {
+    uint64_t entry = atomic_load(&t->slots[index], memory_order_acquire);
+    if (entry == 0) break;
+    if ((uint32_t)(entry >> 32) == key.hash) {
+      dfsan_label label = (dfsan_label)entry;
+      if (labels[label] == key)
+        return some_dfsan_label(label);
+    }
+    index = (index + 1) & mask;
+  }
+  return none();
+}
+
+bool
+union_hashtable::put(table_t *t, uint64_t entry) {
+  uint64_t mask = t->capacity - 1;
+  uint64_t index = (entry >> 32) & mask;
+  for (uint64_t i = 0; i < kMaxProbes && i < t->capacity; i++) {
+    u64 curr = atomic_load(&t->slots[index], memory_order_relaxed);
+    if (curr == 0) {
+      // the label info has been written, publish it with the slot
+      if (atomic_compare_exchange_strong(&t->slots[index], &curr, entry,
+                                         memory_order_seq_cst)) {
+        atomic_fetch_add(&t->count, 1, memory_order_relaxed);
+        return true;
+      }
+      // when fail, curr will contain the new entry
+    }
+    if (curr == entry) return true; // already migrated
+    index = (index + 1) & mask;
+  }
+  return false;
+}
+
+void
+union_hashtable::put_current(table_t *t, uint64_t entry) {
+  // if the table is full, the label is still valid, just not deduplicated
+  if (UNLIKELY(!put(t, entry))) return;
+  // the table was replaced meanwhile, the slot may have been migrated already
+  table_t *c = as_table(atomic_load(&current, memory_order_seq_cst));
+  while (UNLIKELY(c != t)) {
+    t = c;
+    put(t, entry);
+    c = as_table(atomic_load(&current, memory_order_seq_cst));
+  }
+  if (UNLIKELY(atomic_load(&t->count, memory_order_relaxed) > t->capacity / 2))
+    grow(t);
+}
+
+void
+union_hashtable::grow(table_t *t) {
+  if (t->capacity >= kMaxCapacity) return;
+  // only one thread allocates the new table
+  u32 expected = 0;
+  if (!atomic_compare_exchange_strong(&resizing, &expected, 1,
+                                      memory_order_acquire))
+    return;
+  if (atomic_load(&current, memory_order_acquire) == (uptr)t) {
+    table_t *nt = alloc_table(t->capacity * 2);
+    atomic_store(&nt->prev, (uptr)t, memory_order_relaxed);
+    t->next = nt;
+    atomic_store(&current, (uptr)nt, memory_order_seq_cst);
+  }
+  atomic_store(&resizing, 0, memory_order_release);
+}
+
+void
+union_hashtable::migrate(table_t *from) {
+  uint64_t begin = atomic_fetch_add(&from->next_chunk, kMigrateChunk,
+                                    memory_order_relaxed);
+  if (begin >= from->capacity) return;
+  uint64_t end = __sanitizer::Min(begin + kMigrateChunk, from->capacity);
+  for (uint64_t i = begin; i < end; i++) {
+    uint64_t entry = atomic_load(&from->slots[i], memory_order_acquire);
+    if (entry != 0)
+      put_current(as_table(atomic_load(&current, memory_order_acquire)), entry);
+  }
+  uint64_t done = atomic_fetch_add(&from->migrated, end - begin,
+                                   memory_order_seq_cst) + (end - begin);
+  if (done == from->capacity) retire(from);
+}
+
+void
+union_hashtable::retire(table_t *t) {
+  // a migrated table is unlinked once all older tables are migrated too;
+  // as a thread migrating a chunk may be preempted, a newer table can
+  // finish first, then whoever finishes last does the unlinking.
+  // tables are never freed, so concurrent lookups remain safe
+  while (atomic_load(&t->prev, memory_order_seq_cst) == 0) {
+    table_t *n = t->next;
+    atomic_store(&n->prev, 0, memory_order_seq_cst);
+    if (atomic_load(&n->migrated, memory_order_seq_cst) != n->capacity)
+      break;
+    t = n;
+  }
 }
 
 void
 union_hashtable::insert(dfsan_label_info *key, dfsan_label entry) {
-  uint32_t index = hash(*key);
-  auto curr = (struct union_hashtable_entry *)
-      allocator_alloc(sizeof(struct union_hashtable_entry));
-  curr->key = key; curr->entry = entry;
-  uptr p = atomic_load(&bucket[index], memory_order_acquire);
-  while (true) {
-    curr->next = reinterpret_cast<struct union_hashtable_entry *>(p);
-    if (atomic_compare_exchange_strong(&bucket[index], &p, (uptr)curr,
-                                       memory_order_seq_cst))
-      break; // spin until succeed, when fail, p will contain the current head
+  table_t *t = as_table(atomic_load(&current, memory_order_acquire));
+  // help migrating the replaced tables
+  for (uptr p = atomic_load(&t->prev, memory_order_acquire); p != 0;
+       p = atomic_load(&as_table(p)->prev, memory_order_acquire)) {
+    table_t *prev = as_table(p);
+    if (atomic_load(&prev->next_chunk, memory_order_relaxed) < prev->capacity) {
+      migrate(prev);
+      break;
+    }
   }
+
+  uint64_t value = ((uint64_t)key->hash << 32) | entry;
+  put_current(t, value);
 }
 
 option
 union_hashtable::lookup(const dfsan_label_info &key) {
-  uint64_t index = hash(key);
-  uptr p = atomic_load(&bucket[index], memory_order_acquire);
-  auto curr = reinterpret_cast<struct union_hashtable_entry *>(p);
-  while (curr) {
-    if (*(curr->key) == key) {
-      return some_dfsan_label(curr->entry);
-    }
-    curr = curr->next; // no data race here
+  table_t *t = as_table(atomic_load(&current, memory_order_acquire));
+  option res = find(t, key);
+  if (res != none()) return res;
+  // entries of a replaced table are only guaranteed to be in the newer
+  // tables once the whole table is migrated
+  for (uptr p = atomic_load(&t->prev, memory_order_acquire); p != 0;
+       p = atomic_load(&as_table(p)->prev, memory_order_acquire)) {
+    table_t *prev = as_table(p);
+    if (atomic_load(&prev->migrated, memory_order_acquire) == prev->capacity)
+      continue;
+    res = find(prev, key);
+    if (res != none()) return res;
   }
-  return none();
+  return res;
 }
@@ -8,24 +8,55 @@
 #include "union_util.h"
 #include "dfsan.h"
 
+using __sanitizer::u32;
+using __sanitizer::u64;
+using __sanitizer::atomic_uint32_t;
+using __sanitizer::atomic_uint64_t;
 using __sanitizer::atomic_uintptr_t;
 using __sanitizer::atomic_load;
+using __sanitizer::atomic_store;
+using __sanitizer::atomic_fetch_add;
 using __sanitizer::atomic_compare_exchange_strong;
+using __sanitizer::memory_order_relaxed;
 using __sanitizer::memory_order_acquire;
+using __sanitizer::memory_order_release;
+using __sanitizer::memory_order_acq_rel;
 using __sanitizer::memory_order_seq_cst;
 
 namespace __taint {
 
-struct union_hashtable_entry {
-  dfsan_label_info *key;
-  dfsan_label entry;
-  struct union_hashtable_entry *next;
+// an open-addressing table, each slot holds a (hash << 32 | label) pair,
+// 0 means empty as the const label is never inserted;
+// the keys live in the union table and are only compared on hash match
+struct union_hashtable_table {
+  uint64_t capacity; // power of 2
+  atomic_uint64_t count;
+  // migration progress, once the table has been replaced by a larger one
+  atomic_uint64_t next_chunk;
+  atomic_uint64_t migrated;
+  // older table that is still being migrated, or 0
+  atomic_uintptr_t prev;
+  struct union_hashtable_table *next;
+  atomic_uint64_t *slots;
 };
 
+// lock-free, grows by allocating a table twice as large; entries of the
+// replaced tables are migrated incrementally by the following inserts and
+// lookups fall back to the replaced tables until their migration is done
 class union_hashtable {
-  atomic_uintptr_t *bucket;
-  uint64_t bucket_size;
-  uint32_t hash(const dfsan_label_info &key);
+  typedef struct union_hashtable_table table_t;
+
+  atomic_uintptr_t current;
+  atomic_uint32_t resizing;
+  dfsan_label_info *labels;
+
+  table_t *alloc_table(uint64_t capacity);
+  option find(table_t *t, const dfsan_label_info &key);
+  bool put(table_t *t, uint64_t entry);
+  void put_current(table_t *t, uint64_t entry);
+  void grow(table_t *t);
+  void migrate(table_t *from);
+  void retire(table_t *t);
 public:
   union_hashtable(uint64_t n);
   void insert(dfsan_label_info *key, dfsan_label value);
@@ -16,9 +16,13 @@
 
  */
 
+#include "sanitizer_common/sanitizer_allocator_internal.h"
 #include "sanitizer_common/sanitizer_common.h"
 #include "sanitizer_common/sanitizer_file.h"
+#include "sanitizer_common/sanitizer_hash.h"
+#include "sanitizer_common/sanitizer_mutex.h"
 #include "sanitizer_common/sanitizer_posix.h"
+#include "sanitizer_common/sanitizer_procmaps.h"
 #include "dfsan/dfsan.h"
 
 using namespace __dfsan;
@@ -30,6 +34,151 @@ static int __pipe_fd;
 // filter?
 SANITIZER_INTERFACE_ATTRIBUTE THREADLOCAL uint32_t __taint_trace_callstack;
 
+// branch filter, sorted cids and merged address ranges [start, end),
+// the ranges are offsets from the load base of the main executable, so
+// they stay valid across runs of a PIE binary
+struct addr_range {
+  uptr start;
+  uptr end;
+};
+static bool __filter_enabled;
+static bool __filter_deny;
+static uptr __filter_base;
+static InternalMmapVectorNoCtor<uint32_t> __filter_cids;
+static InternalMmapVectorNoCtor<addr_range> __filter_ranges;
+
+// per-(cid, context) emission counters, direct-mapped, so a colliding
+// branch simply restarts the count
+static const uptr kEmitCounterBits = 14;
+struct emit_counter {
+  uint32_t cid;
+  uint32_t context;
+  uint32_t count; // occurrences so far
+  uint8_t used;
+};
+static emit_counter __emit_counters[1 << kEmitCounterBits];
+static uint32_t __emit_limit;
+// sampling, per-mille of the occurrences to emit and max distinct branches
+static uint32_t __sample_permille;
+static uint32_t __sample_first;
+
+// the first sample_first distinct branches, open-addressed and insert-only,
+// kept at most half full, so sample_first is bounded by its capacity
+static const uptr kAdmittedBits = 16;
+static const uint32_t kMaxSampleFirst = 1U << (kAdmittedBits - 1);
+struct admitted_branch {
+  uint32_t cid;
+  uint32_t context;
+  uint8_t used;
+};
+static admitted_branch __admitted[1 << kAdmittedBits];
+static uint32_t __num_admitted;
+
+static bool __is_admitted(uint32_t cid, uint32_t context, uint32_t h) {
+  const uptr mask = (1 << kAdmittedBits) - 1;
+  for (uptr i = h >> (32 - kAdmittedBits);; i = (i + 1) & mask) {
+    admitted_branch &a = __admitted[i];
+    if (!a.used) {
+      if (__num_admitted >= __sample_first)
+        return false;
+      a.cid = cid;
+      a.context = context;
+      a.used = 1;
+      __num_admitted++;
+      return true;
+    }
+    if (a.cid == cid && a.context == context)
+      return true;
+  }
+}
+
+static bool __should_emit(uint32_t cid, uint32_t context) {
+  if (__emit_limit == 0 && __sample_permille == 0 && __sample_first == 0)
+    return true;
+
+  uint32_t h = ((cid * 0x9e3779b1U) ^ context) * 0x9e3779b1U;
+  if (__sample_first && !__is_admitted(cid, context, h))
+    return false;
+  emit_counter &c = __emit_counters[h >> (32 - kEmitCounterBits)];
+  if (!c.used || c.cid != cid || c.context != context) {
+    c.cid = cid;
+    c.context = context;
+    c.count = 0;
+    c.used = 1;
+  }
+  uint32_t n = c.count;
+  if (n < UINT32_MAX) c.count++;
+  if (__emit_limit && n >= __emit_limit)
+    return false;
+  // deterministic, so the same input yields the same events
+  if (__sample_permille && (h ^ (n * 0x85ebca6bU)) * 0xc2b2ae35U % 1000 >= __sample_permille)
+    return false;
+  return true;
+}
+
+// recently sent memcmp payloads, direct-mapped by content hash, a payload
+// identical to the one in its slot is only referenced by the hash
+static const uptr kMemcmpCacheBits = 8;
+struct memcmp_payload {
+  uint32_t hash;
+  uint32_t size;
+  uint8_t *content;
+};
+static memcmp_payload __memcmp_sent[1 << kMemcmpCacheBits];
+static StaticSpinMutex __memcmp_lock;
+static bool __dedup_memcmp;
+
+static uint32_t __payload_hash(const uint8_t *content, uint32_t size) {
+  MurMur2HashBuilder h(size);
+  uint32_t i = 0;
+  for (; i + 4 <= size; i += 4) {
+    uint32_t k;
+    internal_memcpy(&k, content + i, 4);
+    h.add(k);
+  }
+  uint32_t tail = 0;
+  for (uint32_t j = 0; i < size; i++, j += 8)
+    tail |= (uint32_t)content[i] << j;
+  h.add(tail);
+  return h.get();
+}
+
+// must hold __memcmp_lock until the message is written, so a reference
+// never arrives before the payload it refers to
+static bool __payload_sent_before(const uint8_t *content, uint32_t size,
+                                  uint32_t hash) {
+  memcmp_payload &p = __memcmp_sent[hash & ((1 << kMemcmpCacheBits) - 1)];
+  if (p.content && p.hash == hash && p.size == size &&
+      internal_memcmp(p.content, content, size) == 0)
+    return true;
+  if (p.content)
+    InternalFree(p.content);
+  p.content = (uint8_t *)InternalAlloc(size);
+  internal_memcpy(p.content, content, size);
+  p.hash = hash;
+  p.size = size;
+  return false;
+}
+
+static bool __branch_selected(uint32_t cid, void *addr) {
+  if (!__filter_enabled)
+    return true;
+
+  bool listed = false;
+  uptr i = InternalLowerBound(__filter_cids, cid);
+  if (i < __filter_cids.size() && __filter_cids[i] == cid) {
+    listed = true;
+  } else if (__filter_ranges.size()) {
+    // the last range starting at or before addr
+    uptr offset = (uptr)addr - __filter_base;
+    addr_range key = {offset + 1, 0};
+    i = InternalLowerBound(__filter_ranges, key,
+        [](const addr_range &a, const addr_range &b) { return a.start < b.start; });
+    listed = i > 0 && offset < __filter_ranges[i - 1].end;
+  }
+  return listed != __filter_deny;
+}
+
 static inline void __solve_cond(dfsan_label label, uint8_t result, uint8_t add_nested, uint32_t cid, void *addr) {
 
   if (__pipe_fd < 0)
@@ -62,6 +211,8 @@ __taint_trace_cmp(dfsan_label op1, dfsan_label op2, uint32_t size, uint32_t pred
     return;
 
   void *addr = __builtin_return_address(0);
+  if (!__branch_selected(cid, addr))
+    return;
 
   AOUT("solving cmp: %u %u %u %d %llu %llu 0x%x @%p\n",
        op1, op2, size, predicate, c1, c2, cid, addr);
@@ -69,6 +220,13 @@ __taint_trace_cmp(dfsan_label op1, dfsan_label op2, uint32_t size, uint32_t pred
   // save info to a union table slot
   uint8_t r = get_const_result(c1, c2, predicate);
   dfsan_label temp = dfsan_union(op1, op2, (predicate << 8) | ICmp, size, c1, c2);
+  // both operands are too large and have been concretized
+  if (temp == 0)
+    return;
+  // only count the events the consumers handle, UBI ones are just reported
+  if (temp != kInitializingLabel &&
+      !__should_emit(cid, __taint_trace_callstack))
+    return;
 
   // add nested only for matching cases
   __solve_cond(temp, r, r, cid, addr);
@@ -80,6 +238,11 @@ __taint_trace_cond(dfsan_label label, uint8_t r, uint32_t cid) {
     return;
 
   void *addr = __builtin_return_address(0);
+  if (!__branch_selected(cid, addr))
+    return;
+  if (label != kInitializingLabel &&
+      !__should_emit(cid, __taint_trace_callstack))
+    return;
 
   AOUT("solving cond: %u %u 0x%x 0x%x %p\n",
        label, r, __taint_trace_callstack, cid, addr);
@@ -161,17 +324,28 @@ __taint_trace_memcmp(dfsan_label label) {
   if (__pipe_fd < 0)
     return;
 
-  uint16_t has_content = 1;
+  uint16_t flags = F_MEMCMP_CONTENT;
   // if both operands are symbolic, skip sending the content
   if (info->l1 != CONST_LABEL && info->l2 != CONST_LABEL)
-    has_content = 0;
+    flags = 0;
+
+  const uint8_t *content = (const uint8_t *)info->op1.i; // concrete oprand is always in op1
+  uint32_t hash = 0;
+  bool dedup = __dedup_memcmp && flags && info->size > 0;
+  if (dedup) {
+    hash = __payload_hash(content, info->size);
+    __memcmp_lock.Lock();
+    if (__payload_sent_before(content, info->size, hash))
+      flags = F_MEMCMP_CACHED;
+  }
 
   pipe_msg msg = {
     .msg_type = memcmp_type,
-    .flags = has_content,
+    .flags = flags,
     .instance_id = __instance_id,
     .addr = (uptr)addr,
     .context = __taint_trace_callstack,
+    .id = hash,
     .label = label, // just in case
     .result = (uint64_t)info->size
   };
@@ -180,19 +354,21 @@ __taint_trace_memcmp(dfsan_label label) {
     Die();
   }
 
-  if (!has_content)
-    return;
-
-  size_t msg_size = sizeof(memcmp_msg) + info->size;
-  memcmp_msg *mmsg = (memcmp_msg*)__builtin_alloca(msg_size);
-  mmsg->label = label;
-  internal_memcpy(mmsg->content, (void*)info->op1.i, info->size); // concrete oprand is always in op1
+  if (flags == F_MEMCMP_CONTENT) {
+    size_t msg_size = sizeof(memcmp_msg) + info->size;
+    memcmp_msg *mmsg = (memcmp_msg*)__builtin_alloca(msg_size);
+    mmsg->label = label;
+    internal_memcpy(mmsg->content, content, info->size);
 
-  // FIXME: assuming single writer so msg will arrive in the same order
-  if (internal_write(__pipe_fd, mmsg, msg_size) < 0) {
-    Die();
+    // FIXME: assuming single writer so msg will arrive in the same order
+    if (internal_write(__pipe_fd, mmsg, msg_size) < 0) {
+      Die();
+    }
   }
 
+  if (dedup)
+    __memcmp_lock.Unlock();
+
   return;
 }
 
@@ -229,8 +405,105 @@ __taint_trace_memerr(dfsan_label ptr_label, uptr ptr, dfsan_label size_label,
   }
 }
 
+// parse a decimal or 0x-prefixed hex number, return p if there is none
+static const char *parse_filter_number(const char *p, u64 *v) {
+  const char *next = p;
+  if (p[0] == '0' && (p[1] == 'x' || p[1] == 'X') && IsHex(p[2])) {
+    next = p + 2;
+    *v = ParseHex(&next);
+  } else if (IsDecimal(*p)) {
+    *v = ParseDecimal(&next);
+  }
+  return next;
+}
+
+// the filter file lists cids (e.g., 0x1234) and address ranges relative
+// to the main executable (e.g., 0x1000-0x2000, end exclusive, as shown by
+// objdump), separated by whitespace or commas, and '#' starts a comment
+static void InitializeBranchFilter() {
+  const char *path = flags().branch_filter;
+  if (internal_strcmp(path, "") == 0)
+    return;
+
+  char *buf;
+  uptr buf_size, len;
+  if (!ReadFileToBuffer(path, &buf, &buf_size, &len)) {
+    Report("FATAL: failed to read branch filter %s\n", path);
+    Die();
+  }
+
+  __filter_cids.Initialize(0);
+  __filter_ranges.Initialize(0);
+  const char *p = buf, *end = buf + len;
+  while (p < end) {
+    if (*p == '#') {
+      while (p < end && *p != '\n') p++;
+      continue;
+    }
+    if (IsSpace(*p) || *p == ',') {
+      p++;
+      continue;
+    }
+    u64 v, stop;
+    const char *next = parse_filter_number(p, &v);
+    if (next == p) {
+      Report("FATAL: invalid branch filter entry at offset %zu\n", p - buf);
+      Die();
+    }
+    p = next;
+    if (p < end && *p == '-') {
+      next = parse_filter_number(p + 1, &stop);
+      if (next == p + 1 || stop < v) {
+        Report("FATAL: invalid branch filter range at offset %zu\n", p - buf);
+        Die();
+      }
+      __filter_ranges.push_back({(uptr)v, (uptr)stop});
+      p = next;
+    } else {
+      __filter_cids.push_back((uint32_t)v);
+    }
+  }
+  UnmapOrDie(buf, buf_size);
+
+  SortAndDedup(__filter_cids);
+  // merge overlapping ranges so a single lookup is enough
+  Sort(__filter_ranges.data(), __filter_ranges.size(),
+      [](const addr_range &a, const addr_range &b) { return a.start < b.start; });
+  uptr n = 0;
+  for (uptr i = 0; i < __filter_ranges.size(); i++) {
+    if (n > 0 && __filter_ranges[i].start <= __filter_ranges[n - 1].end) {
+      __filter_ranges[n - 1].end =
+          Max(__filter_ranges[n - 1].end, __filter_ranges[i].end);
+    } else {
+      __filter_ranges[n++] = __filter_ranges[i];
+    }
+  }
+  __filter_ranges.resize(n);
+
+  // the load bias of the main executable, 0 if it's not PIE
+  ListOfModules modules;
+  modules.init();
+  if (modules.size() > 0)
+    __filter_base = modules[0].base_address();
+
+  __filter_enabled = true;
+  __filter_deny = flags().branch_filter_deny;
+  AOUT("branch filter: %zu cids, %zu ranges, base %p, %s\n",
+       __filter_cids.size(), __filter_ranges.size(), (void*)__filter_base,
+       __filter_deny ? "deny" : "allow");
+}
+
 extern "C" void InitializeSolver() {
   __instance_id = flags().instance_id;
   __session_id = flags().session_id;
   __pipe_fd = flags().pipe_fd;
+  __emit_limit = flags().branch_emit_limit;
+  __sample_permille = flags().sample_permille;
+  __sample_first = flags().sample_first;
+  if (__sample_first > kMaxSampleFirst) {
+    Report("WARNING: sample_first is capped at %u\n", kMaxSampleFirst);
+    __sample_first = kMaxSampleFirst;
+  }
+  __dedup_memcmp = flags().dedup_memcmp;
+  InitializeBranchFilter();
 }
@@ -1,10 +1,15 @@
 #include "solver.h"
 
+#include "jigsaw/interp.h"
+
 #include "dfsan/dfsan.h"
 
 #include <math.h>
 #include <string.h>
 
+#include <unordered_map>
+#include <vector>
+
 using namespace rgd;
 
 #define DEBUG 0
@@ -211,18 +216,260 @@ I2SSolver::I2SSolver(): matches(0), mismatches(0) {
   binop_mask.set(rgd::AShr);
 }
 
+enum i2s_encoding_t {
+  I2S_LE,
+  I2S_BE,
+  I2S_DEC,
+  I2S_HEX,
+};
+
+// inputs larger than this are not indexed, the index takes a few hundred
+// bytes per input byte
+static const size_t kMaxIndexedInput = 1 << 16;
+// values found at more locations are too common to be useful
+static const size_t kMaxLocations = 8;
+
+static inline int hex_value(uint8_t c) {
+  if (c >= '0' && c <= '9') return c - '0';
+  c |= 0x20;
+  if (c >= 'a' && c <= 'f') return c - 'a' + 10;
+  return -1;
+}
+
+void I2SSolver::new_input(const uint8_t *buf, size_t size) {
+  auto add_location = [](value_index_t &index, uint64_t value,
+                         uint32_t offset, uint8_t size, uint8_t encoding) {
+    auto &entry = index[value];
+    if (entry.poisoned) return;
+    if (entry.locs.size() == kMaxLocations) {
+      entry.poisoned = true;
+      entry.locs.clear();
+      return;
+    }
+    entry.locs.push_back({offset, size, encoding});
+  };
+
+  for (auto &index : raw_index) index.clear();
+  text_index.clear();
+  if (size > kMaxIndexedInput) return;
+
+  for (size_t o = 0; o < size; o++) {
+    for (int k = 0; k < 4; k++) {
+      uint32_t s = 1U << k;
+      if (o + s > size) break;
+      uint64_t value = 0;
+      memcpy(&value, &buf[o], s);
+      add_location(raw_index[k], value, o, s, I2S_LE);
+      if (s > 1)
+        add_location(raw_index[k], SWAP64(value) >> (64 - s * 8), o, s, I2S_BE);
+    }
+    // decimal numbers, only from the first digit
+    if (buf[o] >= '0' && buf[o] <= '9' && (o == 0 || buf[o - 1] < '0' || buf[o - 1] > '9')) {
+      uint64_t value = 0;
+      size_t len = 0;
+      while (o + len < size && len < 19 && buf[o + len] >= '0' && buf[o + len] <= '9') {
+        value = value * 10 + (buf[o + len] - '0');
+        len++;
+      }
+      add_location(text_index, value, o, len, I2S_DEC);
+    }
+    // hex numbers with the 0x prefix
+    if (buf[o] == '0' && o + 2 < size && (buf[o + 1] | 0x20) == 'x' &&
+        hex_value(buf[o + 2]) >= 0) {
+      uint64_t value = 0;
+      size_t len = 0;
+      int v;
+      while (o + 2 + len < size && len < 16 && (v = hex_value(buf[o + 2 + len])) >= 0) {
+        value = (value << 4) | v;
+        len++;
+      }
+      add_location(text_index, value, o + 2, len, I2S_HEX);
+    }
+  }
+}
+
+bool I2SSolver::solve_with_index(std::shared_ptr<const Constraint> const& c,
+                                 uint32_t comparison,
+                                 const uint8_t *in_buf, size_t in_size,
+                                 uint8_t *out_buf, size_t &out_size) {
+  uint32_t s = c->get_root()->children(0).bits() / 8;
+  int k = s == 1 ? 0 : s == 2 ? 1 : s == 4 ? 2 : s == 8 ? 3 : -1;
+  // try op1 first, as the candidates do
+  for (int i = 0; i < 2; i++) {
+    bool rhs = i == 1;
+    uint64_t op = rhs ? c->op2 : c->op1;
+    uint64_t expected = get_i2s_value(comparison, rhs ? c->op1 : c->op2, rhs);
+    if (k >= 0) {
+      auto itr = raw_index[k].find(op);
+      if (itr != raw_index[k].end() && !itr->second.poisoned) {
+        for (auto const& loc : itr->second.locs) {
+          if (try_location(c, comparison, loc, expected, s, in_buf, in_size,
+                           out_buf, out_size))
+            return true;
+        }
+      }
+    }
+    auto itr = text_index.find(op);
+    if (itr != text_index.end() && !itr->second.poisoned) {
+      for (auto const& loc : itr->second.locs) {
+        if (try_location(c, comparison, loc, expected, s, in_buf, in_size,
+                         out_buf, out_size))
+          return true;
+      }
+    }
+  }
+  return false;
+}
+
+// check if the comparison holds on the concrete operands
+static bool check_comparison(uint32_t comp, uint64_t a, uint64_t b, uint32_t bits) {
+  int64_t sa = a, sb = b;
+  if (bits < 64) {
+    sa = (int64_t)(a << (64 - bits)) >> (64 - bits);
+    sb = (int64_t)(b << (64 - bits)) >> (64 - bits);
+  }
+  switch (comp) {
+    case rgd::Equal: return a == b;
+    case rgd::Distinct: return a != b;
+    case rgd::Ult: return a < b;
+    case rgd::Ule: return a <= b;
+    case rgd::Ugt: return a > b;
+    case rgd::Uge: return a >= b;
+    case rgd::Slt: return sa < sb;
+    case rgd::Sle: return sa <= sb;
+    case rgd::Sgt: return sa > sb;
+    case rgd::Sge: return sa >= sb;
+    case rgd::Memcmp: return a == 1;
+    case rgd::MemcmpN: return a == 0;
+    default: return false;
+  }
+}
+
+// evaluate the constraint on the concrete input, return -1 if the
+// constraint cannot be evaluated, 1 if it's satisfied, 0 otherwise
+static int evaluate(std::shared_ptr<const Constraint> const& c, uint32_t comparison,
+                    const uint8_t *buf, size_t size) {
+  auto prog = AstProgram::compile(c->get_root(), c->local_map);
+  if (prog == nullptr) return -1;
+  std::vector<uint64_t> args(RET_OFFSET + c->input_args.size(), 0);
+  for (size_t i = 0; i < c->input_args.size(); i++) {
+    if (!c->input_args[i].first)
+      args[RET_OFFSET + i] = c->input_args[i].second;
+  }
+  for (auto const& [offset, lidx] : c->local_map) {
+    if (offset >= size) return 0;
+    args[RET_OFFSET + lidx] = buf[offset];
+  }
+  prog->eval(args.data());
+  return check_comparison(comparison, args[0], args[1],
+                          c->get_root()->children(0).bits()) ? 1 : 0;
+}
+
+// patch the value at loc, the value may be anywhere in the input, so only
+// accept the patch if it satisfies the constraint, or, if that cannot be
+// checked, at least touches the input bytes of the constraint
+bool I2SSolver::try_location(std::shared_ptr<const Constraint> const& c,
+                             uint32_t comparison, i2s_loc_t const& loc,
+                             uint64_t expected, uint32_t s,
+                             const uint8_t *in_buf, size_t in_size,
+                             uint8_t *out_buf, size_t &out_size) {
+  if (loc.encoding == I2S_LE || loc.encoding == I2S_BE) {
+    uint64_t r = expected;
+    if (loc.encoding == I2S_BE)
+      r = SWAP64(r) >> (64 - s * 8);
+    DEBUGF("i2s: index %u = 0x%lx\n", loc.offset, r);
+    memcpy(out_buf, in_buf, in_size);
+    out_size = in_size;
+    memcpy(&out_buf[loc.offset], &r, s);
+  } else {
+    DEBUGF("i2s: index text %u = %lu\n", loc.offset, expected);
+    // the length may change, as atoi
+    memcpy(out_buf, in_buf, loc.offset);
+    size_t num_len = snprintf((char*)out_buf + loc.offset, 64,
+        loc.encoding == I2S_HEX ? "%lx" : "%lu", expected);
+    memcpy(out_buf + loc.offset + num_len, in_buf + loc.offset + loc.size,
+           in_size - loc.offset - loc.size);
+    out_size = in_size + num_len - loc.size;
+  }
+
+  // offsets of the constraint are shifted if the length has changed
+  int sat = out_size == in_size ? evaluate(c, comparison, out_buf, out_size) : -1;
+  if (sat < 0) {
+    auto lower = c->local_map.lower_bound(loc.offset);
+    sat = lower != c->local_map.end() && lower->first < loc.offset + loc.size;
+  }
+  if (sat) {
+    matches++;
+    return true;
+  }
+  mismatches++;
+  return false;
+}
+
 solver_result_t
 I2SSolver::solve(std::shared_ptr<SearchTask> task,
                  const uint8_t *in_buf, size_t in_size,
                  uint8_t *out_buf, size_t &out_size) {
 
-  if (task->constraints.size() > 1) {
-    // FIXME: only support single constraint for now
+  if (task->constraints.size() == 1) {
+    return solve_constraint(task, 0, in_buf, in_size, out_buf, out_size);
+  }
+
+  // for a conjunction, solve each constraint separately, then apply all
+  // the substitutions together, as long as they don't conflict
+  std::vector<uint8_t> scratch(in_size + 64); // room for atoi
+  std::unordered_map<size_t, uint8_t> patch;
+  std::vector<bool> patched(task->constraints.size(), false);
+  for (size_t i = 0; i < task->constraints.size(); i++) {
+    size_t size = 0;
+    auto res = solve_constraint(task, i, in_buf, in_size, scratch.data(), size);
+    if (res != SOLVER_SAT) continue; // may already be satisfied
+    if (size != in_size) {
+      // atoi that changes the length, cannot be combined
+      return SOLVER_TIMEOUT;
+    }
+    // a substitution may write bytes outside the constraint's local_map
+    // (e.g., an indexed location), so diff the whole buffer
+    for (size_t offset = 0; offset < in_size; offset++) {
+      if (scratch[offset] == in_buf[offset]) continue;
+      auto itr = patch.find(offset);
+      if (itr != patch.end() && itr->second != scratch[offset]) {
+        DEBUGF("i2s: conflicting substitution at %lu\n", offset);
+        return SOLVER_TIMEOUT;
+      }
+      patch[offset] = scratch[offset];
+    }
+    patched[i] = true;
+  }
+  if (patch.empty()) {
     return SOLVER_TIMEOUT;
   }
-  auto const& c = task->constraints[0];
-  auto const& cm = task->consmeta[0];
-  auto comparison = task->comparisons[0];
+
+  memcpy(out_buf, in_buf, in_size);
+  out_size = in_size;
+  for (auto const& [offset, value] : patch) {
+    out_buf[offset] = value;
+  }
+
+  // check all the constraints on the new input
+  for (size_t i = 0; i < task->constraints.size(); i++) {
+    int sat = evaluate(task->constraints[i], task->comparisons[i], out_buf, out_size);
+    // trust the substitution if the constraint cannot be evaluated
+    if (sat == 0 || (sat < 0 && !patched[i])) {
+      mismatches++;
+      return SOLVER_TIMEOUT;
+    }
+  }
+  return SOLVER_SAT;
+}
+
+solver_result_t
+I2SSolver::solve_constraint(std::shared_ptr<SearchTask> task, size_t index,
+                            const uint8_t *in_buf, size_t in_size,
+                            uint8_t *out_buf, size_t &out_size) {
+  auto const& c = task->constraints[index];
+  auto const& cm = task->consmeta[index];
+  auto comparison = task->comparisons[index];
   if (likely(isRelationalKind(comparison))) {
     uint64_t value = 0, value_r = 0;
     uint64_t r = 0;
@@ -380,6 +627,11 @@ I2SSolver::solve(std::shared_ptr<SearchTask> task,
         return SOLVER_SAT;
       }
     }
+    // the operands may not come from the input bytes of the constraint
+    // directly, e.g., copied or transformed data, look them up in the
+    // whole input
+    if (solve_with_index(c, comparison, in_buf, in_size, out_buf, out_size))
+      return SOLVER_SAT;
   } else if (comparison == rgd::Memcmp) {
     DEBUGF("i2s: try memcmp\n");
     memcpy(out_buf, in_buf, in_size);
@@ -2,4 +2,6 @@
 #define CONFIG_H_
 #define MAX_NUM_MINIMAL_OPTIMA_ROUND 32
 #define MAX_EXEC_TIMES 1000
+// evaluate the partial derivatives of all input bytes in batches
+#define BATCHED_GRADIENT 1
 #endif
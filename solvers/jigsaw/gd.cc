@@ -3,9 +3,11 @@
 #include <iostream>
 
 #include "jit.h"
+#include "interp.h"
 #include "input.h"
 #include "grad.h"
 #include "config.h"
+#include "wheels/threadpool/ThreadPool.h"
 #include "ast.h"
 #include "task.h"
 
@@ -46,38 +48,25 @@ static void dump_distances(std::vector<uint64_t> &distances) {
 
 
 static void add_results(MutInput &input, std::shared_ptr<SearchTask> task) {
-  int i = 0;
   // since we used a trick (allow each byte to overflow and then use add instead
   // of bitwise or to concatenate, so the overflow would be visible)
   // to allow us to manipulate each byte individually during gradient descent,
   // we need to do a bit more work to get the final result
 
-  // first, we order the inputs by their offset
-  std::map<uint32_t, uint64_t> ordered_inputs;
-  for (auto it : task->inputs) {
-    ordered_inputs[it.first] = input.value[i];
-    i++;
-  }
-
-  // next, convert the ordered inputs to a vector for easier access
-  std::vector<std::pair<uint32_t, uint64_t> > ordered_inputs_v;
-  for (const auto& pair : ordered_inputs) {
-    ordered_inputs_v.push_back(pair);
-  }
-
-  // finally, we calculate the final result
+  // the inputs are already ordered by their offset
+  auto &inputs = task->inputs;
   uint32_t length = 1;
   uint64_t result = 0;
   uint32_t start = 0;
-  for (i = 0; i < ordered_inputs_v.size();) {
-    start = ordered_inputs_v[i].first;
-    result = ordered_inputs_v[i].second;
-    length = task->shapes[start];
+  for (size_t i = 0; i < inputs.size();) {
+    start = inputs[i].first;
+    result = input.value[i];
+    length = task->shapes[i];
     if (length == 0) { ++i; continue; }
     if (length <= 8) { // 8 bytes or less
       // first, concatenate the bytes according to the shape
       for (int j = 1; j < length; ++j) {
-        result += (ordered_inputs_v[i + j].second << (8 * j));
+        result += (input.value[i + j] << (8 * j));
       }
       // then extract the correct values, little endian
       for (int j = 0; j < length; ++j) {
@@ -85,7 +74,7 @@ static void add_results(MutInput &input, std::shared_ptr<SearchTask> task) {
       }
     } else { // if it's too large, just copy the value
       for (int j = 0; j < length; ++j) {
-        task->solution[start + j] = ordered_inputs_v[i + j].second;
+        task->solution[start + j] = input.value[i + j];
       }
     }
     i += length;
@@ -172,10 +161,38 @@ static uint64_t get_distance(uint32_t comp, uint64_t a, uint64_t b) {
 }
 
 
+// constraints that are not JIT'ed yet are interpreted
+template <typename C>
+static inline void eval_constraint(const C &c, uint64_t *args) {
+  if (likely(c->fn != nullptr)) c->fn(args);
+  else c->prog->eval(args);
+}
+
+// batched version of eval_constraint, args are laid out as [slot][lane]
+template <typename C>
+static inline void eval_constraint_batch(const C &c, uint64_t *args,
+    uint32_t nargs, uint32_t nlanes, uint64_t *scratch) {
+  if (likely(c->batch_fn != nullptr)) {
+    c->batch_fn(args);
+  } else if (c->fn == nullptr) {
+    c->prog->eval_batch(args, nlanes);
+  } else {
+    // not vectorized, evaluate the lanes one by one
+    for (uint32_t l = 0; l < nlanes; l++) {
+      for (uint32_t a = 0; a < nargs; a++)
+        scratch[RET_OFFSET + a] = args[(RET_OFFSET + a) * BATCH_LANES + l];
+      c->fn(scratch);
+      args[l] = scratch[0];
+      args[BATCH_LANES + l] = scratch[1];
+    }
+  }
+}
+
 static uint64_t single_distance(MutInput &input, std::vector<uint64_t> &distances, std::shared_ptr<SearchTask> task, int index) {
   // only re-compute the distance of the constraints that are affected by the change
   uint64_t res = 0;
-  for (uint32_t cons_id : task->cmap[index]) {
+  for (uint32_t k = task->cmap_start[index]; k < task->cmap_start[index + 1]; k++) {
+    uint32_t cons_id = task->cmap[k];
     auto& c = task->constraints[cons_id];
     auto& cm = task->consmeta[cons_id];
     int arg_idx = 0;
@@ -187,7 +204,7 @@ static uint64_t single_distance(MutInput &input, std::vector<uint64_t> &distance
       }
       ++arg_idx;
     }
-    c->fn(task->scratch_args);
+    eval_constraint(cm, task->scratch_args);
     uint64_t dis = get_distance(cm->comparison, task->scratch_args[0], task->scratch_args[1]);
     distances[cons_id] = dis;
 #if DEBUG
@@ -217,7 +234,7 @@ static uint64_t distance(MutInput &input, std::vector<uint64_t> &distances, std:
       }
       ++arg_idx;
     }
-    c->fn(task->scratch_args);
+    eval_constraint(cm, task->scratch_args);
     uint64_t dis = get_distance(cm->comparison, task->scratch_args[0], task->scratch_args[1]);
     distances[i] = dis;
     cm->op1 = task->scratch_args[0];
@@ -242,6 +259,41 @@ static uint64_t distance(MutInput &input, std::vector<uint64_t> &distances, std:
 }
 
 
+// decide the direction and the magnitude of the gradient from f(x),
+// f(x+delta) and f(x-delta)
+static void derive_gradient(uint64_t f0, uint64_t f_plus, uint64_t f_minus,
+                            bool *sign, bool *is_linear, uint64_t *val) {
+  if (f_minus < f0) {
+    if (f_plus < f0) {
+      if (f_minus < f_plus) {
+        *sign = false;
+        *is_linear = false;
+        *val = f0 - f_minus;
+      } else { // f_minus >= f_plus
+        *sign = true;
+        *is_linear = false;
+        *val = f0 - f_plus;
+      }
+    } else { // f_plus >= f0
+      *sign = false;
+      *is_linear = ((f_minus != f0) && (f0 - f_minus == f_plus - f0));
+      *val = f0 - f_minus;
+    }
+  } else { // f_minus >= f0
+    if (f_plus < f0) {
+      *sign = true;
+      *is_linear = ((f_minus != f0) && (f_minus - f0 == f0 - f_plus));
+      *val = f0 - f_plus;
+    } else { // f_plus >= f0
+      // reached a local optimum
+      *sign = true;
+      *is_linear = false;
+      *val = 0;
+    }
+  }
+}
+
+
 static void partial_derivative(MutInput &orig_input, size_t index, uint64_t f0, bool *sign, bool* is_linear, uint64_t *val, std::shared_ptr<SearchTask> task) {
 
   uint64_t orig_val = orig_input.value[index];
@@ -309,34 +361,7 @@ static void partial_derivative(MutInput &orig_input, size_t index, uint64_t f0,
   std::cout << "calculating partial and f0 is " << f0 << " f_minus is " << f_minus << " and f_plus is " << f_plus << std::endl;
 #endif
 
-  if (f_minus < f0) {
-    if (f_plus < f0) {
-      if (f_minus < f_plus) {
-        *sign = false;
-        *is_linear = false;
-        *val = f0 - f_minus;
-      } else { // f_minus >= f_plus
-        *sign = true;
-        *is_linear = false;
-        *val = f0 - f_plus;
-      }
-    } else { // f_plus >= f0
-      *sign = false;
-      *is_linear = ((f_minus != f0) && (f0 - f_minus == f_plus - f0));
-      *val = f0 - f_minus;
-    }
-  } else { // f_minus >= f0
-    if (f_plus < f0) {
-      *sign = true;
-      *is_linear = ((f_minus != f0) && (f_minus - f0 == f0 - f_plus));
-      *val = f0 - f_plus;
-    } else { // f_plus >= f0
-      // reached a local optimum
-      *sign = true;
-      *is_linear = false;
-      *val = 0;
-    }
-  }
+  derive_gradient(f0, f_plus, f_minus, sign, is_linear, val);
 }
 
 
@@ -356,7 +381,147 @@ static void compute_delta_all(MutInput &input, Grad &grad, size_t step) {
 }
 
 
+// a probe of the partial derivative, i.e., f(x+delta) or f(x-delta)
+struct probe_t {
+  uint32_t index;
+  bool plus;
+  bool done;
+  bool lucky;
+  uint64_t delta;
+  uint64_t value; // the perturbed input value
+  uint64_t f;
+};
+
+// same as partial_derivative on all the input bytes, but the probes of all
+// the bytes are evaluated together, BATCH_LANES at a time per constraint
+static void cal_gradient_batched(MutInput &input, uint64_t f0, Grad &grad, std::shared_ptr<SearchTask> task) {
+  const size_t num_cons = task->constraints.size();
+  // probes[2 * i] is f(x+delta) of input i, probes[2 * i + 1] is f(x-delta)
+  std::vector<probe_t> probes;
+  probes.reserve(2 * grad.len());
+  for (uint32_t i = 0; i < grad.len(); i++) {
+    probes.push_back({i, true, false, false, 1, 0, 0});
+    probes.push_back({i, false, false, false, 1, 0, 0});
+  }
+  // distances of the constraints affected by a probe, indexed by the
+  // position in cmap, so the plus and minus probes don't overlap
+  std::vector<uint64_t> plus_dis(task->cmap.size()), minus_dis(task->cmap.size());
+  // (probe, position in cmap) to be evaluated, grouped by constraint
+  std::vector<std::vector<std::pair<uint32_t, uint32_t>>> lanes(num_cons);
+  std::vector<uint32_t> round;
+
+  while (!task->stopped) {
+    round.clear();
+    for (uint32_t p = 0; p < probes.size(); p++) {
+      if (!probes[p].done) round.push_back(p);
+    }
+    if (round.empty()) break;
+    size_t budget = task->attempts < MAX_EXEC_TIMES ? MAX_EXEC_TIMES - task->attempts : 0;
+    if (round.size() > budget) {
+      round.resize(budget);
+      task->stopped = true;
+    }
+    task->attempts += round.size();
+
+    for (auto p : round) {
+      auto &pr = probes[p];
+      uint64_t orig_val = input.value[pr.index];
+      input.update(pr.index, pr.plus, pr.delta);
+      pr.value = input.value[pr.index];
+      input.value[pr.index] = orig_val;
+      for (uint32_t k = task->cmap_start[pr.index]; k < task->cmap_start[pr.index + 1]; k++)
+        lanes[task->cmap[k]].push_back({p, k});
+    }
+
+    uint64_t *args = task->batch_args;
+    for (size_t i = 0; i < num_cons; i++) {
+      auto &todo = lanes[i];
+      if (todo.empty()) continue;
+      auto& c = task->constraints[i];
+      auto& cm = task->consmeta[i];
+      for (size_t base = 0; base < todo.size(); base += BATCH_LANES) {
+        uint32_t nlanes = std::min<size_t>(BATCH_LANES, todo.size() - base);
+        int arg_idx = 0;
+        for (auto const &arg : cm->input_args) {
+          uint64_t *slot = &args[(RET_OFFSET + arg_idx) * BATCH_LANES];
+          for (uint32_t l = 0; l < nlanes; l++) {
+            auto &pr = probes[todo[base + l].first];
+            if (!arg.first) slot[l] = arg.second;
+            else if (arg.second == pr.index) slot[l] = pr.value;
+            else slot[l] = input.value[arg.second];
+          }
+          // unused lanes are still computed by the vectorized function,
+          // copy lane 0 so they can't trap (e.g., INT_MIN / -1)
+          for (uint32_t l = nlanes; l < BATCH_LANES; l++)
+            slot[l] = slot[0];
+          ++arg_idx;
+        }
+        eval_constraint_batch(cm, args, cm->input_args.size(), nlanes, task->scratch_args);
+        for (uint32_t l = 0; l < nlanes; l++) {
+          auto const& [p, k] = todo[base + l];
+          uint64_t dis = get_distance(cm->comparison, args[l], args[BATCH_LANES + l]);
+          (probes[p].plus ? plus_dis : minus_dis)[k] = dis;
+        }
+      }
+      todo.clear();
+    }
+
+    for (auto p : round) {
+      auto &pr = probes[p];
+      if (pr.done) continue; // the other direction got lucky
+      auto &dis = pr.plus ? plus_dis : minus_dis;
+      auto &distances = pr.plus ? task->plus_distances : task->minus_distances;
+      distances = task->min_distances;
+      uint64_t single_dis = 0;
+      for (uint32_t k = task->cmap_start[pr.index]; k < task->cmap_start[pr.index + 1]; k++) {
+        distances[task->cmap[k]] = dis[k];
+        single_dis = sat_inc(single_dis, dis[k]);
+      }
+      if (single_dis == 0) { // well, we got lucky and found a solution
+        pr.lucky = true;
+        pr.done = true;
+        probes[p ^ 1].done = true;
+        continue;
+      }
+      pr.f = 0;
+      for (size_t i = 0; i < num_cons; i++)
+        pr.f = sat_inc(pr.f, distances[i]);
+      // if f(x+delta) == f(x), delta is not large enough
+      if (pr.f == f0 && (pr.delta << 2) < 256) pr.delta <<= 2;
+      else pr.done = true;
+    }
+  }
+
+  int index = 0;
+  for (auto &gradu : grad.get_value()) {
+    auto &plus = probes[2 * index];
+    auto &minus = probes[2 * index + 1];
+    if (plus.lucky || minus.lucky) {
+      // keep the value, as partial_derivative does
+      auto &pr = plus.lucky ? plus : minus;
+      input.value[index] = pr.value;
+      gradu.sign = pr.plus;
+      gradu.val = 0;
+    } else if (!plus.done || !minus.done) {
+      // stopped before the probes finished
+      gradu.val = 0;
+    } else {
+      bool sign = false;
+      bool is_linear = false;
+      uint64_t val = 0;
+      derive_gradient(f0, plus.f, minus.f, &sign, &is_linear, &val);
+      gradu.sign = sign;
+      gradu.val = val;
+    }
+    index++;
+  }
+}
+
+
 static void cal_gradient(MutInput &input, uint64_t f0, Grad &grad, std::shared_ptr<SearchTask> task) {
+#if BATCHED_GRADIENT
+  cal_gradient_batched(input, f0, grad, task);
+#else
   uint64_t max = 0;
   int index = 0;
   for (auto &gradu : grad.get_value()) {
@@ -381,6 +546,7 @@ static void cal_gradient(MutInput &input, uint64_t f0, Grad &grad, std::shared_p
     gradu.val = val;
     index++;
   }
+#endif
 }
 
 
@@ -509,7 +675,7 @@ static uint64_t get_i2s_value(uint32_t comp, uint64_t v, bool rhs) {
 }
 
 
-static uint64_t try_new_i2s_value(std::shared_ptr<const Constraint> &c, uint32_t comparison, uint64_t value, std::shared_ptr<SearchTask> task) {
+static uint64_t try_new_i2s_value(std::shared_ptr<const Constraint> &c, std::unique_ptr<ConsMeta> &cm, uint64_t value, std::shared_ptr<SearchTask> task) {
   int i = 0;
   for (auto const& [offset, lidx] : c->local_map) {
     uint64_t v = ((value >> i) & 0xff);
@@ -523,8 +689,8 @@ static uint64_t try_new_i2s_value(std::shared_ptr<const Constraint> &c, uint32_t
     if (!arg.first) task->scratch_args[RET_OFFSET + arg_idx] = arg.second;
     ++arg_idx;
   }
-  c->fn(task->scratch_args);
-  return get_distance(comparison, task->scratch_args[0], task->scratch_args[1]);
+  eval_constraint(cm, task->scratch_args);
+  return get_distance(cm->comparison, task->scratch_args[0], task->scratch_args[1]);
 }
 
 
@@ -562,7 +728,7 @@ static uint64_t try_i2s(MutInput &input_min, MutInput &temp_input, uint64_t f0,
           }
 
           // test the new value
-          dis = try_new_i2s_value(c, cm->comparison, value, task);
+          dis = try_new_i2s_value(c, cm, value, task);
           if (dis == 0) {
 #if DEBUG
             std::cerr << "i2s updated c = " << k << " t = " << t << " input = " << input
@@ -594,7 +760,7 @@ try_reverse:
 
           // test the new value
           value = SWAP64(value) >> (64 - t); // reverse the value
-          dis = try_new_i2s_value(c, cm->comparison, value, task);
+          dis = try_new_i2s_value(c, cm, value, task);
           if (dis == 0) {
             // successful, update the real inputs
             i = 0;
@@ -677,12 +843,20 @@ static uint64_t reload_input(MutInput &input_min, std::shared_ptr<SearchTask> ta
   return ret;
 }
 
-bool rgd::gd_entry(std::shared_ptr<SearchTask> task) {
+// worker 0 starts from the original input, others from a random point
+static bool gd_search(std::shared_ptr<SearchTask> task, uint32_t worker) {
   MutInput input(task->inputs.size());
   MutInput scratch_input(task->inputs.size());
   task->attempts = 0;
 
-  uint64_t f0 = reload_input(input, task);
+  uint64_t f0;
+  if (worker == 0) {
+    f0 = reload_input(input, task);
+  } else {
+    // workers created at the same time should not get the same sequence
+    input.reseed((unsigned)time(NULL) + worker * 0x9e3779b9U);
+    f0 = repick_start_point(input, task);
+  }
   f0 = try_i2s(input, scratch_input, f0, task);
   if (task->stopped)
     return task->solved;
@@ -736,3 +910,46 @@ bool rgd::gd_entry(std::shared_ptr<SearchTask> task) {
 
   return task->solved;
 }
+
+bool rgd::gd_entry(std::shared_ptr<SearchTask> task) {
+  return gd_search(task, 0);
+}
+
+bool rgd::gd_entry_parallel(std::shared_ptr<SearchTask> task,
+                            ThreadPool &pool, uint32_t num_workers) {
+  if (num_workers <= 1)
+    return gd_search(task, 0);
+
+  // each worker searches its own copy of the task
+  std::vector<std::shared_ptr<SearchTask>> workers;
+  for (uint32_t i = 0; i < num_workers; i++)
+    workers.push_back(task->fork());
+  std::atomic<int> winner(-1);
+
+  std::vector<std::future<void>> results;
+  for (uint32_t i = 0; i < num_workers; i++) {
+    results.emplace_back(pool.enqueue([&workers, &winner, i] {
+      if (!gd_search(workers[i], i)) return;
+      int expected = -1;
+      if (winner.compare_exchange_strong(expected, (int)i)) {
+        // the first solution wins, cancel the others
+        for (auto &w : workers) w->stopped = true;
+      }
+    }));
+  }
+  for (auto &r : results) r.wait();
+
+  int attempts = 0;
+  for (auto &w : workers) attempts += w->attempts;
+  task->attempts = attempts;
+  task->stopped = true;
+  if (winner.load() < 0) {
+    task->solved = false;
+    return false;
+  }
+  auto &w = workers[winner.load()];
+  task->solved = true;
+  task->solution = w->solution;
+  task->min_distances = w->min_distances;
+  return true;
+}
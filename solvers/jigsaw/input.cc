@@ -73,6 +73,14 @@ void MutInput::randomize() {
   }
 }
 
+void MutInput::reseed(unsigned int seed) {
+  r_idx = 0;
+  memset(r_s, 0, 256);
+  memset(&r_d, 0, sizeof(struct random_data));
+  initstate_r(seed, r_s, 256, &r_d);
+  random_r(&r_d, &r_val);
+}
+
 uint8_t MutInput::get(const size_t i) {
   return value[i];
 }
@@ -84,10 +92,7 @@ MutInput::MutInput(size_t size) {
   unsigned int seed;
   //_rdseed32_step(&seed);
   seed = (unsigned)time(NULL);
-  memset(r_s, 0, 256);
-  memset(&r_d, 0, sizeof(struct random_data));
-  initstate_r(seed, r_s, 256, &r_d);
-  random_r(&r_d, &r_val);
+  reseed(seed);
 }
 
 MutInput::~MutInput()
@@ -30,6 +30,7 @@ public:
   uint64_t len();
   uint64_t val_len();
   void randomize();
+  void reseed(unsigned int seed);
   //random
   char r_s[256];
   struct random_data r_d;
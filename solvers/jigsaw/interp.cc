@@ -0,0 +1,227 @@
+#include <stdint.h>
+
+#include "interp.h"
+
+using namespace rgd;
+
+#define unlikely(x)     __builtin_expect(!!(x), 0)
+
+static inline uint64_t mask(uint32_t bits) {
+  return bits >= 64 ? ~0ULL : (1ULL << bits) - 1;
+}
+
+static inline uint64_t sext(uint64_t v, uint32_t from) {
+  if (from == 0 || from >= 64) return v;
+  return (uint64_t)(((int64_t)(v << (64 - from))) >> (64 - from));
+}
+
+static inline uint64_t sdiv(uint64_t a, uint64_t b, uint32_t bits, bool rem) {
+  int64_t sa = (int64_t)sext(a, bits);
+  int64_t sb = b ? (int64_t)sext(b, bits) : 1;
+  // avoid the INT_MIN / -1 trap
+  if (sb == -1) return rem ? 0 : 0 - (uint64_t)sa;
+  return rem ? (uint64_t)(sa % sb) : (uint64_t)(sa / sb);
+}
+
+std::shared_ptr<AstProgram> AstProgram::compile(const AstNode *node,
+    std::map<size_t, uint32_t> const& local_map) {
+  std::shared_ptr<AstProgram> prog(new AstProgram());
+  std::unordered_map<uint32_t, uint32_t> label_slots;
+  try {
+    if (prog->compile_node(node, local_map, label_slots, true) < 0)
+      return nullptr;
+  } catch (std::out_of_range &e) {
+    return nullptr;
+  }
+  return prog;
+}
+
+int64_t AstProgram::compile_node(const AstNode *node,
+    std::map<size_t, uint32_t> const& local_map,
+    std::unordered_map<uint32_t, uint32_t> &label_slots, bool is_root) {
+
+  // same as codegen, a labeled node is only evaluated once
+  if (node->label() != 0) {
+    auto itr = label_slots.find(node->label());
+    if (itr != label_slots.end())
+      return itr->second;
+  }
+
+  if (node->bits() > 64) return -1;
+
+  instr_t ins = {node->kind(), node->bits(), 0, 0, 0, 0};
+  switch (node->kind()) {
+    case rgd::Bool:
+      ins.imm = node->boolvalue() ? 1 : 0;
+      break;
+    case rgd::Constant:
+      ins.imm = node->index() + RET_OFFSET;
+      break;
+    case rgd::Read:
+      ins.imm = local_map.at(node->index()) + RET_OFFSET;
+      break;
+    // unary
+    case rgd::Extract:
+    case rgd::ZExt:
+    case rgd::SExt:
+    case rgd::Neg:
+    case rgd::Not: {
+      int64_t c = compile_node(&node->children(0), local_map, label_slots, false);
+      if (c < 0) return -1;
+      ins.op0 = c;
+      ins.bits0 = node->children(0).bits();
+      ins.imm = node->index();
+      break;
+    }
+    // binary
+    case rgd::Concat:
+    case rgd::Add:
+    case rgd::Sub:
+    case rgd::Mul:
+    case rgd::UDiv:
+    case rgd::SDiv:
+    case rgd::URem:
+    case rgd::SRem:
+    case rgd::And:
+    case rgd::Or:
+    case rgd::Xor:
+    case rgd::Shl:
+    case rgd::LShr:
+    case rgd::AShr: {
+      int64_t c1 = compile_node(&node->children(0), local_map, label_slots, false);
+      if (c1 < 0) return -1;
+      int64_t c2 = compile_node(&node->children(1), local_map, label_slots, false);
+      if (c2 < 0) return -1;
+      ins.op0 = c1;
+      ins.op1 = c2;
+      ins.bits0 = node->children(0).bits();
+      if (node->kind() == rgd::Concat &&
+          ins.bits0 + node->children(1).bits() > 64)
+        return -1;
+      break;
+    }
+    // relational and memcmp, must be the root
+    case rgd::Equal:
+    case rgd::Distinct:
+    case rgd::Ult:
+    case rgd::Ule:
+    case rgd::Ugt:
+    case rgd::Uge:
+    case rgd::Slt:
+    case rgd::Sle:
+    case rgd::Sgt:
+    case rgd::Sge:
+    case rgd::Memcmp:
+    case rgd::MemcmpN: {
+      if (!is_root) return -1;
+      if (node->children(0).bits() > 64 || node->children(1).bits() > 64)
+        return -1;
+      int64_t c1 = compile_node(&node->children(0), local_map, label_slots, false);
+      if (c1 < 0) return -1;
+      int64_t c2 = compile_node(&node->children(1), local_map, label_slots, false);
+      if (c2 < 0) return -1;
+      ins.op0 = c1;
+      ins.op1 = c2;
+      break;
+    }
+    default:
+      // LOr, LAnd, LNot, Ite, Load are not supported by codegen either
+      return -1;
+  }
+
+  uint32_t slot = code_.size();
+  code_.push_back(ins);
+  if (node->label() != 0)
+    label_slots.insert({node->label(), slot});
+  return slot;
+}
+
+// args and registers are laid out as [slot][lane], so a single lane is
+// the same layout as the scalar JIT'ed function, L is the stride of a
+// slot and only the first n lanes are evaluated
+#define LANES(expr) \
+  for (uint32_t l = 0; l < n; l++) { \
+    uint64_t a = A[l], b = B[l]; (void)a; (void)b; R[l] = (expr); \
+  }
+
+template <uint32_t L>
+void AstProgram::run(uint64_t *args, uint32_t n) const {
+  static thread_local std::vector<uint64_t> regs;
+  if (unlikely(regs.size() < code_.size() * L))
+    regs.resize(code_.size() * L);
+  uint64_t *r = regs.data();
+
+  evals_.fetch_add(n, std::memory_order_relaxed);
+  for (size_t i = 0; i < code_.size(); i++) {
+    const instr_t &ins = code_[i];
+    const uint64_t m = mask(ins.bits);
+    const uint64_t *A = &r[ins.op0 * L], *B = &r[ins.op1 * L];
+    uint64_t *R = &r[i * L];
+    switch (ins.kind) {
+      case rgd::Bool: LANES(ins.imm); break;
+      case rgd::Constant: {
+        const uint64_t *C = &args[ins.imm * L];
+        LANES(C[l] & m);
+        break;
+      }
+      case rgd::Read: {
+        // bytes are added instead of or'ed, so overflows are visible
+        uint32_t length = ins.bits / 8;
+        const uint64_t *C = &args[ins.imm * L];
+        LANES(C[l]);
+        for (uint32_t k = 1; k < length; k++) {
+          C = &args[(ins.imm + k) * L];
+          LANES(R[l] + (C[l] << (8 * k)));
+        }
+        LANES(R[l] & m);
+        break;
+      }
+      case rgd::Concat: LANES((b << ins.bits0) | a); break;
+      // shifting beyond the width is poison in the JIT'ed code, use 0
+      case rgd::Extract: LANES(ins.imm < 64 ? (a >> ins.imm) & m : 0); break;
+      case rgd::ZExt: LANES(a & m); break;
+      case rgd::SExt: LANES(sext(a, ins.bits0) & m); break;
+      case rgd::Neg: LANES((0 - a) & m); break;
+      case rgd::Not: LANES(~a & m); break;
+      case rgd::Add: LANES((a + b) & m); break;
+      case rgd::Sub: LANES((a - b) & m); break;
+      case rgd::Mul: LANES((a * b) & m); break;
+      // division by zero is replaced by division by one, as in codegen
+      case rgd::UDiv: LANES((a / (b ? b : 1)) & m); break;
+      case rgd::URem: LANES((a % (b ? b : 1)) & m); break;
+      case rgd::SDiv: LANES(sdiv(a, b, ins.bits, false) & m); break;
+      case rgd::SRem: LANES(sdiv(a, b, ins.bits, true) & m); break;
+      case rgd::And: LANES(a & b); break;
+      case rgd::Or: LANES(a | b); break;
+      case rgd::Xor: LANES(a ^ b); break;
+      case rgd::Shl: LANES(b < ins.bits ? (a << b) & m : 0); break;
+      case rgd::LShr: LANES(b < ins.bits ? a >> b : 0); break;
+      case rgd::AShr:
+        LANES((uint64_t)((int64_t)sext(a, ins.bits) >>
+              (b < ins.bits ? b : ins.bits - 1)) & m);
+        break;
+      case rgd::Memcmp:
+      case rgd::MemcmpN:
+        for (uint32_t l = 0; l < n; l++)
+          args[l] = A[l] == B[l] ? 1 : 0;
+        break;
+      default:
+        // relational, save the operands, already zero-extended
+        for (uint32_t l = 0; l < n; l++) {
+          args[l] = A[l];
+          args[L + l] = B[l];
+        }
+        break;
+    }
+  }
+}
+
+#undef LANES
+
+void AstProgram::eval(uint64_t *args) const {
+  run<1>(args, 1);
+}
+
+void AstProgram::eval_batch(uint64_t *args, uint32_t nlanes) const {
+  run<BATCH_LANES>(args, nlanes);
+}
@@ -0,0 +1,58 @@
+#ifndef INTERP_H_
+#define INTERP_H_
+
+#include <stdint.h>
+
+#include <atomic>
+#include <map>
+#include <memory>
+#include <unordered_map>
+#include <vector>
+
+#include "ast.h"
+#include "task.h"
+
+namespace rgd {
+
+// a flattened AST that can be evaluated without JIT compilation,
+// it follows the same calling convention and produces the same results
+// as the JIT'ed function, so the two can be used interchangeably
+class AstProgram {
+public:
+  // return nullptr if the AST cannot be interpreted (e.g., values wider
+  // than 64 bits), in which case it has to be JIT'ed
+  static std::shared_ptr<AstProgram> compile(const AstNode *node,
+      std::map<size_t, uint32_t> const& local_map);
+
+  void eval(uint64_t *args) const;
+  // evaluate the first nlanes (up to BATCH_LANES) inputs at once,
+  // args are laid out as [slot][lane] with a stride of BATCH_LANES
+  void eval_batch(uint64_t *args, uint32_t nlanes) const;
+
+  // number of times the program has been evaluated
+  uint64_t num_evals() const { return evals_.load(std::memory_order_relaxed); }
+
+private:
+  struct instr_t {
+    uint16_t kind;
+    uint16_t bits;
+    uint16_t bits0; // bits of the first operand
+    uint32_t op0; // slots of the operands
+    uint32_t op1;
+    uint64_t imm; // arg index, extract offset, or bool value
+  };
+
+  AstProgram() : evals_(0) {}
+  template <uint32_t L> void run(uint64_t *args, uint32_t n) const;
+  // return the slot of the result, or -1 if not supported
+  int64_t compile_node(const AstNode *node,
+      std::map<size_t, uint32_t> const& local_map,
+      std::unordered_map<uint32_t, uint32_t> &label_slots, bool is_root);
+
+  std::vector<instr_t> code_;
+  mutable std::atomic<uint64_t> evals_;
+};
+
+}; // namespace rgd
+
+#endif
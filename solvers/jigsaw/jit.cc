@@ -29,10 +29,97 @@ using namespace rgd;
 
 std::unique_ptr<GradJit> JIT;
 
+// id -> name of the JIT'ed function
+static std::unordered_map<uint64_t, std::string> func_names;
+// a module added to the JIT, its code is freed once no id refers to
+// any function in it
+struct jit_module_t {
+  llvm::orc::ResourceTrackerSP rt;
+  uint32_t refs;
+  std::vector<std::string> funcs;
+};
+// name of the JIT'ed function -> the module containing it
+static std::unordered_map<std::string, std::shared_ptr<jit_module_t>> added_funcs;
+// suffix of the batched version of a function, the lane count is part of
+// the name, as it changes the code
+static const std::string kBatchSuffix = "_v" + std::to_string(BATCH_LANES);
+
+static inline uint64_t mix64(uint64_t h, uint64_t v) {
+  h ^= v + 0x9e3779b97f4a7c15ULL + (h << 6) + (h >> 2);
+  h ^= h >> 31;
+  h *= 0x7fb5d329728ea185ULL;
+  h ^= h >> 27;
+  return h;
+}
+
+// digest everything codegen depends on: the structure, the arg index of
+// each read (i.e., the local_map shape), and which nodes share a label
+// (codegen reuses the value of a visited label), relational operators
+// generate the same code so they are not distinguished
+static void hash_ast(const AstNode* node,
+    std::map<size_t, uint32_t> const& local_map,
+    std::unordered_map<uint32_t, uint32_t> &labels,
+    uint64_t &h1, uint64_t &h2) {
+  if (node->label() != 0) {
+    auto itr = labels.find(node->label());
+    if (itr != labels.end()) {
+      h1 = mix64(h1, 0xffff0000ULL | itr->second);
+      h2 = mix64(h2, 0xffff0000ULL | itr->second);
+      return;
+    }
+    labels.insert({node->label(), (uint32_t)labels.size()});
+  }
+  uint64_t kind = isRelationalKind(node->kind()) ? rgd::Equal : node->kind();
+  uint64_t index = node->kind() == rgd::Read ? local_map.at(node->index()) : node->index();
+  uint64_t v = (kind << 48) | ((uint64_t)node->bits() << 32) |
+      ((uint64_t)node->boolvalue() << 31) | index;
+  h1 = mix64(h1, v);
+  h2 = mix64(h2 ^ 0x5bd1e995, v);
+  uint32_t n = node->children_size();
+  h1 = mix64(h1, n);
+  for (uint32_t i = 0; i < n; i++) {
+    hash_ast(&node->children(i), local_map, labels, h1, h2);
+  }
+}
+
+// with lanes > 0, values are vectors of lanes integers, and the arguments
+// are laid out as [slot][lane], otherwise values are scalars
+static llvm::Type* getIntTy(llvm::IRBuilder<> &Builder, uint32_t bits,
+    uint32_t lanes) {
+  llvm::Type *ty = llvm::Type::getIntNTy(Builder.getContext(), bits);
+  if (lanes == 0) return ty;
+  return llvm::FixedVectorType::get(ty, lanes);
+}
+
+static llvm::Value* loadLanes(llvm::IRBuilder<> &Builder, llvm::Value* arg,
+    uint32_t slot, uint32_t lanes) {
+  llvm::Value* idx[1];
+  idx[0] = llvm::ConstantInt::get(Builder.getInt32Ty(), lanes ? slot * lanes : slot);
+  llvm::Value* ptr = Builder.CreateGEP(arg, idx);
+  if (lanes == 0) return Builder.CreateLoad(ptr);
+  llvm::Type *vecTy = getIntTy(Builder, 64, lanes);
+  ptr = Builder.CreateBitCast(ptr, llvm::PointerType::getUnqual(vecTy));
+  return Builder.CreateAlignedLoad(vecTy, ptr, llvm::MaybeAlign(8));
+}
+
+static void storeLanes(llvm::IRBuilder<> &Builder, llvm::Value* val,
+    llvm::Value* arg, uint32_t slot, uint32_t lanes) {
+  llvm::Value* idx[1];
+  idx[0] = llvm::ConstantInt::get(Builder.getInt32Ty(), lanes ? slot * lanes : slot);
+  llvm::Value* ptr = Builder.CreateGEP(arg, idx);
+  if (lanes == 0) {
+    Builder.CreateStore(val, ptr);
+    return;
+  }
+  ptr = Builder.CreateBitCast(ptr, llvm::PointerType::getUnqual(val->getType()));
+  Builder.CreateAlignedStore(val, ptr, llvm::MaybeAlign(8));
+}
+
 static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
     const AstNode* node,
     std::map<size_t, uint32_t> const& local_map, llvm::Value* arg,
-    std::unordered_map<uint32_t, llvm::Value*> &value_cache) {
+    std::unordered_map<uint32_t, llvm::Value*> &value_cache,
+    uint32_t lanes) {
 
   llvm::Value* ret = nullptr;
   //std::cout << "code gen and nargs is " << nargs << std::endl;
@@ -44,10 +131,18 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
     return itr->second;
   }
 
+  // constants wider than a slot cannot be loaded as a vector, and wide
+  // vectors are too expensive to compile anyway
+  if (lanes && node->bits() > 64) {
+    throw std::invalid_argument("wide expression in batched function");
+  }
+
   switch (node->kind()) {
     case rgd::Bool: {
       // getTrue is actually 1 bit integer 1
-      if (node->boolvalue())
+      if (lanes)
+        ret = llvm::ConstantInt::get(getIntTy(Builder, 1, lanes), node->boolvalue());
+      else if (node->boolvalue())
         ret = llvm::ConstantInt::getTrue(Builder.getContext());
       else
         ret = llvm::ConstantInt::getFalse(Builder.getContext());
@@ -58,10 +153,15 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
       uint32_t start = node->index();
       uint32_t length = node->bits() / 8;
 
+      if (lanes) {
+        ret = loadLanes(Builder, arg, start + RET_OFFSET, lanes);
+        ret = Builder.CreateTrunc(ret, getIntTy(Builder, node->bits(), lanes));
+        break;
+      }
       llvm::Value* idx[1];
       idx[0] = llvm::ConstantInt::get(Builder.getInt32Ty(), start + RET_OFFSET);
       llvm::PointerType *constPtr = llvm::PointerType::getUnqual(
-          llvm::Type::getIntNTy(Builder.getContext(), node->bits()));
+          getIntTy(Builder, node->bits(), lanes));
       ret = Builder.CreateGEP(arg, idx); // calculate the offset
       ret = Builder.CreateBitCast(ret, constPtr);
       ret = Builder.CreateLoad(ret); // load length bytes at once
@@ -71,14 +171,11 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
       uint32_t start = local_map.at(node->index());
       size_t length = node->bits() / 8;
       //std::cout << "read index " << start << " length " << length << std::endl;
-      llvm::Type *retTy = llvm::Type::getIntNTy(Builder.getContext(), node->bits());
-      llvm::Value* idx[1];
-      idx[0] = llvm::ConstantInt::get(Builder.getInt32Ty(), start + RET_OFFSET);
-      ret = Builder.CreateLoad(Builder.CreateGEP(arg, idx));
+      llvm::Type *retTy = getIntTy(Builder, node->bits(), lanes);
+      ret = loadLanes(Builder, arg, start + RET_OFFSET, lanes);
       ret = Builder.CreateZExtOrTrunc(ret, retTy);
       for (uint32_t k = 1; k < length; k++) {
-        idx[0] = llvm::ConstantInt::get(Builder.getInt32Ty(), start + k + RET_OFFSET);
-        llvm::Value* tmp = Builder.CreateLoad(Builder.CreateGEP(arg, idx));
+        llvm::Value* tmp = loadLanes(Builder, arg, start + k + RET_OFFSET, lanes);
         tmp = Builder.CreateZExtOrTrunc(tmp, retTy);
         tmp = Builder.CreateShl(tmp, 8 * k);
         ret = Builder.CreateAdd(ret, tmp);
@@ -89,13 +186,13 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
       uint32_t bits = rc1->bits() + rc2->bits(); 
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       ret = Builder.CreateOr(
           Builder.CreateShl(
-            Builder.CreateZExt(c2,llvm::Type::getIntNTy(Builder.getContext(),bits)),
+            Builder.CreateZExt(c2, getIntTy(Builder, bits, lanes)),
             rc1->bits()),
-          Builder.CreateZExt(c1, llvm::Type::getIntNTy(Builder.getContext(), bits)));
+          Builder.CreateZExt(c1, getIntTy(Builder, bits, lanes)));
       break;
     }
     case rgd::Extract: {
@@ -103,10 +200,10 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
       //std::cerr << "Extract expression" << std::endl;
 #endif
       const AstNode* rc = &node->children(0);
-      llvm::Value* c = codegen(Builder, rc, local_map, arg, value_cache);
+      llvm::Value* c = codegen(Builder, rc, local_map, arg, value_cache, lanes);
       ret = Builder.CreateTrunc(
           Builder.CreateLShr(c, node->index()),
-          llvm::Type::getIntNTy(Builder.getContext(), node->bits()));
+          getIntTy(Builder, node->bits(), lanes));
       break;
     }
     case rgd::ZExt: {
@@ -114,10 +211,10 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
       // std::cerr << "ZExt the bits is " << node->bits() << std::endl;
 #endif
       const AstNode* rc = &node->children(0);
-      llvm::Value* c = codegen(Builder, rc, local_map, arg, value_cache);
+      llvm::Value* c = codegen(Builder, rc, local_map, arg, value_cache, lanes);
       //FIXME: we may face ZEXT to boolean expr
       ret = Builder.CreateZExtOrTrunc(c,
-          llvm::Type::getIntNTy(Builder.getContext(), node->bits()));
+          getIntTy(Builder, node->bits(), lanes));
       break;
     }
     case rgd::SExt: {
@@ -125,42 +222,42 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
       // std::cerr << "SExt the bits is " << node->bits() << std::endl;
 #endif
       const AstNode* rc = &node->children(0);
-      llvm::Value* c = codegen(Builder, rc,local_map, arg, value_cache);
+      llvm::Value* c = codegen(Builder, rc, local_map, arg, value_cache, lanes);
       ret = Builder.CreateSExt(c,
-          llvm::Type::getIntNTy(Builder.getContext(), node->bits()));
+          getIntTy(Builder, node->bits(), lanes));
       break;
     }
     case rgd::Add: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       ret = Builder.CreateAdd(c1, c2);
       break;
     }
     case rgd::Sub: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       ret = Builder.CreateSub(c1, c2);
       break;
     }
     case rgd::Mul: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       ret = Builder.CreateMul(c1, c2);
       break;
     }
     case rgd::UDiv: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
-      llvm::Value* VA0 = llvm::ConstantInt::get(llvm::Type::getIntNTy(Builder.getContext(), node->bits()), 0);
-      llvm::Value* VA1 = llvm::ConstantInt::get(llvm::Type::getIntNTy(Builder.getContext(), node->bits()), 1);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
+      llvm::Value* VA0 = llvm::ConstantInt::get(getIntTy(Builder, node->bits(), lanes), 0);
+      llvm::Value* VA1 = llvm::ConstantInt::get(getIntTy(Builder, node->bits(), lanes), 1);
       // FIXME: this is a hack to avoid division by zero, but should use a better way
       // FIXME: should record the divisor to avoid gradient vanish
       llvm::Value* cond = Builder.CreateICmpEQ(c2, VA0);
@@ -171,10 +268,10 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
     case rgd::SDiv: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
-      llvm::Value* VA0 = llvm::ConstantInt::get(llvm::Type::getIntNTy(Builder.getContext(), node->bits()), 0);
-      llvm::Value* VA1 = llvm::ConstantInt::get(llvm::Type::getIntNTy(Builder.getContext(), node->bits()), 1);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
+      llvm::Value* VA0 = llvm::ConstantInt::get(getIntTy(Builder, node->bits(), lanes), 0);
+      llvm::Value* VA1 = llvm::ConstantInt::get(getIntTy(Builder, node->bits(), lanes), 1);
       // FIXME: this is a hack to avoid division by zero, but should use a better way
       // FIXME: should record the divisor to avoid gradient vanish
       llvm::Value* cond = Builder.CreateICmpEQ(c2, VA0);
@@ -185,10 +282,10 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
     case rgd::URem: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
-      llvm::Value* VA0 = llvm::ConstantInt::get(llvm::Type::getIntNTy(Builder.getContext(), node->bits()), 0);
-      llvm::Value* VA1 = llvm::ConstantInt::get(llvm::Type::getIntNTy(Builder.getContext(), node->bits()), 1);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
+      llvm::Value* VA0 = llvm::ConstantInt::get(getIntTy(Builder, node->bits(), lanes), 0);
+      llvm::Value* VA1 = llvm::ConstantInt::get(getIntTy(Builder, node->bits(), lanes), 1);
       // FIXME: this is a hack to avoid division by zero, but should use a better way
       // FIXME: should record the divisor to avoid gradient vanish
       llvm::Value* cond = Builder.CreateICmpEQ(c2, VA0);
@@ -199,10 +296,10 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
     case rgd::SRem: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
-      llvm::Value* VA0 = llvm::ConstantInt::get(llvm::Type::getIntNTy(Builder.getContext(), node->bits()), 0);
-      llvm::Value* VA1 = llvm::ConstantInt::get(llvm::Type::getIntNTy(Builder.getContext(), node->bits()), 1);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
+      llvm::Value* VA0 = llvm::ConstantInt::get(getIntTy(Builder, node->bits(), lanes), 0);
+      llvm::Value* VA1 = llvm::ConstantInt::get(getIntTy(Builder, node->bits(), lanes), 1);
       // FIXME: this is a hack to avoid division by zero, but should use a better way
       // FIXME: should record the divisor to avoid gradient vanish
       llvm::Value* cond = Builder.CreateICmpEQ(c2, VA0);
@@ -212,61 +309,61 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
     }
     case rgd::Neg: {
       const AstNode* rc = &node->children(0);
-      llvm::Value* c = codegen(Builder, rc, local_map, arg, value_cache);
+      llvm::Value* c = codegen(Builder, rc, local_map, arg, value_cache, lanes);
       ret = Builder.CreateNeg(c);
       break;
     }
     case rgd::Not: {
       const AstNode* rc = &node->children(0);
-      llvm::Value* c = codegen(Builder, rc, local_map, arg, value_cache);
+      llvm::Value* c = codegen(Builder, rc, local_map, arg, value_cache, lanes);
       ret = Builder.CreateNot(c);
       break;
     }
     case rgd::And: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       ret = Builder.CreateAnd(c1, c2);
       break;
     }
     case rgd::Or: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       ret = Builder.CreateOr(c1, c2);
       break;
     }
     case rgd::Xor: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       ret = Builder.CreateXor(c1, c2);
       break;
     }
     case rgd::Shl: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       ret = Builder.CreateShl(c1, c2);
       break;
     }
     case rgd::LShr: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       ret = Builder.CreateLShr(c1, c2);
       break;
     }
     case rgd::AShr: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       ret = Builder.CreateAShr(c1, c2);
       break;
     }
@@ -284,19 +381,16 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
     // we don't really care about the comparison, just need to save the operands
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       // extend to 64-bit to avoid overflow
-      llvm::Value* c1e = Builder.CreateZExt(c1, Builder.getInt64Ty());
-      llvm::Value* c2e = Builder.CreateZExt(c2, Builder.getInt64Ty());
+      llvm::Value* c1e = Builder.CreateZExt(c1, getIntTy(Builder, 64, lanes));
+      llvm::Value* c2e = Builder.CreateZExt(c2, getIntTy(Builder, 64, lanes));
 
       // save the comparison operands to the output args
       // so it's easier to negate the condition
-      llvm::Value* idx[1];
-      idx[0] = llvm::ConstantInt::get(Builder.getInt32Ty(), 0);
-      Builder.CreateStore(c1e, Builder.CreateGEP(arg, idx));
-      idx[0] = llvm::ConstantInt::get(Builder.getInt32Ty(), 1);
-      Builder.CreateStore(c2e, Builder.CreateGEP(arg, idx));
+      storeLanes(Builder, c1e, arg, 0, lanes);
+      storeLanes(Builder, c2e, arg, 1, lanes);
 
       ret = nullptr;
       break;
@@ -305,16 +399,14 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
     case rgd::MemcmpN: {
       const AstNode* rc1 = &node->children(0);
       const AstNode* rc2 = &node->children(1);
-      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache);
-      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache);
+      llvm::Value* c1 = codegen(Builder, rc1, local_map, arg, value_cache, lanes);
+      llvm::Value* c2 = codegen(Builder, rc2, local_map, arg, value_cache, lanes);
       // c1 & c2 should be IntNty
       llvm::Value* ret = Builder.CreateICmpEQ(c1, c2);
-      ret = Builder.CreateZExt(ret, Builder.getInt64Ty());
+      ret = Builder.CreateZExt(ret, getIntTy(Builder, 64, lanes));
 
       // just save the results
-      llvm::Value* idx[1];
-      idx[0] = llvm::ConstantInt::get(Builder.getInt32Ty(), 0);
-      Builder.CreateStore(ret, Builder.CreateGEP(arg, idx));
+      storeLanes(Builder, ret, arg, 0, lanes);
 
       ret = nullptr;
       break;
@@ -363,10 +455,11 @@ static llvm::Value* codegen(llvm::IRBuilder<> &Builder,
   return ret; 
 }
 
-int rgd::addFunction(const AstNode* node,
-    std::map<size_t,uint32_t> const& local_map,
-    uint64_t id) {
-
+// name the function by the digest of the AST, so the object cache can
+// find the compiled code across runs
+static int get_func_digest(const AstNode* node,
+    std::map<size_t, uint32_t> const& local_map,
+    uint64_t &h1, uint64_t &h2) {
   if ((!isRelationalKind(node->kind()) &&
       node->kind() != rgd::Memcmp &&
       node->kind() != rgd::MemcmpN)) {
@@ -374,33 +467,42 @@ int rgd::addFunction(const AstNode* node,
     return -1;
   }
 
-  // Open a new module.
-  std::string moduleName = "rgdjit_m" + std::to_string(id);
-  std::string funcName = "rgdjit_f" + std::to_string(id);
+  h1 = 0; h2 = 0;
+  std::unordered_map<uint32_t, uint32_t> labels;
+  try {
+    hash_ast(node, local_map, labels, h1, h2);
+  } catch (std::out_of_range &e) {
+    std::cerr << "Invalid read: " << e.what() << std::endl;
+    return -1;
+  }
+  return 0;
+}
 
-  auto TheCtx = std::make_unique<llvm::LLVMContext>();
-  auto TheModule = std::make_unique<Module>(moduleName, *TheCtx);
-  TheModule->setDataLayout(JIT->getDataLayout());
-  llvm::IRBuilder<> Builder(*TheCtx);
+// with lanes > 0, emit the batched version of the function
+static int emitFunction(llvm::Module *TheModule,
+    const AstNode* node,
+    std::map<size_t,uint32_t> const& local_map,
+    const std::string &funcName, uint32_t lanes = 0) {
+  llvm::IRBuilder<> Builder(TheModule->getContext());
 
   std::vector<llvm::Type*> input_type(1,
       llvm::PointerType::getUnqual(Builder.getInt64Ty()));
   llvm::FunctionType *funcType;
   funcType = llvm::FunctionType::get(Builder.getVoidTy(), input_type, false);
   auto *fooFunc = llvm::Function::Create(funcType, llvm::Function::ExternalLinkage,
-      funcName, TheModule.get());
+      funcName, TheModule);
   auto *po = llvm::BasicBlock::Create(Builder.getContext(), "entry", fooFunc);
   Builder.SetInsertPoint(po);
-  uint32_t idx = 0;
 
   auto args = fooFunc->arg_begin();
   llvm::Value* var = &(*args);
   std::unordered_map<uint32_t, llvm::Value*> value_cache;
   llvm::Value* body = nullptr;
   try {
-    body = codegen(Builder, node, local_map, var, value_cache);
+    body = codegen(Builder, node, local_map, var, value_cache, lanes);
   } catch (std::invalid_argument &e) {
-    std::cerr << "Invalid node: " << e.what() << std::endl;
+    if (!lanes) std::cerr << "Invalid node: " << e.what() << std::endl;
+    fooFunc->eraseFromParent();
     return -1;
   }
   if (body != nullptr) {
@@ -411,18 +513,134 @@ int rgd::addFunction(const AstNode* node,
 
   llvm::raw_ostream *stream = &llvm::outs();
   llvm::verifyFunction(*fooFunc, stream);
+
+  return 0;
+}
+
+int rgd::addFunction(const AstNode* node,
+    std::map<size_t,uint32_t> const& local_map,
+    uint64_t id) {
+  std::vector<jit_request_t> reqs = {{node, &local_map, id}};
+  return addFunctions(reqs);
+}
+
+int rgd::addFunctions(const std::vector<jit_request_t> &reqs) {
+  // first, name all the functions without changing any state,
+  // so a failure in the batch leaves nothing behind
+  std::vector<std::string> names;
+  std::vector<size_t> to_emit; // index of the first request of a new function
+  std::vector<std::pair<uint64_t, uint64_t>> digests;
+  std::unordered_map<std::string, size_t> pending;
+  for (size_t i = 0; i < reqs.size(); i++) {
+    uint64_t h1, h2;
+    if (get_func_digest(reqs[i].node, *reqs[i].local_map, h1, h2) != 0)
+      return -1;
+    char digest[40];
+    snprintf(digest, sizeof(digest), "%016lx%016lx", h1, h2);
+    names.push_back(std::string("rgdjit_f") + digest);
+    digests.push_back({h1, h2});
+    if (added_funcs.count(names.back()) == 0 &&
+        pending.insert({names.back(), i}).second) {
+      to_emit.push_back(i);
+    }
+  }
+
+  // emit all new functions into a single module, so the fixed cost of
+  // compiling a module is only paid once per batch; but the object cache
+  // is keyed by the module name, so with a disk cache, emit one module per
+  // function, otherwise it would only hit on the exact same batch
+  std::vector<std::vector<size_t>> groups;
+  if (JIT->getObjectCache() != nullptr) {
+    for (auto i : to_emit) groups.push_back({i});
+  } else if (!to_emit.empty()) {
+    groups.push_back(to_emit);
+  }
+
+  // emit all the modules before adding any of them, so a failure leaves
+  // nothing behind
+  struct emitted_t {
+    std::unique_ptr<llvm::LLVMContext> ctx;
+    std::unique_ptr<Module> mod;
+    std::vector<bool> batched;
+  };
+  std::vector<emitted_t> emitted;
+  for (auto const& group : groups) {
+    // modules also contain the batched functions, so the lane count is
+    // part of the module name
+    uint64_t m1 = BATCH_LANES, m2 = 0;
+    for (auto i : group) {
+      m1 = mix64(m1, digests[i].first);
+      m2 = mix64(m2, digests[i].second);
+    }
+    char digest[40];
+    snprintf(digest, sizeof(digest), "%016lx%016lx", m1, m2);
+    std::string moduleName = std::string("rgdjit_m") + digest;
+
+    auto TheCtx = std::make_unique<llvm::LLVMContext>();
+    auto TheModule = std::make_unique<Module>(moduleName, *TheCtx);
+    TheModule->setDataLayout(JIT->getDataLayout());
+    std::vector<bool> batched(reqs.size(), false);
+    for (auto i : group) {
+      if (emitFunction(TheModule.get(), reqs[i].node, *reqs[i].local_map, names[i]) != 0)
+        return -1;
+      // the batched version is optional, skip it if it cannot be vectorized
+      batched[i] = emitFunction(TheModule.get(), reqs[i].node, *reqs[i].local_map,
+                                names[i] + kBatchSuffix, BATCH_LANES) == 0;
+    }
 #if DEBUG
-  // TheModule->print(llvm::errs(), nullptr);
+    // TheModule->print(llvm::errs(), nullptr);
 #endif
+    emitted.push_back({std::move(TheCtx), std::move(TheModule), std::move(batched)});
+  }
 
-  JIT->addModule(std::move(TheModule), std::move(TheCtx));
+  for (size_t g = 0; g < groups.size(); g++) {
+    auto &e = emitted[g];
+    auto module = std::make_shared<jit_module_t>();
+    module->rt = JIT->addModule(std::move(e.mod), std::move(e.ctx));
+    module->refs = 0;
+    for (auto i : groups[g]) {
+      added_funcs.insert({names[i], module});
+      module->funcs.push_back(names[i]);
+      if (e.batched[i]) {
+        added_funcs.insert({names[i] + kBatchSuffix, module});
+        module->funcs.push_back(names[i] + kBatchSuffix);
+      }
+    }
+  }
+
+  // then, record the references
+  for (size_t i = 0; i < reqs.size(); i++) {
+    added_funcs[names[i]]->refs++;
+    func_names[reqs[i].id] = names[i];
+  }
 
   return 0;
 }
 
-test_fn_type rgd::performJit(uint64_t id) {
-  std::string funcName = "rgdjit_f" + std::to_string(id);
-  auto ExprSymbol = JIT->lookup(funcName).get();
+test_fn_type rgd::performJit(uint64_t id, bool batched) {
+  auto itr = func_names.find(id);
+  if (itr == func_names.end()) return nullptr;
+  std::string name = itr->second;
+  if (batched) {
+    name += kBatchSuffix;
+    if (added_funcs.count(name) == 0) return nullptr;
+  }
+  auto ExprSymbol = JIT->lookup(name).get();
   auto func = (test_fn_type)ExprSymbol.getAddress();
   return func;
 }
+
+void rgd::removeFunction(uint64_t id) {
+  auto itr = func_names.find(id);
+  if (itr == func_names.end()) return;
+  auto fitr = added_funcs.find(itr->second);
+  func_names.erase(itr);
+  if (fitr == added_funcs.end()) return;
+  // free the code once no one refers to any function in the module
+  auto module = fitr->second;
+  if (--module->refs == 0) {
+    JIT->removeModule(module->rt);
+    for (auto const& f : module->funcs)
+      added_funcs.erase(f);
+  }
+}
@@ -1,21 +1,44 @@
 #ifndef JIGSAW_H_
 #define JIGSAW_H_
 
+#include <map>
 #include <memory>
+#include <vector>
 
 #include "ast.h"
 #include "task.h"
 
+class ThreadPool;
+
 namespace rgd {
 
+struct jit_request_t {
+  const AstNode* node;
+  const std::map<size_t, uint32_t> *local_map;
+  uint64_t id;
+};
+
 int addFunction(const AstNode* node,
     std::map<size_t, uint32_t> const& local_map,
     uint64_t id);
 
-test_fn_type performJit(uint64_t id);
+// add a batch of functions, compiled as a single module
+int addFunctions(const std::vector<jit_request_t> &reqs);
+
+// if batched, return the batched version of the function, or nullptr
+// if it's not available
+test_fn_type performJit(uint64_t id, bool batched = false);
+
+// release the function, the code is freed when no other id refers to it
+void removeFunction(uint64_t id);
 
 bool gd_entry(std::shared_ptr<SearchTask> task);
 
+// search copies of the task from different starting points on the pool,
+// stop at the first solution
+bool gd_entry_parallel(std::shared_ptr<SearchTask> task,
+                       ThreadPool &pool, uint32_t num_workers);
+
 }
 
 #endif
\ No newline at end of file
@@ -2,7 +2,9 @@
 #define GRAD_JIT_H
 
 #include "llvm/ADT/StringRef.h"
+#include "llvm/Config/llvm-config.h"
 #include "llvm/ExecutionEngine/JITSymbol.h"
+#include "llvm/ExecutionEngine/ObjectCache.h"
 #include "llvm/ExecutionEngine/Orc/CompileUtils.h"
 #include "llvm/ExecutionEngine/Orc/Core.h"
 #include "llvm/ExecutionEngine/Orc/ExecutionUtils.h"
@@ -15,11 +17,17 @@
 #include "llvm/IR/DataLayout.h"
 #include "llvm/IR/LLVMContext.h"
 #include "llvm/IR/LegacyPassManager.h"
+#include "llvm/IR/Module.h"
+#include "llvm/Support/FileSystem.h"
+#include "llvm/Support/MemoryBuffer.h"
+#include "llvm/Support/Path.h"
+#include "llvm/Support/raw_ostream.h"
 #include "llvm/Transforms/InstCombine/InstCombine.h"
 #include "llvm/Transforms/Scalar.h"
 #include "llvm/Transforms/Scalar/GVN.h"
 
 #include <algorithm>
+#include <atomic>
 #include <map>
 #include <memory>
 #include <set>
@@ -28,8 +36,58 @@
 
 namespace rgd {
 
+  // on-disk cache of the compiled objects, one file per module, named by
+  // the module identifier (i.e., the hash of the AST and its arg mapping)
+  class DiskObjectCache : public llvm::ObjectCache {
+    public:
+      DiskObjectCache(const std::string &Dir) : Dir(Dir), Hits(0), Misses(0) {}
+
+      void notifyObjectCompiled(const llvm::Module *M, llvm::MemoryBufferRef Obj) override {
+        llvm::SmallString<256> Path, TmpPath;
+        getPath(M, Path);
+        // write to a temporary file first, then rename, so concurrent
+        // instances sharing the directory never see a partial object
+        int FD;
+        if (llvm::sys::fs::createUniqueFile(llvm::Twine(Path) + ".tmp-%%%%%%", FD, TmpPath))
+          return;
+        {
+          llvm::raw_fd_ostream OS(FD, true);
+          OS << Obj.getBuffer();
+        }
+        if (llvm::sys::fs::rename(TmpPath, Path))
+          llvm::sys::fs::remove(TmpPath);
+      }
+
+      std::unique_ptr<llvm::MemoryBuffer> getObject(const llvm::Module *M) override {
+        llvm::SmallString<256> Path;
+        getPath(M, Path);
+        auto Buf = llvm::MemoryBuffer::getFile(Path, -1, false);
+        if (!Buf) {
+          Misses++;
+          return nullptr;
+        }
+        Hits++;
+        return std::move(*Buf);
+      }
+
+      uint64_t getHits() const { return Hits; }
+      uint64_t getMisses() const { return Misses; }
+
+    private:
+      std::string Dir;
+      std::atomic<uint64_t> Hits;
+      std::atomic<uint64_t> Misses;
+
+      void getPath(const llvm::Module *M, llvm::SmallVectorImpl<char> &Path) {
+        Path.clear();
+        llvm::sys::path::append(Path, Dir, M->getModuleIdentifier() + ".o");
+      }
+  };
+
   class GradJit {
     private:
+      // must be initialized before the compile layer
+      std::unique_ptr<DiskObjectCache> ObjCache;
       llvm::orc::ExecutionSession ES;
       llvm::orc::RTDyldObjectLinkingLayer ObjectLayer;
       llvm::orc::IRCompileLayer CompileLayer;
@@ -39,10 +97,12 @@ namespace rgd {
       llvm::orc::JITDylib *MainJD;
 
     public:
-      GradJit(std::unique_ptr<llvm::TargetMachine> TM, llvm::DataLayout DL)
-        : ObjectLayer(ES,
+      GradJit(std::unique_ptr<llvm::TargetMachine> TM, llvm::DataLayout DL,
+              std::unique_ptr<DiskObjectCache> Cache = nullptr)
+        : ObjCache(std::move(Cache)),
+        ObjectLayer(ES,
             []() { return std::make_unique<llvm::SectionMemoryManager>(); }),
-        CompileLayer(ES, ObjectLayer, std::make_unique<llvm::orc::TMOwningSimpleCompiler>(std::move(TM))),
+        CompileLayer(ES, ObjectLayer, std::make_unique<llvm::orc::TMOwningSimpleCompiler>(std::move(TM), ObjCache.get())),
         DL(std::move(DL)), Mangle(ES, this->DL)
         {
           MainJD = &cantFail(ES.createJITDylib("main"));
@@ -59,7 +119,11 @@ namespace rgd {
 
       const llvm::DataLayout &getDataLayout() const { return DL; }
 
-      static llvm::Expected<std::unique_ptr<GradJit>> Create() {
+      const DiskObjectCache *getObjectCache() const { return ObjCache.get(); }
+
+      // if CacheDir is given, compiled objects are persisted there and
+      // reloaded by later runs (or other instances sharing the directory)
+      static llvm::Expected<std::unique_ptr<GradJit>> Create(const char *CacheDir = nullptr) {
         auto JTMB = llvm::orc::JITTargetMachineBuilder::detectHost();
 
         if (!JTMB) {
@@ -79,13 +143,35 @@ namespace rgd {
           return TM.takeError();
         }
 
-        return std::make_unique<GradJit>(std::move(*TM), std::move(*DL));
+        std::unique_ptr<DiskObjectCache> Cache = nullptr;
+        if (CacheDir) {
+          // objects are only valid for the same target and llvm version
+          llvm::SmallString<256> Dir(CacheDir);
+          std::string Target = (*TM)->getTargetTriple().str() + "-" +
+              (*TM)->getTargetCPU().str() + "-llvm" + LLVM_VERSION_STRING;
+          llvm::sys::path::append(Dir, Target);
+          if (auto EC = llvm::sys::fs::create_directories(Dir)) {
+            llvm::errs() << "Cannot create JIT cache dir " << Dir << ": " << EC.message() << "\n";
+          } else {
+            Cache = std::make_unique<DiskObjectCache>(Dir.str().str());
+          }
+        }
+
+        return std::make_unique<GradJit>(std::move(*TM), std::move(*DL), std::move(Cache));
       }
 
-      void addModule(std::unique_ptr<llvm::Module> M,
+      // each module gets its own resource tracker, so it can be freed
+      llvm::orc::ResourceTrackerSP addModule(std::unique_ptr<llvm::Module> M,
                             std::unique_ptr<llvm::LLVMContext> ctx) {
-        cantFail(CompileLayer.add(*MainJD,
+        auto RT = MainJD->createResourceTracker();
+        cantFail(CompileLayer.add(RT,
           llvm::orc::ThreadSafeModule(std::move(M), std::move(ctx))));
+        return RT;
+      }
+
+      void removeModule(llvm::orc::ResourceTrackerSP RT) {
+        if (auto Err = RT->remove())
+          ES.reportError(std::move(Err));
       }
 
       llvm::Expected<llvm::JITEvaluatedSymbol> lookup(llvm::StringRef Name) {
@@ -5,7 +5,13 @@
 #include "ast.h"
 #include "jigsaw/rgdJit.h"
 #include "jigsaw/jit.h"
-#include "wheels/lockfreehash/lprobe/hash_table.h"
+#include "jigsaw/interp.h"
+#include "wheels/threadpool/ThreadPool.h"
+
+#include <list>
+#include <mutex>
+#include <vector>
+#include <unordered_map>
 
 using namespace rgd;
 
@@ -32,36 +38,102 @@ static uint64_t getTimeStamp() {
 
 extern std::unique_ptr<GradJit> JIT;
 
-struct myKV {
-  std::shared_ptr<AstNode> node;
-  test_fn_type fn;
-  myKV(std::shared_ptr<AstNode> anode, test_fn_type f) : node(anode), fn(f) {}
-};
+// LRU cache of the JIT'ed functions and the interpreted programs,
+// the code of evicted functions is freed,
+// functions pinned by the tasks being solved are never evicted
+class FunctionCache {
+public:
+  struct entry_t {
+    std::shared_ptr<AstNode> node;
+    test_fn_type fn; // nullptr if not JIT'ed yet
+    test_fn_type batch_fn;
+    std::shared_ptr<const AstProgram> prog;
+    uint64_t id; // for freeing the function
+    uint32_t pins; // number of tasks using the function
+  };
+
+  FunctionCache(size_t capacity) : capacity_(capacity) {}
+
+  void set_capacity(size_t capacity) { capacity_ = capacity; }
+
+  // the returned entry is pinned
+  entry_t* find(const std::shared_ptr<AstNode> &node) {
+    auto range = index_.equal_range(node->hash());
+    for (auto itr = range.first; itr != range.second; ++itr) {
+      auto e = itr->second;
+      // ASTs are interned by the parser, so identical ones share the same node
+      if (e->node == node || isEqualAst(*e->node, *node)) {
+        lru_.splice(lru_.begin(), lru_, e);
+        e->pins++;
+        return &*e;
+      }
+    }
+    return nullptr;
+  }
+
+  // the inserted entry is pinned, return the number of evicted functions
+  size_t insert(const std::shared_ptr<AstNode> &node, test_fn_type fn,
+                test_fn_type batch_fn, std::shared_ptr<const AstProgram> prog,
+                uint64_t id, entry_t **entry) {
+    lru_.push_front({node, fn, batch_fn, std::move(prog), id, 1});
+    index_.insert({node->hash(), lru_.begin()});
+    *entry = &lru_.front();
+    size_t evicted = 0;
+    auto itr = lru_.end();
+    while (lru_.size() > capacity_ && itr != lru_.begin()) {
+      --itr;
+      if (itr->pins) continue; // in use
+      auto range = index_.equal_range(itr->node->hash());
+      for (auto i = range.first; i != range.second; ++i) {
+        if (i->second == itr) {
+          index_.erase(i);
+          break;
+        }
+      }
+      if (itr->fn) removeFunction(itr->id);
+      itr = lru_.erase(itr);
+      evicted++;
+    }
+    return evicted;
+  }
+
+  void unpin(entry_t *e) { e->pins--; }
 
-struct myHash {
-  using eType = struct myKV*;
-  using kType = std::shared_ptr<AstNode>;
-  eType empty() {return nullptr;}
-  kType getKey(eType v) {return v->node;}
-  int hash(kType v) {return v->hash();} //hash64_2(v);}
-  //int hash(kType v) {return hash64_2(v);}
-  //int cmp(kType v, kType b) {return (v > b) ? 1 : ((v == b) ? 0 : -1);}
-  int cmp(kType v, kType b) {return (isEqualAst(*v,*b)) ? 0 : -1;}
-  bool replaceQ(eType, eType) {return 0;}
-  eType update(eType v, eType) {return v;}
-  bool cas(eType* p, eType o, eType n) {return pbbs::atomic_compare_and_swap(p, o, n);}
+  // replace the interpreted program with the JIT'ed function
+  void promote(entry_t *e, test_fn_type fn, test_fn_type batch_fn,
+               uint64_t id) {
+    e->fn = fn;
+    e->batch_fn = batch_fn;
+    e->id = id;
+    e->prog = nullptr;
+  }
+
+private:
+  size_t capacity_;
+  std::list<entry_t> lru_; // most recently used first
+  std::unordered_multimap<uint32_t, std::list<entry_t>::iterator> index_; // hash -> entry
 };
 
-static pbbs::Table<myHash> fCache(8000016, myHash(), 1.3);
+// protects fCache and the JIT, so independent tasks can be solved concurrently
+static std::mutex jit_lock;
+static FunctionCache fCache(JITSolver::kDefaultCacheSize);
 
-JITSolver::JITSolver(): uuid(0) {
+JITSolver::JITSolver(const char *cache_dir, size_t cache_size,
+    uint64_t jit_threshold, uint32_t num_threads):
+    jit_threshold(jit_threshold), num_threads(num_threads), uuid(0),
+    cache_evictions(0), num_tasks(0), jit_batches(0), interp_hits(0) {
+  if (num_threads > 1)
+    pool = std::make_unique<ThreadPool>(num_threads);
+  fCache.set_capacity(cache_size);
   llvm::InitializeNativeTarget();
   llvm::InitializeNativeTargetAsmPrinter();
   llvm::InitializeNativeTargetAsmParser();
 
-  JIT = std::move(GradJit::Create().get());
+  JIT = std::move(GradJit::Create(cache_dir).get());
 }
 
+JITSolver::~JITSolver() {}
+
 solver_result_t
 JITSolver::solve(std::shared_ptr<SearchTask> task,
                  const uint8_t *in_buf, size_t in_size,
@@ -90,40 +162,111 @@ JITSolver::solve(std::shared_ptr<SearchTask> task,
     base_task = base_task->base_task;
   }
 
+  // functions may have been evicted since the last time the constraint
+  // was solved, so always go through the cache
+  // constraints are interpreted until they have been evaluated
+  // jit_threshold times, then they are JIT'ed the next time they are solved
+  num_tasks++;
+  std::vector<FunctionCache::entry_t*> pinned;
+  auto unpin_all = [&pinned]() {
+    std::lock_guard<std::mutex> guard(jit_lock);
+    for (auto *e : pinned) fCache.unpin(e);
+  };
+  std::unique_lock<std::mutex> lock(jit_lock);
+  std::vector<jit_request_t> batch;
+  std::vector<size_t> batch_cons;
+  std::vector<FunctionCache::entry_t*> batch_entries;
   for (size_t i = 0; i < task->constraints.size(); i++) {
     auto &c = task->constraints[i];
-    DEBUGF("process constraint %d (fn=%p)\n", c->ast->label(), c->fn);
-    // jit the AST into a native function if haven't done so
-    if (c->fn == nullptr) {
-      struct myKV *res = fCache.find(c->ast);
-      if (res == nullptr) {
+    auto &cm = task->consmeta[i];
+    DEBUGF("process constraint %d\n", c->ast->label());
+    auto *e = fCache.find(c->ast);
+    if (e != nullptr) pinned.push_back(e);
+    if (e != nullptr && e->fn != nullptr) {
+      cache_hits++;
+      cm->fn = e->fn;
+      cm->batch_fn = e->batch_fn;
+      cm->prog = nullptr;
+      continue;
+    }
+    if (e != nullptr && e->prog->num_evals() < jit_threshold) {
+      interp_hits++;
+      cm->fn = nullptr;
+      cm->batch_fn = nullptr;
+      cm->prog = e->prog;
+      continue;
+    }
+    if (e == nullptr && jit_threshold > 0) {
+      auto prog = AstProgram::compile(c->get_root(), c->local_map);
+      if (prog != nullptr) {
+        DEBUGF("interpret constraint %d\n", c->ast->label());
         cache_misses++;
-        DEBUGF("jit constraint %d\n", c->ast->label());
-        uint64_t id = ++uuid;
-        start = getTimeStamp();
-        if (addFunction(c->get_root(), c->local_map, id) != 0) {
-          WARNF("failed to add function\n");
-          return SOLVER_ERROR;
-        }
-        process_time += (getTimeStamp() - start);
-        start = getTimeStamp();
-        auto fn = performJit(id);
-        jit_time += (getTimeStamp() - start);
-        auto kv = new struct myKV(c->ast, fn);
-        if (!fCache.insert(kv))
-          delete kv;
-        const_cast<Constraint*>(c.get())->fn = fn; // XXX: workaround, no concurrent access
+        cm->fn = nullptr;
+        cm->batch_fn = nullptr;
+        cm->prog = prog;
+        cache_evictions += fCache.insert(c->ast, nullptr, nullptr, prog, 0, &e);
+        pinned.push_back(e);
+        continue;
+      }
+    }
+    if (e == nullptr) cache_misses++;
+    DEBUGF("jit constraint %d\n", c->ast->label());
+    batch.push_back({c->get_root(), &c->local_map, ++uuid});
+    batch_cons.push_back(i);
+    batch_entries.push_back(e);
+  }
+
+  // jit all the missing constraints in one module
+  if (!batch.empty()) {
+    start = getTimeStamp();
+    if (addFunctions(batch) != 0) {
+      WARNF("failed to add functions\n");
+      lock.unlock();
+      unpin_all();
+      return SOLVER_ERROR;
+    }
+    process_time += (getTimeStamp() - start);
+    start = getTimeStamp();
+    std::vector<test_fn_type> fns, batch_fns;
+    for (auto const& req : batch) {
+      auto fn = performJit(req.id);
+      if (fn == nullptr) {
+        WARNF("failed to jit function\n");
+        for (auto const& r : batch) removeFunction(r.id);
+        lock.unlock();
+        unpin_all();
+        return SOLVER_ERROR;
+      }
+      fns.push_back(fn);
+      // may not be available, then the scalar function is used
+      batch_fns.push_back(performJit(req.id, true));
+    }
+    jit_time += (getTimeStamp() - start);
+    jit_batches++;
+    // entries found above are pinned, so they are not evicted by the insertions
+    for (size_t k = 0; k < batch.size(); k++) {
+      auto &c = task->constraints[batch_cons[k]];
+      auto &cm = task->consmeta[batch_cons[k]];
+      if (batch_entries[k] != nullptr) {
+        fCache.promote(batch_entries[k], fns[k], batch_fns[k], batch[k].id);
       } else {
-        cache_hits++;
-        const_cast<Constraint*>(c.get())->fn = res->fn; // XXX: workaround
+        FunctionCache::entry_t *e;
+        cache_evictions += fCache.insert(c->ast, fns[k], batch_fns[k],
+                                         nullptr, batch[k].id, &e);
+        pinned.push_back(e);
       }
+      cm->fn = fns[k];
+      cm->batch_fn = batch_fns[k];
+      cm->prog = nullptr;
     }
   }
+  lock.unlock();
 
   // solve the task
   start = getTimeStamp();
-  bool res = gd_entry(task);
+  bool res = pool ? gd_entry_parallel(task, *pool, num_threads) : gd_entry(task);
   solving_time += (getTimeStamp() - start);
+  unpin_all();
   if (res) {
     DEBUGF("solved\n");
     out_size = in_size;
@@ -175,9 +318,19 @@ void JITSolver::print_stats(int fd) {
   dprintf(fd, "JIT solver stats:\n");
   dprintf(fd, "  cache hits: %lu\n", cache_hits.load());
   dprintf(fd, "  cache misses: %lu\n", cache_misses.load());
+  dprintf(fd, "  cache evictions: %lu\n", cache_evictions.load());
+  dprintf(fd, "  interpreter hits: %lu\n", interp_hits.load());
+  if (auto *oc = JIT->getObjectCache()) {
+    dprintf(fd, "  object cache hits: %lu\n", oc->getHits());
+    dprintf(fd, "  object cache misses: %lu\n", oc->getMisses());
+  }
+  dprintf(fd, "  num tasks: %lu\n", num_tasks.load());
   dprintf(fd, "  num solved: %lu\n", num_solved.load());
   dprintf(fd, "  num timeout: %lu\n", num_timeout.load());
   dprintf(fd, "  process time: %lu\n", process_time.load());
   dprintf(fd, "  jit  time: %lu\n", jit_time.load());
+  dprintf(fd, "  jit batches: %lu\n", jit_batches.load());
+  if (jit_batches.load())
+    dprintf(fd, "  jit time per batch: %lu\n", jit_time.load() / jit_batches.load());
   dprintf(fd, "  solving time: %lu\n", solving_time.load());
 }
@@ -240,7 +240,7 @@ z3::expr Z3Solver::serialize_rel(uint32_t comparison,
 }
 
 static inline void extract_model(z3::model &m, uint8_t *buf, size_t buf_size,
-                                 std::unordered_map<size_t, uint8_t> &solution) {
+                                 OffsetMap<uint8_t> &solution) {
   unsigned num_constants = m.num_consts();
   for (unsigned i = 0; i< num_constants; i++) {
     z3::func_decl decl = m.get_const_decl(i);
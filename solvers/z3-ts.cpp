@@ -2,6 +2,8 @@
 
 #include "parse-z3.h"
 
+#include <algorithm>
+#include <string>
 #include <unordered_map>
 #include <unordered_set>
 #include <utility>
@@ -9,8 +11,10 @@
 
 using namespace symsan;
 
+static const std::string kTrackPrefix = "track-";
+
 Z3AstParser::Z3AstParser(void *base, size_t size, z3::context &context)
-  : ASTParser(base, size), context_(context) {
+  : ASTParser(base, size), context_(context), index_enum_limit_(0) {
     input_name_format = "input-%u-%u";
     atoi_name_format = "atoi-%u-%u-%d";
   }
@@ -19,9 +23,11 @@ int Z3AstParser::restart(std::vector<input_t> &inputs) {
 
   // reset caches
   memcmp_cache_.clear();
+  memcmp_content_.clear();
   tsize_cache_.clear();
   deps_cache_.clear();
   expr_cache_.clear();
+  enum_tasks_.clear();
   branch_deps_.clear();
   branch_deps_.resize(inputs.size());
 
@@ -303,8 +309,23 @@ void Z3AstParser::construct_index_tasks(z3::expr &index, uint64_t curr,
 
   std::shared_ptr<z3_task_t> task = nullptr;
 
-  // enumerate indices
-  if (enum_index) {
+  // enumerate indices with a single incremental solver
+  if (enum_index && index_enum_limit_ > 0 && ub > lb) {
+    z3::expr l = context_.bv_val(lb, 64);
+    z3::expr u = context_.bv_val(ub, 64);
+    z3::expr c = context_.bv_val(curr, 64);
+    z3::expr e = z3::uge(index, l) && z3::ult(index, u) && index != c;
+    if (step > 1) {
+      z3::expr s = context_.bv_val(step, 64);
+      e = e && z3::urem(index - l, s) == context_.bv_val(0, 64);
+    }
+    task = std::make_shared<z3_task_t>();
+    task->push_back(e);
+    task->insert(task->end(), nested.begin(), nested.end());
+    uint64_t tid = save_task(task);
+    enum_tasks_.insert({tid, index});
+    tasks.push_back(tid);
+  } else if (enum_index) {
     for (uint64_t i = lb; i < ub; i += step) {
       if (i == curr) continue;
       z3::expr idx = context_.bv_val(i, 64);
@@ -483,6 +504,8 @@ size_t Z3AstParser::add_nested_constraints(input_dep_set_t &inputs, z3_task_t *t
 Z3ParserSolver::solving_status
 Z3ParserSolver::solve_task(uint64_t task_id, unsigned timeout, solution_t &solutions) {
   solving_status ret = unknown_error;
+  // an enumeration task solved this way yields a single index
+  enum_tasks_.erase(task_id);
   auto task = retrieve_task(task_id);
   if (task == nullptr) {
     return invalid_task;
@@ -502,19 +525,54 @@ Z3ParserSolver::solve_task(uint64_t task_id, unsigned timeout, solution_t &solut
       z3::model m = solver.get_model();
       // check nested, if any
       if (task->size() > 1) {
-        solver.push();
-        // add nested constraints
-        for (size_t i = 1; i < task->size(); i++) {
-          solver.add(task->at(i));
-        }
-        res = solver.check();
-        if (res == z3::sat) {
-          ret = nested_sat;
-          m = solver.get_model();
-        } else if (res == z3::unsat) {
+        std::vector<z3::expr> nested;
+        size_t pruned = prune_nested(*task, nested);
+        if (nested.empty()) {
+          // all nested constraints conflict with the target
           ret = opt_sat_nested_unsat;
         } else {
-          ret = opt_sat_nested_timeout;
+          solver.push();
+          // add nested constraints, tracked so an unsat core can be extracted
+          std::vector<z3::expr> props;
+          std::unordered_map<unsigned, size_t> tracked;
+          for (size_t i = 0; i < nested.size(); i++) {
+            std::string name = kTrackPrefix + std::to_string(i);
+            z3::expr p = context_.bool_const(name.c_str());
+            solver.add(z3::implies(p, nested[i]));
+            props.push_back(p);
+            tracked.insert({p.id(), i});
+          }
+          // on conflict, drop one member of the core and check again
+          std::vector<bool> active(nested.size(), true);
+          for (unsigned round = 0;; round++) {
+            z3::expr_vector assumptions(context_);
+            for (size_t i = 0; i < props.size(); i++) {
+              if (active[i]) assumptions.push_back(props[i]);
+            }
+            res = solver.check(assumptions);
+            if (res == z3::sat) {
+              // with pruned constraints, the model is only closer to the path
+              ret = pruned ? opt_sat_nested_unsat : nested_sat;
+              m = solver.get_model();
+              break;
+            } else if (res != z3::unsat) {
+              ret = opt_sat_nested_timeout;
+              break;
+            }
+            ret = opt_sat_nested_unsat;
+            z3::expr_vector core = solver.unsat_core();
+            save_core(e, nested, core, tracked);
+            if (round == kMaxPruneRounds) break;
+            ssize_t last = -1;
+            for (unsigned i = 0; i < core.size(); i++) {
+              auto itr = tracked.find(core[i].id());
+              if (itr != tracked.end())
+                last = std::max(last, (ssize_t)itr->second);
+            }
+            if (last < 0) break; // no nested constraint in the core
+            active[last] = false;
+            pruned++;
+          }
         }
       } else {
         ret = nested_sat; // XXX: upgrade to nested_sat?
@@ -534,6 +592,148 @@ Z3ParserSolver::solve_task(uint64_t task_id, unsigned timeout, solution_t &solut
   return ret;
 }
 
+Z3ParserSolver::solving_status
+Z3ParserSolver::solve_task(uint64_t task_id, unsigned timeout,
+                           std::vector<solution_t> &solutions) {
+  auto itr = enum_tasks_.find(task_id);
+  if (itr == enum_tasks_.end()) {
+    solution_t solution;
+    solving_status ret = solve_task(task_id, timeout, solution);
+    if (solution.size() != 0) {
+      solutions.push_back(std::move(solution));
+    }
+    return ret;
+  }
+
+  z3::expr index = itr->second;
+  enum_tasks_.erase(itr);
+  auto task = retrieve_task(task_id);
+  if (task == nullptr) {
+    return invalid_task;
+  }
+
+  solving_status ret = unknown_error;
+  try {
+    z3::solver solver(context_, "QF_BV");
+    solver.set("timeout", timeout);
+    // the range of the index (optimistic)
+    solver.add(task->at(0));
+    z3::check_result res = solver.check();
+    if (res == z3::unsat) {
+      return opt_unsat;
+    } else if (res != z3::sat) {
+      return opt_timeout;
+    }
+    ret = nested_sat;
+    if (task->size() > 1) {
+      // the nested constraints are shared by all indices, assert them once
+      solver.push();
+      for (size_t i = 1; i < task->size(); i++) {
+        solver.add(task->at(i));
+      }
+      if (enumerate_index(solver, index, index_enum_limit_, solutions, res) > 0) {
+        return nested_sat;
+      }
+      ret = res == z3::unsat ? opt_sat_nested_unsat : opt_sat_nested_timeout;
+      solver.pop();
+    }
+    // same as the per-index tasks, fall back to optimistic solutions
+    enumerate_index(solver, index, index_enum_limit_, solutions, res);
+  } catch (z3::exception ze) {
+    ret = unknown_error;
+  }
+
+  return ret;
+}
+
+size_t Z3ParserSolver::prune_nested(z3_task_t &task, std::vector<z3::expr> &nested) {
+  nested.assign(task.begin() + 1, task.end());
+  auto itr = core_index_.find(task[0].id());
+  if (itr == core_index_.end()) {
+    return 0;
+  }
+
+  // position of each nested constraint, later ones are added more recently
+  std::unordered_map<unsigned, size_t> pos;
+  for (size_t i = 0; i < nested.size(); i++) {
+    pos.insert({nested[i].id(), i});
+  }
+  // a core is broken by dropping one of its members, drop the most recent
+  // one of each core that is still complete
+  std::vector<bool> dropped(nested.size(), false);
+  size_t pruned = 0;
+  for (size_t idx : itr->second) {
+    core_t &core = unsat_cores_[idx];
+    ssize_t last = -1;
+    for (size_t i = 1; i < core.size(); i++) {
+      auto p = pos.find(core[i].id());
+      if (p == pos.end() || dropped[p->second]) {
+        last = -1;
+        break;
+      }
+      last = std::max(last, (ssize_t)p->second);
+    }
+    if (last >= 0) {
+      dropped[last] = true;
+      pruned++;
+    }
+  }
+  if (pruned == 0) {
+    return 0;
+  }
+
+  core_hits_++;
+  size_t j = 0;
+  for (size_t i = 0; i < nested.size(); i++) {
+    if (!dropped[i]) nested[j++] = nested[i];
+  }
+  nested.erase(nested.begin() + j, nested.end());
+  return pruned;
+}
+
+void Z3ParserSolver::save_core(z3::expr &target, std::vector<z3::expr> &nested,
+                               z3::expr_vector const& core,
+                               std::unordered_map<unsigned, size_t> &tracked) {
+  // the target is not tracked but always part of the conflict
+  core_t c;
+  c.push_back(target);
+  for (unsigned i = 0; i < core.size(); i++) {
+    auto itr = tracked.find(core[i].id());
+    if (itr != tracked.end()) {
+      c.push_back(nested[itr->second]);
+    }
+  }
+  if (c.size() == 1) {
+    return;
+  }
+  if (unsat_cores_.size() >= kMaxUnsatCores) {
+    unsat_cores_.clear();
+    core_index_.clear();
+  }
+  core_index_[target.id()].push_back(unsat_cores_.size());
+  unsat_cores_.push_back(std::move(c));
+}
+
+size_t Z3ParserSolver::enumerate_index(z3::solver &solver, z3::expr &index,
+                                       uint32_t limit,
+                                       std::vector<solution_t> &solutions,
+                                       z3::check_result &res) {
+  size_t n = 0;
+  while (n < limit && (res = solver.check()) == z3::sat) {
+    z3::model m = solver.get_model();
+    z3::expr v = m.eval(index, true);
+    solution_t solution;
+    generate_solution(m, solution);
+    if (solution.size() != 0) {
+      solutions.push_back(std::move(solution));
+    }
+    // block the index value, so the next model picks a different one
+    solver.add(index != v);
+    n++;
+  }
+  return n;
+}
+
 void Z3ParserSolver::generate_solution(z3::model &m, solution_t &solutions) {
   // from qsym
   unsigned num_constants = m.num_consts();
@@ -550,6 +750,9 @@ void Z3ParserSolver::generate_solution(z3::model &m, solution_t &solutions) {
         sscanf(name.str().c_str(), input_name_format, &input, &offset);
         uint8_t value = (uint8_t)e.get_numeral_int();
         solutions.push_back({input, offset, value});
+      } else if (name.str().find(kTrackPrefix) == 0) {
+        // tracking literals of nested constraints
+        continue;
       } else if (!name.str().compare("fsize")) {
         // FIXME:
         // off_t size = (off_t)e.get_numeral_int64();
@@ -204,8 +204,13 @@ __taint_trace_gep(dfsan_label ptr_label, uint64_t ptr, dfsan_label index_label,
   }
 
   for (auto id : tasks) {
-    // solve
-    if (__solve_task(id)) {
+    // solve, an enumeration task may produce multiple inputs
+    std::vector<symsan::Z3ParserSolver::solution_t> solutions;
+    __z3_parser->solve_task(id, 5000U, solutions);
+    for (auto &solution : solutions) {
+      generate_input(solution);
+    }
+    if (solutions.size() != 0) {
       AOUT("gep solved\n");
     } else {
       AOUT("gep not solvable @%p\n", addr);
@@ -238,6 +243,8 @@ extern "C" void InitializeSolver() {
   __instance_id = flags().instance_id;
   __session_id = flags().session_id;
   __z3_parser = new symsan::Z3ParserSolver((void*)UnionTableAddr(), uniontable_size, __z3_context);
+  if (flags().gep_enum_limit > 0)
+    __z3_parser->set_index_enum_limit(flags().gep_enum_limit);
   std::vector<symsan::input_t> inputs;
   inputs.push_back({(u8*)tainted.buf, tainted.size});
   __z3_parser->restart(inputs);
@@ -0,0 +1,80 @@
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: python -c'print("A"*20)' > %t.bin
+// RUN: python -c'print("0x0-0x7fffffffffffffff")' > %t.all
+// RUN: python -c'print("# nothing selected")' > %t.none
+// RUN: clang -o %t.uninstrumented %s
+// RUN: %t.uninstrumented %t.bin | FileCheck --check-prefix=CHECK-ORIG %s
+// RUN: env KO_USE_FASTGEN=1 %ko-clang -o %t.fg %s
+// RUN: nm -S %t.fg > %t.syms
+// RUN: python -c'import sys; f = [l.split() for l in open(sys.argv[1])]; a, n = [(int(x[0], 16), int(x[1], 16)) for x in f if len(x) == 4 and x[3].endswith("check_y")][0]; print(hex(a) + "-" + hex(a + n))' %t.syms > %t.narrow
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out branch_filter=%t.all" %fgtest %t.fg %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN1 %s
+// RUN: %t.uninstrumented %t.out/id-0-0-1 | FileCheck --check-prefix=CHECK-GEN2 %s
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out branch_filter=%t.all branch_filter_deny=1" %fgtest %t.fg %t.bin | FileCheck --check-prefix=CHECK-SILENT %s
+// RUN: not test -e %t.out/id-0-0-0
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out branch_filter=%t.none" %fgtest %t.fg %t.bin | FileCheck --check-prefix=CHECK-SILENT %s
+// RUN: not test -e %t.out/id-0-0-0
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out branch_filter=%t.narrow" %fgtest %t.fg %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN2 %s
+// RUN: not test -e %t.out/id-0-0-1
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out branch_filter=%t.narrow branch_filter_deny=1" %fgtest %t.fg %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN1 %s
+// RUN: not test -e %t.out/id-0-0-1
+
+// CHECK-SILENT-NOT: branch solved
+
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include "lib.h"
+
+// the narrow filter is the address range of check_y, relative to the
+// load base, so it has to match under ASLR as well
+int __attribute__ ((noinline)) check_x(uint32_t x) {
+  if (x == 0x12345678) return 1;
+  return 0;
+}
+
+int __attribute__ ((noinline)) check_y(uint32_t y) {
+  if (y == 0x87654321) return 1;
+  return 0;
+}
+
+int main (int argc, char** argv) {
+  if (argc < 2) {
+    fprintf(stderr, "Usage: %s [file]\n", argv[0]);
+    return -1;
+  }
+
+  char buf[20];
+  FILE* fp = chk_fopen(argv[1], "rb");
+  chk_fread(buf, 1, sizeof(buf), fp);
+  fclose(fp);
+
+  uint32_t x = 0;
+  uint32_t y = 0;
+  memcpy(&x, buf, 4);
+  memcpy(&y, buf + 8, 4);
+
+  int good = 0;
+  if (check_x(x)) {
+    // CHECK-GEN1: Good1
+    printf("Good1\n");
+    good = 1;
+  }
+  if (check_y(y)) {
+    // CHECK-GEN2: Good2
+    printf("Good2\n");
+    good = 1;
+  }
+  if (!good) {
+    // CHECK-ORIG: Bad
+    printf("Bad\n");
+  }
+}
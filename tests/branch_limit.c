@@ -0,0 +1,52 @@
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: python -c'print("A"*20)' > %t.bin
+// RUN: clang -o %t.uninstrumented %s
+// RUN: %t.uninstrumented %t.bin | FileCheck --check-prefix=CHECK-ORIG %s
+// RUN: env KO_USE_FASTGEN=1 %ko-clang -o %t.fg %s
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out" %fgtest %t.fg %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN0 %s
+// RUN: %t.uninstrumented %t.out/id-0-0-1 | FileCheck --check-prefix=CHECK-GEN1 %s
+// RUN: %t.uninstrumented %t.out/id-0-0-2 | FileCheck --check-prefix=CHECK-GEN2 %s
+// RUN: %t.uninstrumented %t.out/id-0-0-3 | FileCheck --check-prefix=CHECK-GEN3 %s
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out branch_emit_limit=2" %fgtest %t.fg %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN0 %s
+// RUN: %t.uninstrumented %t.out/id-0-0-1 | FileCheck --check-prefix=CHECK-GEN1 %s
+// RUN: not test -e %t.out/id-0-0-2
+
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include "lib.h"
+
+int main (int argc, char** argv) {
+  if (argc < 2) {
+    fprintf(stderr, "Usage: %s [file]\n", argv[0]);
+    return -1;
+  }
+
+  char buf[20];
+  FILE* fp = chk_fopen(argv[1], "rb");
+  chk_fread(buf, 1, sizeof(buf), fp);
+  fclose(fp);
+
+  // the same branch in the same context, hit once per byte
+  int hits = 0;
+  for (int i = 0; i < 4; i++) {
+    if (buf[i] == 'a' + i) {
+      // CHECK-GEN0: Hit 0
+      // CHECK-GEN1: Hit 1
+      // CHECK-GEN2: Hit 2
+      // CHECK-GEN3: Hit 3
+      printf("Hit %d\n", i);
+      hits++;
+    }
+  }
+
+  if (hits == 0) {
+    // CHECK-ORIG: Bad
+    printf("Bad\n");
+  }
+}
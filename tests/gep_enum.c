@@ -0,0 +1,40 @@
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: python -c'print("\x00\x00\x00\x00")' > %t.bin
+// RUN: clang -o %t.uninstrumented %s
+// RUN: %t.uninstrumented %t.bin | FileCheck --check-prefix=CHECK-ORIG %s
+// RUN: env KO_USE_FASTGEN=1 %ko-clang -o %t.fg %s
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out gep_enum_limit=4" %fgtest %t.fg %t.bin | FileCheck --check-prefix=CHECK-ENUM %s
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN %s
+// RUN: %t.uninstrumented %t.out/id-0-0-1 | FileCheck --check-prefix=CHECK-GEN %s
+
+// a single enumeration task yields several indices
+// CHECK-ENUM: generate #0 output
+// CHECK-ENUM-NOT: gep solved
+// CHECK-ENUM: generate #1 output
+// CHECK-ENUM: gep solved
+
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include "lib.h"
+
+int main (int argc, char** argv) {
+  if (argc < 2) {
+    fprintf(stderr, "Usage: %s [file]\n", argv[0]);
+    return -1;
+  }
+
+  uint8_t index = 0;
+  int table[4] = {1, 2, 3, 4};
+
+  FILE* fp = chk_fopen(argv[1], "rb");
+  chk_fread(&index, 1, sizeof(index), fp);
+  fclose(fp);
+
+  // no tainted branch, all inputs come from the GEP
+  // CHECK-ORIG: Value 1
+  // CHECK-GEN: Value
+  printf("Value %d\n", table[index & 3]);
+}
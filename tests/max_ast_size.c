@@ -0,0 +1,47 @@
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: python -c'print("A"*20)' > %t.bin
+// RUN: clang -o %t.uninstrumented %s
+// RUN: %t.uninstrumented %t.bin | FileCheck --check-prefix=CHECK-ORIG %s
+// RUN: env KO_USE_FASTGEN=1 %ko-clang -o %t.fg %s
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out max_ast_size=16" %fgtest %t.fg %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN %s
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out max_ast_size=1" %fgtest %t.fg %t.bin 2>&1 | FileCheck --check-prefix=CHECK-DROP %s
+// RUN: not test -e %t.out/id-0-0-0
+// RUN: env KO_USE_Z3=1 %ko-clang -o %t.z3 %s
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out max_ast_size=1" %t.z3 %t.bin
+// RUN: not test -e %t.out/id-0-0-0
+
+// the comparison alone is larger than a single node, so it is dropped
+// CHECK-DROP: AST too large
+
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include "lib.h"
+
+int main (int argc, char** argv) {
+  if (argc < 2) {
+    fprintf(stderr, "Usage: %s [file]\n", argv[0]);
+    return -1;
+  }
+
+  char buf[20];
+  FILE* fp = chk_fopen(argv[1], "rb");
+  chk_fread(buf, 1, sizeof(buf), fp);
+  fclose(fp);
+
+  uint32_t x = 0;
+  memcpy(&x, buf, 4);
+
+  if (x == 0x12345678) {
+    // CHECK-GEN: Good
+    printf("Good\n");
+  } else {
+    // CHECK-ORIG: Bad
+    printf("Bad\n");
+  }
+}
@@ -0,0 +1,55 @@
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: python -c'print("A"*20)' > %t.bin
+// RUN: clang -o %t.uninstrumented %s
+// RUN: %t.uninstrumented %t.bin | FileCheck --check-prefix=CHECK-ORIG %s
+// RUN: env KO_USE_FASTGEN=1 %ko-clang -o %t.fg %s
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out dedup_memcmp=1" %fgtest %t.fg %t.bin 2>&1 | FileCheck --check-prefix=CHECK-REF %s
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN1 %s
+// RUN: %t.uninstrumented %t.out/id-0-0-1 | FileCheck --check-prefix=CHECK-GEN2 %s
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out dedup_memcmp=0" %fgtest %t.fg %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN1 %s
+// RUN: %t.uninstrumented %t.out/id-0-0-1 | FileCheck --check-prefix=CHECK-GEN2 %s
+
+// the second memcmp only references the content of the first one
+// CHECK-REF-NOT: Unknown memcmp content hash
+
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include "lib.h"
+
+int main(int argc, char **argv) {
+  if (argc < 2) {
+    fprintf(stderr, "Usage: %s [file]\n", argv[0]);
+    return -1;
+  }
+
+  char buf[20];
+  FILE* fp = chk_fopen(argv[1], "rb");
+  chk_fread(buf, 1, sizeof(buf), fp);
+  fclose(fp);
+
+  char b[10] = {1, 1, 1, 1, 1, 2, 3, 4, 5, 0};
+  int good = 0;
+
+  if (memcmp(b, buf, 9) == 0) {
+    // CHECK-GEN1: Good1
+    printf("Good1\n");
+    good = 1;
+  }
+
+  if (memcmp(b, buf + 10, 9) == 0) {
+    // CHECK-GEN2: Good2
+    printf("Good2\n");
+    good = 1;
+  }
+
+  if (!good) {
+    // CHECK-ORIG: Bad
+    printf("Bad\n");
+  }
+}
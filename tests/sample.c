@@ -0,0 +1,61 @@
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: python -c'print("A"*20)' > %t.bin
+// RUN: clang -o %t.uninstrumented %s
+// RUN: %t.uninstrumented %t.bin | FileCheck --check-prefix=CHECK-ORIG %s
+// RUN: env KO_USE_FASTGEN=1 %ko-clang -o %t.fg %s
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out sample_first=1" %fgtest %t.fg %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN1 %s
+// RUN: not test -e %t.out/id-0-0-1
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out sample_permille=1000" %fgtest %t.fg %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN1 %s
+// RUN: %t.uninstrumented %t.out/id-0-0-1 | FileCheck --check-prefix=CHECK-GEN2 %s
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out sample_permille=500" %fgtest %t.fg %t.bin > %t.run1
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out sample_permille=500" %fgtest %t.fg %t.bin > %t.run2
+// RUN: diff %t.run1 %t.run2
+
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include "lib.h"
+
+int main (int argc, char** argv) {
+  if (argc < 2) {
+    fprintf(stderr, "Usage: %s [file]\n", argv[0]);
+    return -1;
+  }
+
+  char buf[20];
+  FILE* fp = chk_fopen(argv[1], "rb");
+  chk_fread(buf, 1, sizeof(buf), fp);
+  fclose(fp);
+
+  uint32_t x = 0;
+  uint32_t y = 0;
+
+  memcpy(&x, buf, 4);
+  memcpy(&y, buf + 8, 4);
+
+  if (x == 0x12345678) {
+    // CHECK-GEN1: Good1
+    printf("Good1\n");
+  }
+
+  // sample_first=1 only admits the first branch
+  if (y == 0x87654321) {
+    // CHECK-GEN2: Good2
+    printf("Good2\n");
+  }
+
+  if (x != 0x12345678 && y != 0x87654321) {
+    // CHECK-ORIG: Bad
+    printf("Bad\n");
+  }
+}
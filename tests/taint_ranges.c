@@ -0,0 +1,58 @@
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: python -c'print("A"*20)' > %t.bin
+// RUN: clang -o %t.uninstrumented %s
+// RUN: %t.uninstrumented %t.bin | FileCheck --check-prefix=CHECK-ORIG %s
+// RUN: env KO_USE_FASTGEN=1 %ko-clang -o %t.fg %s
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out taint_ranges=8-12" %fgtest %t.fg %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN %s
+// RUN: not test -e %t.out/id-0-0-1
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: python -c'import sys; sys.stdout.write("\0"*8 + "\1"*4)' > %t.mask
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out taint_mask=%t.mask" %fgtest %t.fg %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN %s
+// RUN: not test -e %t.out/id-0-0-1
+// RUN: rm -rf %t.out
+// RUN: mkdir -p %t.out
+// RUN: env KO_USE_Z3=1 %ko-clang -o %t.z3 %s
+// RUN: env TAINT_OPTIONS="taint_file=%t.bin output_dir=%t.out taint_ranges=8-12" %t.z3 %t.bin
+// RUN: %t.uninstrumented %t.out/id-0-0-0 | FileCheck --check-prefix=CHECK-GEN %s
+// RUN: not test -e %t.out/id-0-0-1
+
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include "lib.h"
+
+int main (int argc, char** argv) {
+  if (argc < 2) {
+    fprintf(stderr, "Usage: %s [file]\n", argv[0]);
+    return -1;
+  }
+
+  char buf[20];
+  FILE* fp = chk_fopen(argv[1], "rb");
+  chk_fread(buf, 1, sizeof(buf), fp);
+  fclose(fp);
+
+  uint32_t x = 0;
+  uint32_t y = 0;
+
+  memcpy(&x, buf, 4);     // x 0 - 3, not tainted
+  memcpy(&y, buf + 8, 4); // y 8 - 11, tainted
+
+  // CHECK-GEN-NOT: Good1
+  if (x == 0x12345678) {
+    printf("Good1\n");
+  }
+
+  if (y == 0x87654321) {
+    // CHECK-GEN: Good2
+    printf("Good2\n");
+  } else {
+    // CHECK-ORIG: Bad
+    printf("Bad\n");
+  }
+}